@@ -0,0 +1,84 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class BoundedCache(Generic[K, V]):
+    """
+    A dict that holds at most max_size items and can drop the ones that haven't been used for idle_seconds.
+    Either limit can be None to disable it. Nothing is evicted implicitly: put() and evict_idle() return
+    what was evicted so that the caller can clean it up.
+    """
+
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        idle_seconds: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self._clock = clock
+        # Least recently used first, along with when each item was last used
+        self._items: "OrderedDict[K, Tuple[V, float]]" = OrderedDict()
+
+    def get(self, key: K) -> Optional[V]:
+        """
+        Get an item and mark it as used.
+        """
+        item = self._items.get(key)
+        if item is None:
+            return None
+        self._items[key] = (item[0], self._clock())
+        self._items.move_to_end(key)
+        return item[0]
+
+    def put(self, key: K, value: V) -> List[Tuple[K, V]]:
+        """
+        Add or replace an item and mark it as used. Returns the least recently used items that were evicted
+        to make room for it.
+        """
+        self._items[key] = (value, self._clock())
+        self._items.move_to_end(key)
+        evicted: List[Tuple[K, V]] = []
+        while self.max_size is not None and len(self._items) > self.max_size:
+            oldest, (oldest_value, _) = self._items.popitem(last=False)
+            evicted.append((oldest, oldest_value))
+        return evicted
+
+    def evict_idle(self) -> List[Tuple[K, V]]:
+        """
+        Remove and return every item that hasn't been used for idle_seconds.
+        """
+        evicted: List[Tuple[K, V]] = []
+        if self.idle_seconds is None:
+            return evicted
+
+        cutoff = self._clock() - self.idle_seconds
+        # Items are ordered by when they were last used so this can stop at the first recent one
+        while self._items:
+            key, (value, last_used) = next(iter(self._items.items()))
+            if last_used > cutoff:
+                break
+            del self._items[key]
+            evicted.append((key, value))
+        return evicted
+
+    def pop(self, key: K) -> Optional[V]:
+        item = self._items.pop(key, None)
+        return None if item is None else item[0]
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def items(self) -> List[Tuple[K, V]]:
+        return [(key, value) for key, (value, _) in self._items.items()]
+
+    def values(self) -> List[V]:
+        return [value for value, _ in self._items.values()]
@@ -0,0 +1,52 @@
+from typing import List
+
+from .cache_util import BoundedCache
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_evicts_least_recently_used() -> None:
+    cache: BoundedCache[str, int] = BoundedCache(max_size=2)
+    assert cache.put("a", 1) == []
+    assert cache.put("b", 2) == []
+    assert cache.get("a") == 1
+
+    assert cache.put("c", 3) == [("b", 2)]
+    assert cache.items() == [("a", 1), ("c", 3)]
+    # Replacing an item doesn't count against the limit
+    assert cache.put("a", 4) == []
+    assert cache.values() == [3, 4]
+
+
+def test_evicts_idle() -> None:
+    clock = _Clock()
+    cache: BoundedCache[str, int] = BoundedCache(idle_seconds=10, clock=clock)
+    cache.put("a", 1)
+    clock.now = 5
+    cache.put("b", 2)
+    clock.now = 9
+    cache.get("a")
+
+    clock.now = 16
+    assert cache.evict_idle() == [("b", 2)]
+    assert "a" in cache
+    clock.now = 19
+    assert cache.evict_idle() == [("a", 1)]
+    assert len(cache) == 0
+
+
+def test_unbounded() -> None:
+    cache: BoundedCache[int, int] = BoundedCache()
+    evicted: List[object] = []
+    for i in range(100):
+        evicted += cache.put(i, i)
+    assert evicted == []
+    assert cache.evict_idle() == []
+    assert cache.pop(5) == 5
+    assert len(cache) == 99
@@ -0,0 +1,200 @@
+import importlib.util
+import zlib
+from typing import Any, Iterator, List, Optional, Set
+
+GZIP = "gzip"
+ZSTD = "zstd"
+LZ4 = "lz4"
+
+# Decompressed output is produced in pieces of this size when only the start of the data is needed
+_CHUNK_SIZE = 64 * 1024
+
+# zstd decompressors can't be asked for a limited amount of output, so streamed zstd data is fed to them in
+# pieces this small. A zstd block can expand by at most 128KB for every 4 bytes, so each piece's output is at
+# most 32MB.
+_ZSTD_INPUT_SIZE = 1024
+
+# A few kilobytes can decompress to gigabytes, so decompress refuses to produce more than this by default
+MAX_DECOMPRESSED_BYTES = 1024 * 1024 * 1024
+
+
+class DecompressedSizeError(Exception):
+    """
+    The data decompresses to more than the limit that was passed to decompress.
+    """
+
+
+def supported_encodings() -> Set[str]:
+    """
+    The Content-Encodings that can be decompressed here. gzip is always available, zstd and lz4 need the
+    zstandard and lz4 packages.
+    """
+    encodings = {GZIP}
+    if importlib.util.find_spec("zstandard") is not None:
+        encodings.add(ZSTD)
+    if importlib.util.find_spec("lz4") is not None:
+        encodings.add(LZ4)
+    return encodings
+
+
+def decompressor(encoding: str) -> Any:
+    """
+    An object with a decompress(data) method that takes the compressed data a piece at a time and returns
+    whatever can be decompressed so far.
+    """
+    if encoding == GZIP:
+        # Only accept the gzip wrapper, not raw zlib streams
+        return zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    elif encoding == ZSTD:
+        import zstandard  # Optional dependency, only needed for zstd requests
+
+        return zstandard.ZstdDecompressor().decompressobj()
+    elif encoding == LZ4:
+        import lz4.frame  # Optional dependency, only needed for lz4 requests
+
+        return lz4.frame.LZ4FrameDecompressor()
+    else:
+        raise Exception(f"Unsupported content encoding {encoding}")
+
+
+def decompress(data: bytes, encoding: Optional[str], max_length: Optional[int] = None) -> bytes:
+    """
+    Decompress data that was compressed with one of the supported Content-Encodings, or return it as is if
+    encoding is None. Raises DecompressedSizeError instead of producing more than max_length bytes, which
+    defaults to MAX_DECOMPRESSED_BYTES.
+    """
+    if encoding is None:
+        return data
+
+    if max_length is None:
+        max_length = MAX_DECOMPRESSED_BYTES
+
+    if encoding == ZSTD:
+        return _decompress_zstd(data, max_length)
+
+    stream = decompressor(encoding)
+    pieces: List[bytes] = []
+    total = 0
+    while True:
+        # Asking for one byte more than the limit is how to tell whether there was more
+        piece: bytes = stream.decompress(data, max_length + 1 - total)
+        pieces.append(piece)
+        total += len(piece)
+        if total > max_length:
+            raise DecompressedSizeError(f"Data decompresses to more than {max_length} bytes")
+        data = _next_member(stream, encoding)
+        if not data:
+            break
+        stream = decompressor(encoding)
+
+    if encoding == GZIP and not stream.eof:
+        raise Exception("Incomplete or truncated gzip data")
+    return pieces[0] if len(pieces) == 1 else b"".join(pieces)
+
+
+def _next_member(stream: Any, encoding: str) -> bytes:
+    """
+    What's left after a gzip or lz4 stream ends. Concatenated members are valid and the decompressors stop at
+    the end of the first one, so anything left is the next member. gzip also allows zeros between them.
+    """
+    if not stream.eof:
+        return b""
+    rest: bytes = stream.unused_data
+    return rest.lstrip(b"\0") if encoding == GZIP else rest
+
+
+def _decompress_zstd(data: bytes, max_length: int) -> bytes:
+    import zstandard  # Optional dependency, only needed for zstd requests
+
+    # Frames from one shot compressors say how large they are, and that's checked when they're decompressed
+    size = zstandard.frame_content_size(data)
+    if size > max_length:
+        raise DecompressedSizeError(f"Data decompresses to {size} bytes, more than {max_length}")
+    elif size >= 0:
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    # Streaming compressors don't record the size, so it's only known once enough has been decompressed
+    chunks = []
+    total = 0
+    for chunk in iter_decompressed(data, ZSTD):
+        total += len(chunk)
+        if total > max_length:
+            raise DecompressedSizeError(f"Data decompresses to more than {max_length} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def iter_decompressed(data: bytes, encoding: str) -> Iterator[bytes]:
+    """
+    Decompress data at most _CHUNK_SIZE bytes at a time, for when only the start of it is needed or its size
+    has to be checked along the way.
+    """
+    if encoding == ZSTD:
+        import zstandard  # Optional dependency, only needed for zstd requests
+
+        with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+            chunk: bytes = reader.read(_CHUNK_SIZE)
+            while chunk:
+                yield chunk
+                chunk = reader.read(_CHUNK_SIZE)
+        return
+
+    # Same as data that arrives a piece at a time, without the limit
+    yield from StreamDecompressor(encoding)._pieces(data)
+
+
+def _bounded_pieces(stream: Any, encoding: str, data: bytes) -> Iterator[bytes]:
+    """
+    Feed data to a gzip or lz4 decompressor and take the output out of it at most _CHUNK_SIZE bytes at a time.
+    """
+    chunk = stream.decompress(data, _CHUNK_SIZE)
+    while chunk:
+        yield chunk
+        if stream.eof:
+            # Anything after the end is in unused_data, zlib leaves it in unconsumed_tail too
+            break
+        if encoding == GZIP:
+            # zlib hands back the input it didn't get to, lz4 keeps it
+            chunk = stream.decompress(stream.unconsumed_tail, _CHUNK_SIZE)
+        else:
+            chunk = b"" if stream.needs_input else stream.decompress(b"", _CHUNK_SIZE)
+
+
+class StreamDecompressor:
+    """
+    Decompress data that arrives a piece at a time, like a request body that's being streamed. The output comes
+    back a piece at a time too and DecompressedSizeError is raised as soon as there's more than max_length of it,
+    which defaults to MAX_DECOMPRESSED_BYTES.
+    """
+
+    def __init__(self, encoding: str, max_length: Optional[int] = None) -> None:
+        self.encoding = encoding
+        self.max_length = MAX_DECOMPRESSED_BYTES if max_length is None else max_length
+        self.total = 0
+        self._stream = decompressor(encoding)
+
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        for chunk in self._pieces(data):
+            self.total += len(chunk)
+            if self.total > self.max_length:
+                raise DecompressedSizeError(f"Data decompresses to more than {self.max_length} bytes")
+            yield chunk
+
+    def _pieces(self, data: bytes) -> Iterator[bytes]:
+        if self.encoding != ZSTD:
+            while data:
+                if self._stream.eof:
+                    # The next member of concatenated data, which can start in a later piece than the last one ended
+                    data = data.lstrip(b"\0") if self.encoding == GZIP else data
+                    if not data:
+                        return
+                    self._stream = decompressor(self.encoding)
+                yield from _bounded_pieces(self._stream, self.encoding, data)
+                data = _next_member(self._stream, self.encoding)
+            return
+
+        view = memoryview(data)
+        for start in range(0, len(data), _ZSTD_INPUT_SIZE):
+            chunk: bytes = self._stream.decompress(view[start : start + _ZSTD_INPUT_SIZE])
+            if chunk:
+                yield chunk
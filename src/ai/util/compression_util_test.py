@@ -0,0 +1,166 @@
+import gzip
+import os
+from typing import Callable, Dict
+
+import pytest
+
+from .compression_util import (
+    _CHUNK_SIZE,
+    GZIP,
+    LZ4,
+    ZSTD,
+    DecompressedSizeError,
+    StreamDecompressor,
+    decompress,
+    iter_decompressed,
+    supported_encodings,
+)
+
+# Random hex doesn't compress much, so this takes several chunks to decompress
+_DATA = b'{"data": "' + os.urandom(200 * 1024).hex().encode() + b'"}'
+
+
+def test_gzip() -> None:
+    assert GZIP in supported_encodings()
+    assert decompress(gzip.compress(_DATA), GZIP) == _DATA
+
+
+def test_no_encoding() -> None:
+    assert decompress(_DATA, None) is _DATA
+
+
+def test_zstd() -> None:
+    zstandard = pytest.importorskip("zstandard")
+    assert ZSTD in supported_encodings()
+    assert decompress(zstandard.ZstdCompressor().compress(_DATA), ZSTD) == _DATA
+
+    # Streaming compressors don't record the decompressed size in the frame
+    compressor = zstandard.ZstdCompressor().compressobj()
+    streamed = compressor.compress(_DATA) + compressor.flush()
+    assert decompress(streamed, ZSTD) == _DATA
+
+
+def test_lz4() -> None:
+    lz4_frame = pytest.importorskip("lz4.frame")
+    assert LZ4 in supported_encodings()
+    assert decompress(lz4_frame.compress(_DATA), LZ4) == _DATA
+
+
+def test_iter_decompressed() -> None:
+    chunks = list(iter_decompressed(gzip.compress(_DATA), GZIP))
+    assert len(chunks) > 1
+    assert b"".join(chunks) == _DATA
+
+
+def test_corrupt_data() -> None:
+    with pytest.raises(Exception):
+        decompress(b"not gzip", GZIP)
+
+
+def _compressors() -> Dict[str, Callable[[bytes], bytes]]:
+    compressors: Dict[str, Callable[[bytes], bytes]] = {GZIP: gzip.compress}
+    if ZSTD in supported_encodings():
+        import zstandard
+
+        def zstd_streamed(data: bytes) -> bytes:
+            compressor = zstandard.ZstdCompressor().compressobj()
+            return compressor.compress(data) + compressor.flush()
+
+        compressors[ZSTD] = zstandard.ZstdCompressor().compress
+        compressors["zstd-streamed"] = zstd_streamed
+    if LZ4 in supported_encodings():
+        import lz4.frame
+
+        compressors[LZ4] = lz4.frame.compress
+    return compressors
+
+
+@pytest.mark.parametrize("name", ["gzip", "zstd", "zstd-streamed", "lz4"])
+def test_max_length(name: str) -> None:
+    compress = _compressors().get(name)
+    if compress is None:
+        pytest.skip(f"{name} isn't installed")
+    encoding = name.split("-")[0]
+    compressed = compress(_DATA)
+
+    assert decompress(compressed, encoding, max_length=len(_DATA)) == _DATA
+    with pytest.raises(DecompressedSizeError):
+        decompress(compressed, encoding, max_length=len(_DATA) - 1)
+
+    # Highly compressible data is where the limit matters, and it's checked without decompressing all of it
+    bomb = compress(bytes(100 * 1024 * 1024))
+    with pytest.raises(DecompressedSizeError):
+        decompress(bomb, encoding, max_length=1024 * 1024)
+
+
+@pytest.mark.parametrize("name", ["gzip", "zstd", "lz4"])
+def test_iter_decompressed_chunk_size(name: str) -> None:
+    compress = _compressors().get(name)
+    if compress is None:
+        pytest.skip(f"{name} isn't installed")
+
+    data = bytes(1024 * 1024) + _DATA
+    chunks = list(iter_decompressed(compress(data), name))
+    assert max(len(it) for it in chunks) <= _CHUNK_SIZE
+    assert b"".join(chunks) == data
+
+
+def test_truncated_gzip() -> None:
+    with pytest.raises(Exception):
+        decompress(gzip.compress(_DATA)[:-100], GZIP)
+
+
+@pytest.mark.parametrize("name", ["gzip", "zstd", "lz4"])
+def test_stream_decompressor(name: str) -> None:
+    compress = _compressors().get(name)
+    if compress is None:
+        pytest.skip(f"{name} isn't installed")
+
+    data = bytes(1024 * 1024) + _DATA
+    compressed = compress(data)
+    decompressor = StreamDecompressor(name)
+    chunks = [
+        chunk
+        for start in range(0, len(compressed), 1000)
+        for chunk in decompressor.decompress(compressed[start : start + 1000])
+    ]
+    assert b"".join(chunks) == data
+    assert decompressor.total == len(data)
+
+
+@pytest.mark.parametrize("name", ["gzip", "zstd", "lz4"])
+def test_stream_decompressor_max_length(name: str) -> None:
+    compress = _compressors().get(name)
+    if compress is None:
+        pytest.skip(f"{name} isn't installed")
+
+    decompressor = StreamDecompressor(name, max_length=1024 * 1024)
+    with pytest.raises(DecompressedSizeError):
+        for _ in decompressor.decompress(compress(bytes(100 * 1024 * 1024))):
+            pass
+    # It stops as soon as it's past the limit instead of decompressing everything it was given
+    assert decompressor.total < 40 * 1024 * 1024
+
+
+@pytest.mark.parametrize("name", ["gzip", "lz4"])
+def test_concatenated_members(name: str) -> None:
+    compress = _compressors().get(name)
+    if compress is None:
+        pytest.skip(f"{name} isn't installed")
+
+    # Like a file that was compressed a piece at a time, gzip also allows zeros between members
+    padding = bytes(10) if name == GZIP else b""
+    compressed = compress(_DATA) + padding + compress(b"second") + compress(b"third") + padding
+    data = _DATA + b"secondthird"
+
+    assert decompress(compressed, name) == data
+    assert b"".join(iter_decompressed(compressed, name)) == data
+    decompressor = StreamDecompressor(name)
+    assert b"".join(chunk for it in compressed for chunk in decompressor.decompress(bytes([it]))) == data
+
+    # Every member counts towards the limit
+    with pytest.raises(DecompressedSizeError):
+        decompress(compressed, name, max_length=len(data) - 1)
+    with pytest.raises(DecompressedSizeError):
+        for _ in StreamDecompressor(name, max_length=len(data) - 1).decompress(compressed):
+            pass
@@ -1,21 +1,63 @@
-from itertools import takewhile
-from typing import Any, List, Tuple, Type, Generator
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple, Type, TypeVar
 
+T = TypeVar("T")
+K = TypeVar("K", bound=Hashable)
 
-# TODO this should be available as an iterator. Kind of hard to use
-def get_like_items(items: List[Any]) -> Tuple[List[Any], Type, List[Any]]:
-    if not items:
-        return ([], type(None), items)
 
-    item_type = type(items[0])
-    matches = list(takewhile(lambda item: isinstance(item, item_type), items))
-    return (matches, item_type, items[len(matches) :])
+def partition_by_type(items: Iterable[T], is_barrier: Callable[[T], bool]) -> List[Tuple[List[T], Type]]:
+    """
+    Group items by type in a single pass, no matter how the types are interleaved. Barrier items keep their
+    place in the order: everything before a barrier ends up in a group before it and everything after it in
+    a group after it. Between barriers the groups are in the order that their types were first seen and
+    items keep their relative order. Consecutive barriers of the same type are grouped together.
 
+    is_barrier is only called for the first item of each type, so it has to depend on the type alone.
+    """
+    partitions: List[Tuple[List[T], Type]] = []
+    groups: Dict[Type, List[T]] = {}
+    barrier_types: Dict[Type, bool] = {}
+    current_type: Optional[Type] = None
+    current: List[T] = []
+    for item in items:
+        item_type = type(item)
+        # Runs of the same type are the common case, they skip all of the lookups
+        if item_type is current_type:
+            current.append(item)
+            continue
 
-def type_batched_items(items: List[Any]) -> Generator[Tuple[List[Any], Type], None, None]:
-    (matches, item_type, rest) = get_like_items(items)
-    yield (matches, item_type)
-    if not rest:
-        return
-    else:
-        yield from type_batched_items(rest)
+        barrier = barrier_types.get(item_type)
+        if barrier is None:
+            barrier = barrier_types[item_type] = is_barrier(item)
+
+        if barrier:
+            partitions.extend((group, group_type) for group_type, group in groups.items())
+            groups = {}
+            current = [item]
+            partitions.append((current, item_type))
+        else:
+            group = groups.get(item_type)
+            if group is None:
+                current = groups[item_type] = [item]
+            else:
+                current = group
+                current.append(item)
+        current_type = item_type
+
+    partitions.extend((group, group_type) for group_type, group in groups.items())
+    return partitions
+
+
+def group_by_key(items: Iterable[T], key: Callable[[T], K]) -> Dict[K, List[T]]:
+    """
+    Group items by key across the entire iterable. Unlike itertools.groupby this doesn't require
+    the items to be sorted, so items with the same key always end up in a single group. Groups are
+    in the order that their keys were first seen and items keep their relative order.
+    """
+    groups: Dict[K, List[T]] = {}
+    for item in items:
+        k = key(item)
+        if k in groups:
+            groups[k].append(item)
+        else:
+            groups[k] = [item]
+    return groups
@@ -0,0 +1,98 @@
+"""
+Compare the old recursive type_batched_items, an iterative version of it and partition_by_type on batches with
+adversarial interleavings of message types.
+
+Run with `python -m ai.util.list_util_bench` from the src directory.
+"""
+import random
+import time
+from itertools import takewhile
+from typing import Any, Callable, Generator, List, Sized, Tuple, Type
+
+from .list_util import partition_by_type
+
+
+class _Log:
+    pass
+
+
+class _Embeddings:
+    pass
+
+
+class _Arrow:
+    pass
+
+
+class _Publish:
+    pass
+
+
+def _recursive_type_batched_items(items: List[Any]) -> Generator[Tuple[List[Any], Type], None, None]:
+    # How type_batched_items used to work
+    if not items:
+        yield ([], type(None))
+        return
+    item_type = type(items[0])
+    matches = list(takewhile(lambda item: isinstance(item, item_type), items))
+    yield (matches, item_type)
+    rest = items[len(matches) :]
+    if rest:
+        yield from _recursive_type_batched_items(rest)
+
+
+def _iterative_type_batched_items(items: List[Any]) -> Generator[Tuple[List[Any], Type], None, None]:
+    if not items:
+        yield ([], type(None))
+        return
+    start = 0
+    item_type = type(items[0])
+    for i in range(1, len(items)):
+        if not isinstance(items[i], item_type):
+            yield (items[start:i], item_type)
+            start = i
+            item_type = type(items[i])
+    yield (items[start:], item_type)
+
+
+def _alternating(n: int) -> List[Any]:
+    return [_Log() if i % 2 == 0 else _Embeddings() for i in range(n)]
+
+
+def _random(n: int) -> List[Any]:
+    rng = random.Random(0)
+    return [rng.choice([_Log, _Embeddings, _Arrow])() for _ in range(n)]
+
+
+def _with_barriers(n: int) -> List[Any]:
+    # A publish message every 100 messages
+    return [_Publish() if i % 100 == 99 else (_Log() if i % 2 == 0 else _Embeddings()) for i in range(n)]
+
+
+def _single_type(n: int) -> List[Any]:
+    return [_Log() for _ in range(n)]
+
+
+def _time(name: str, items: List[Any], fn: Callable[[List[Any]], Sized], iterations: int = 3) -> None:
+    times: List[float] = []
+    partitions = 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        try:
+            partitions = len(fn(items))
+        except RecursionError:
+            print(f"  {name:<12} RecursionError")
+            return
+        times.append(time.perf_counter() - start)
+
+    print(f"  {name:<12} {min(times) * 1000:>9.2f}ms  {partitions} batches")
+
+
+if __name__ == "__main__":
+    for make in [_alternating, _random, _with_barriers, _single_type]:
+        for n in [1_000, 10_000, 50_000]:
+            items = make(n)
+            print(f"{make.__name__[1:]} x {n}")
+            _time("recursive", items, lambda it: list(_recursive_type_batched_items(it)))
+            _time("iterative", items, lambda it: list(_iterative_type_batched_items(it)))
+            _time("partition", items, lambda it: partition_by_type(it, lambda m: isinstance(m, _Publish)))
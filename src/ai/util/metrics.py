@@ -0,0 +1,268 @@
+import ctypes
+import pickle
+import struct
+import threading
+from bisect import bisect_left
+from dataclasses import dataclass, field, replace
+from multiprocessing import Lock
+from multiprocessing.sharedctypes import RawArray
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+# Responses add the charset to text content types
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+LATENCY_BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0]
+SIZE_BUCKETS = [1.0, 10.0, 100.0, 1_000.0, 10_000.0, 100_000.0, 1_000_000.0]
+BYTE_BUCKETS = [1024.0 * 2**it for it in range(0, 21, 2)]  # 1KB to 1GB
+
+# The value that label values past a label's limit are combined under
+OTHER_LABEL_VALUE = "other"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+@dataclass
+class Histogram:
+    buckets: List[float]
+    # One count per bucket plus one for everything above the last bucket. These aren't cumulative.
+    counts: List[int]
+    sum: float = 0.0
+    count: int = 0
+
+    @staticmethod
+    def empty(buckets: List[float]) -> "Histogram":
+        return Histogram(buckets=buckets, counts=[0] * (len(buckets) + 1))
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+@dataclass
+class MetricFamily:
+    name: str
+    type: str  # counter, gauge or histogram
+    help: str
+    buckets: List[float] = field(default_factory=list)
+    samples: Dict[Labels, Union[float, Histogram]] = field(default_factory=dict)
+
+    def with_labels(self, labels: Dict[str, str]) -> "MetricFamily":
+        """
+        A copy of this family with extra labels on every sample.
+        """
+        extra = tuple(labels.items())
+        return replace(self, samples={key + extra: value for key, value in self.samples.items()})
+
+
+def _to_labels(labels: Optional[Dict[str, str]]) -> Labels:
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _as_float(value: Union[float, Histogram]) -> float:
+    if isinstance(value, Histogram):
+        raise Exception("Expected a counter or gauge value, got a histogram")
+    return value
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms for a single process. Updates are thread safe since some of them
+    come from whylogs' logger threads.
+    """
+
+    def __init__(self) -> None:
+        self._families: Dict[str, MetricFamily] = {}
+        self._lock = threading.Lock()
+        self._label_limits: Dict[str, int] = {}
+        self._label_values: Dict[str, Set[str]] = {}
+
+    def limit_label(self, label: str, max_values: int) -> None:
+        """
+        Keep at most max_values distinct values of a label, like a dataset id that can take any number of them.
+        Samples with any other value are combined under OTHER_LABEL_VALUE so that the metrics stay bounded.
+        """
+        with self._lock:
+            self._label_limits[label] = max_values
+            self._label_values.setdefault(label, set())
+
+    def _key(self, labels: Optional[Dict[str, str]]) -> Labels:
+        # Called with the lock held
+        if labels and self._label_limits:
+            labels = {k: self._limit_value(k, v) for k, v in labels.items()}
+        return _to_labels(labels)
+
+    def _limit_value(self, label: str, value: str) -> str:
+        limit = self._label_limits.get(label)
+        if limit is None:
+            return value
+        values = self._label_values[label]
+        if value not in values:
+            if len(values) >= limit:
+                return OTHER_LABEL_VALUE
+            values.add(value)
+        return value
+
+    # Registering a family that already exists keeps the existing one and its samples.
+
+    def counter(self, name: str, help: str) -> None:
+        self._families.setdefault(name, MetricFamily(name=name, type="counter", help=help))
+
+    def gauge(self, name: str, help: str) -> None:
+        self._families.setdefault(name, MetricFamily(name=name, type="gauge", help=help))
+
+    def histogram(self, name: str, help: str, buckets: List[float] = LATENCY_BUCKETS) -> None:
+        self._families.setdefault(name, MetricFamily(name=name, type="histogram", help=help, buckets=buckets))
+
+    def inc(self, name: str, value: float = 1.0, labels: Optional[Dict[str, str]] = None) -> None:
+        with self._lock:
+            key = self._key(labels)
+            samples = self._families[name].samples
+            samples[key] = _as_float(samples.get(key, 0.0)) + value
+
+    def set(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        with self._lock:
+            self._families[name].samples[self._key(labels)] = value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        with self._lock:
+            key = self._key(labels)
+            family = self._families[name]
+            histogram = family.samples.get(key)
+            if not isinstance(histogram, Histogram):
+                histogram = Histogram.empty(family.buckets)
+                family.samples[key] = histogram
+            histogram.observe(value)
+
+    def serialize(self) -> bytes:
+        with self._lock:
+            return pickle.dumps(list(self._families.values()), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def deserialize(data: bytes) -> List[MetricFamily]:
+    families: List[MetricFamily] = pickle.loads(data)
+    return families
+
+
+# Sequence number and then the length of the data that follows
+_SNAPSHOT_SEQUENCE = struct.Struct("<Q")
+_SNAPSHOT_LENGTH = struct.Struct("<Q")
+_SNAPSHOT_HEADER_SIZE = _SNAPSHOT_SEQUENCE.size + _SNAPSHOT_LENGTH.size
+_SNAPSHOT_READ_ATTEMPTS = 100
+
+
+class SharedSnapshot:
+    """
+    A buffer in shared memory that one process publishes to and any number of processes read from
+    without locking. It's a seqlock: the sequence number is odd while a write is in progress, and readers
+    retry if it was odd or changed while they were copying. This has to be created before forking.
+    """
+
+    def __init__(self, size_bytes: int = 1024 * 1024) -> None:
+        self.capacity = size_bytes - _SNAPSHOT_HEADER_SIZE
+        self._buffer = RawArray(ctypes.c_ubyte, size_bytes)
+
+    def _view(self) -> memoryview:
+        return memoryview(self._buffer).cast("B")
+
+    def publish(self, data: bytes) -> bool:
+        """
+        Replace the snapshot. Returns False without changing it if the data doesn't fit.
+        """
+        if len(data) > self.capacity:
+            return False
+
+        view = self._view()
+        (sequence,) = _SNAPSHOT_SEQUENCE.unpack_from(view, 0)
+        _SNAPSHOT_SEQUENCE.pack_into(view, 0, sequence + 1)
+        _SNAPSHOT_LENGTH.pack_into(view, _SNAPSHOT_SEQUENCE.size, len(data))
+        view[_SNAPSHOT_HEADER_SIZE : _SNAPSHOT_HEADER_SIZE + len(data)] = data
+        _SNAPSHOT_SEQUENCE.pack_into(view, 0, sequence + 2)
+        return True
+
+    def read(self) -> Optional[bytes]:
+        """
+        The latest snapshot, or None if nothing has been published yet or it kept changing while reading.
+        """
+        view = self._view()
+        for _ in range(_SNAPSHOT_READ_ATTEMPTS):
+            (before,) = _SNAPSHOT_SEQUENCE.unpack_from(view, 0)
+            if before % 2 == 1:
+                continue
+            (length,) = _SNAPSHOT_LENGTH.unpack_from(view, _SNAPSHOT_SEQUENCE.size)
+            data = bytes(view[_SNAPSHOT_HEADER_SIZE : _SNAPSHOT_HEADER_SIZE + length])
+            (after,) = _SNAPSHOT_SEQUENCE.unpack_from(view, 0)
+            if before == after:
+                return data if before > 0 else None
+        return None
+
+
+class SharedHistogram:
+    """
+    A histogram in shared memory that any number of processes can observe values into, like the http
+    workers. This has to be created before forking.
+    """
+
+    def __init__(self, buckets: List[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        # Bucket counts, then the sum and the count
+        self._values = RawArray(ctypes.c_double, len(buckets) + 3)
+        self._lock = Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._values[bisect_left(self.buckets, value)] += 1
+            self._values[-2] += value
+            self._values[-1] += 1
+
+    def snapshot(self) -> Histogram:
+        with self._lock:
+            values = list(self._values)
+        return Histogram(
+            buckets=self.buckets, counts=[int(it) for it in values[:-2]], sum=values[-2], count=int(values[-1])
+        )
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = [(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def render_prometheus(families: Iterable[MetricFamily], namespace: Optional[str] = None) -> str:
+    """
+    Render metrics in the Prometheus text exposition format, with namespace as a prefix on every name.
+    Families with the same name, like the same metric from several processes, are rendered together.
+    """
+    by_name: Dict[str, List[MetricFamily]] = {}
+    for family in families:
+        name = f"{namespace}_{family.name}" if namespace else family.name
+        by_name.setdefault(name, []).append(family)
+
+    lines: List[str] = []
+    for name, group in by_name.items():
+        lines.append(f"# HELP {name} {group[0].help}")
+        lines.append(f"# TYPE {name} {group[0].type}")
+        for family in group:
+            for labels, value in family.samples.items():
+                if not isinstance(value, Histogram):
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(value.buckets + [float("inf")], value.counts):
+                    cumulative += count
+                    le = (("le", _format_value(bound)),)
+                    lines.append(f"{name}_bucket{_format_labels(labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value.sum)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value.count}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,95 @@
+import os
+
+from .metrics import OTHER_LABEL_VALUE, MetricsRegistry, SharedHistogram, SharedSnapshot, deserialize, render_prometheus
+
+
+def test_render_counter_and_histogram() -> None:
+    registry = MetricsRegistry()
+    registry.counter("rows_total", "Rows profiled")
+    registry.histogram("log_seconds", "Time to log", buckets=[0.1, 1.0])
+    registry.inc("rows_total", 10, labels={"dataset_id": "model-1"})
+    registry.inc("rows_total", 5, labels={"dataset_id": "model-1"})
+    registry.observe("log_seconds", 0.05)
+    registry.observe("log_seconds", 0.5)
+    registry.observe("log_seconds", 2)
+
+    families = [it.with_labels({"shard": "0"}) for it in deserialize(registry.serialize())]
+    assert render_prometheus(families).splitlines() == [
+        "# HELP rows_total Rows profiled",
+        "# TYPE rows_total counter",
+        'rows_total{dataset_id="model-1",shard="0"} 15',
+        "# HELP log_seconds Time to log",
+        "# TYPE log_seconds histogram",
+        'log_seconds_bucket{shard="0",le="0.1"} 1',
+        'log_seconds_bucket{shard="0",le="1"} 2',
+        'log_seconds_bucket{shard="0",le="+Inf"} 3',
+        'log_seconds_sum{shard="0"} 2.55',
+        'log_seconds_count{shard="0"} 3',
+    ]
+
+
+def test_render_merges_families() -> None:
+    registry = MetricsRegistry()
+    registry.gauge("depth", "Queue depth")
+    registry.set("depth", 3)
+    families = deserialize(registry.serialize())
+
+    text = render_prometheus([families[0].with_labels({"shard": "0"}), families[0].with_labels({"shard": "1"})])
+    assert text.count("# TYPE depth gauge") == 1
+    assert 'depth{shard="0"} 3' in text
+    assert 'depth{shard="1"} 3' in text
+
+
+def test_shared_snapshot() -> None:
+    snapshot = SharedSnapshot(size_bytes=64)
+    assert snapshot.read() is None
+    assert snapshot.publish(b"first")
+    assert snapshot.publish(b"second")
+    assert not snapshot.publish(b"x" * 64)
+    assert snapshot.read() == b"second"
+
+
+def test_shared_across_fork() -> None:
+    snapshot = SharedSnapshot(size_bytes=64)
+    histogram = SharedHistogram(buckets=[1.0])
+
+    pid = os.fork()
+    if pid == 0:
+        snapshot.publish(b"from child")
+        histogram.observe(0.5)
+        os._exit(0)
+    os.waitpid(pid, 0)
+    histogram.observe(2)
+
+    assert snapshot.read() == b"from child"
+    result = histogram.snapshot()
+    assert result.counts == [1, 1]
+    assert result.count == 2
+
+
+def test_render_namespace() -> None:
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests")
+    registry.inc("requests_total")
+
+    text = render_prometheus(deserialize(registry.serialize()), namespace="container")
+    assert text.splitlines()[-1] == "container_requests_total 1"
+
+
+def test_limit_label() -> None:
+    registry = MetricsRegistry()
+    registry.counter("rows_total", "Rows")
+    registry.histogram("upload_seconds", "Uploads")
+    registry.limit_label("dataset_id", 2)
+
+    for dataset_id in ["model-1", "model-2", "model-3", "model-4", "model-1"]:
+        registry.inc("rows_total", 1, {"dataset_id": dataset_id, "result": "ok"})
+        registry.observe("upload_seconds", 0.1, {"dataset_id": dataset_id})
+
+    families = {it.name: it for it in deserialize(registry.serialize())}
+    assert families["rows_total"].samples == {
+        (("dataset_id", "model-1"), ("result", "ok")): 2,
+        (("dataset_id", "model-2"), ("result", "ok")): 1,
+        (("dataset_id", OTHER_LABEL_VALUE), ("result", "ok")): 2,
+    }
+    assert len(families["upload_seconds"].samples) == 3
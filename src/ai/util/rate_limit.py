@@ -0,0 +1,87 @@
+import ctypes
+import hashlib
+import time
+from multiprocessing import Lock
+from multiprocessing.sharedctypes import RawArray
+from typing import Callable, Hashable
+
+_DEFAULT_MAX_BUCKETS = 64 * 1024
+# How many slots from a key's own one it can end up in. When they're all taken by other keys the least
+# recently used one is reused.
+_PROBES = 8
+
+
+def _key_hash(key: Hashable) -> int:
+    # Python's hash() isn't stable across processes, and 0 marks an empty slot
+    digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+
+class RateLimiter:
+    """
+    A token bucket per key. rate(key) is the tokens per second for a key, or 0 if it isn't limited, and each
+    bucket holds burst_seconds worth of tokens. Taking tokens is allowed as long as there are any left, even
+    if there aren't enough, which leaves the bucket in debt. That way something larger than the capacity
+    still gets through eventually and the average rate works out the same.
+
+    The buckets are in shared memory so that every process taking from them, like the http workers, enforces
+    the same limit. This has to be created before forking. There are at most max_buckets of them, a key whose
+    bucket was reused for another one starts over with a full bucket, same as if it hadn't sent anything in a
+    while.
+    """
+
+    def __init__(
+        self,
+        rate: Callable[[Hashable], float],
+        burst_seconds: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+        max_buckets: int = _DEFAULT_MAX_BUCKETS,
+    ) -> None:
+        self.rate = rate
+        self.burst_seconds = burst_seconds
+        self._clock = clock
+        self._keys = RawArray(ctypes.c_uint64, max_buckets)
+        self._tokens = RawArray(ctypes.c_double, max_buckets)
+        self._updated = RawArray(ctypes.c_double, max_buckets)
+        self._lock = Lock()
+
+    def take(self, key: Hashable, amount: float, force: bool = False) -> float:
+        """
+        Take amount tokens from key's bucket. Returns 0 if that's allowed, otherwise how many seconds to wait
+        before trying again. force takes them regardless, for the rest of something that was already let in.
+        """
+        rate = self.rate(key)
+        if rate <= 0:
+            return 0
+
+        capacity = rate * self.burst_seconds
+        key_hash = _key_hash(key)
+        with self._lock:
+            now = self._clock()
+            slot = self._slot(key_hash, capacity, now)
+            tokens = min(capacity, self._tokens[slot] + (now - self._updated[slot]) * rate)
+            self._updated[slot] = now
+            if tokens <= 0 and not force:
+                self._tokens[slot] = tokens
+                return -tokens / rate if tokens < 0 else 1 / rate
+            self._tokens[slot] = tokens - amount
+            return 0
+
+    def _slot(self, key_hash: int, capacity: float, now: float) -> int:
+        start = key_hash % len(self._keys)
+        oldest = start
+        for i in range(_PROBES):
+            slot = (start + i) % len(self._keys)
+            if self._keys[slot] == key_hash:
+                return slot
+            if self._keys[slot] == 0:
+                # Slots are only ever reused, never emptied, so the key isn't in any of the ones after this
+                oldest = slot
+                break
+            if self._updated[slot] < self._updated[oldest]:
+                oldest = slot
+
+        self._keys[oldest] = key_hash
+        self._tokens[oldest] = capacity
+        self._updated[oldest] = now
+        return oldest
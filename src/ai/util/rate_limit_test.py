@@ -0,0 +1,85 @@
+import os
+from typing import Hashable, List
+
+from .rate_limit import RateLimiter
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _limiter(clock: _Clock) -> RateLimiter:
+    def rate(key: Hashable) -> float:
+        return {"limited": 100.0}.get(str(key), 0)
+
+    return RateLimiter(rate, burst_seconds=2, clock=clock)
+
+
+def test_burst_then_rate() -> None:
+    clock = _Clock()
+    limiter = _limiter(clock)
+
+    # The bucket starts with 2 seconds worth
+    assert [limiter.take("limited", 50) for _ in range(4)] == [0, 0, 0, 0]
+    assert limiter.take("limited", 50) > 0
+
+    clock.now = 0.5
+    assert limiter.take("limited", 50) == 0
+    assert limiter.take("limited", 50) > 0
+
+
+def test_debt() -> None:
+    clock = _Clock()
+    limiter = _limiter(clock)
+
+    # Larger than the bucket, it's let in but has to be paid back before anything else is
+    assert limiter.take("limited", 500) == 0
+    assert limiter.take("limited", 1) == 3
+
+    clock.now = 3.01
+    assert limiter.take("limited", 1) == 0
+
+
+def test_force() -> None:
+    clock = _Clock()
+    limiter = _limiter(clock)
+    limiter.take("limited", 200)
+
+    assert limiter.take("limited", 100, force=True) == 0
+    assert limiter.take("limited", 1) == 1
+
+
+def test_unlimited() -> None:
+    limiter = _limiter(_Clock())
+    waits: List[float] = [limiter.take("other", 1_000_000) for _ in range(10)]
+    assert waits == [0] * 10
+
+
+def test_shared_across_processes() -> None:
+    clock = _Clock()
+    limiter = _limiter(clock)
+
+    pid = os.fork()
+    if pid == 0:
+        limiter.take("limited", 200)
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert limiter.take("limited", 1) > 0
+
+
+def test_max_buckets() -> None:
+    clock = _Clock()
+    limiter = RateLimiter(lambda key: 100.0, burst_seconds=2, clock=clock, max_buckets=4)
+    limiter.take("first", 1000)
+
+    # The least recently used bucket is reused, which starts the key over with a full one
+    for i in range(20):
+        clock.now += 0.001
+        limiter.take(f"other-{i}", 1)
+    assert len(limiter._keys) == 4
+    assert limiter.take("first", 1) == 0
@@ -12,3 +12,22 @@ def encode_strings(col_names: List[str]) -> int:
     # Use sha1 because its fast. This isn't used for anything related to security.
     hashes = [int.from_bytes(sha1(it.encode("utf-8")).digest(), "big") for it in col_names]
     return sum(hashes)
+
+
+def consistent_shard(value: str, shards: int) -> int:
+    """
+    Map a string to one of `shards` buckets using jump consistent hashing (Lamping and Veach).
+    The result is stable across processes and python runs, unlike the builtin hash(), and growing
+    the shard count only moves the minimum amount of keys to new shards.
+    """
+    if shards <= 1:
+        return 0
+
+    key = int.from_bytes(sha1(value.encode("utf-8")).digest()[:8], "big")
+    bucket = -1
+    j = 0
+    while j < shards:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
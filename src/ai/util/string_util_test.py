@@ -1,4 +1,4 @@
-from .string_util import encode_strings
+from .string_util import consistent_shard, encode_strings
 
 
 def test_order_doesnt_matter() -> None:
@@ -19,3 +19,21 @@ def test_different_hashes() -> None:
     hash2 = encode_strings(column_names_2)
 
     assert hash1 != hash2
+
+
+def test_consistent_shard_stable() -> None:
+    assert consistent_shard("model-1", 8) == consistent_shard("model-1", 8)
+    assert consistent_shard("model-1", 1) == 0
+
+
+def test_consistent_shard_in_range() -> None:
+    shards = {consistent_shard(f"model-{i}", 4) for i in range(100)}
+    assert shards == {0, 1, 2, 3}
+
+
+def test_consistent_shard_minimal_movement() -> None:
+    ids = [f"model-{i}" for i in range(1000)]
+    moved = [it for it in ids if consistent_shard(it, 4) != consistent_shard(it, 5)]
+
+    # Only keys that move to the new shard should change buckets
+    assert all(consistent_shard(it, 5) == 4 for it in moved)
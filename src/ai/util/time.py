@@ -1,7 +1,9 @@
 import time
-from datetime import datetime
-from dateutil import tz
+from dataclasses import dataclass
 from enum import Enum
+from typing import List, Tuple, Union
+
+import numpy as np
 
 
 def current_time_ms() -> int:
@@ -9,16 +11,81 @@ def current_time_ms() -> int:
 
 
 class TimeGranularity(Enum):
+    M = "Minute"
     H = "Hour"
     D = "Day"
+    W = "Week"  # Starting on Monday
+
+
+@dataclass(frozen=True)
+class TimeWindow:
+    """
+    Fixed size windows of some number of minutes. They're aligned to the epoch, so windows that evenly divide
+    an hour or a day, like 15 minutes, start on the hour or at midnight.
+    """
+
+    minutes: int
+
+    def __post_init__(self) -> None:
+        if self.minutes < 1:
+            raise ValueError(f"Time windows have to be at least a minute, got {self.minutes}")
+
+
+Bucketing = Union[TimeGranularity, TimeWindow]
+
+_MINUTE_MS = 60 * 1000
+_GRANULARITY_MS = {
+    TimeGranularity.M: _MINUTE_MS,
+    TimeGranularity.H: 60 * _MINUTE_MS,
+    TimeGranularity.D: 24 * 60 * _MINUTE_MS,
+    TimeGranularity.W: 7 * 24 * 60 * _MINUTE_MS,
+}
+# The epoch was a Thursday, so weeks start 4 days after it
+_WEEK_ORIGIN_MS = 4 * _GRANULARITY_MS[TimeGranularity.D]
+# Bucket size and origin, looked up once since this is called for every request
+_GRANULARITY_BUCKETS = {
+    granularity: (size, _WEEK_ORIGIN_MS if granularity == TimeGranularity.W else 0)
+    for granularity, size in _GRANULARITY_MS.items()
+}
+
+
+def _size_and_origin(bucketing: Bucketing) -> Tuple[int, int]:
+    if isinstance(bucketing, TimeWindow):
+        return bucketing.minutes * _MINUTE_MS, 0
+    return _GRANULARITY_BUCKETS[bucketing]
+
+
+def truncate_time_ms(t: int, granularity: Bucketing) -> int:
+    """
+    The start of the UTC minute, hour, day, week or window that t falls in.
+    """
+    # Epoch time has no leap seconds, so every bucket is a fixed number of ms
+    size, origin = _size_and_origin(granularity)
+    return t - (t - origin) % size
+
 
+def truncate_times_ms(timestamps: np.ndarray, granularity: Bucketing) -> np.ndarray:
+    """
+    truncate_time_ms for an array of epoch ms timestamps at once. Returns an int64 array of the bucket start
+    times, which double as bucket ids.
+    """
+    size, origin = _size_and_origin(granularity)
+    ts = np.asarray(timestamps, dtype=np.int64)
+    # Numpy's % takes the sign of the divisor like python's, so times before the epoch round down too
+    result: np.ndarray = ts - (ts - origin) % size
+    return result
 
-def truncate_time_ms(t: int, granularity: TimeGranularity) -> int:
-    dt = datetime.fromtimestamp(t / 1000, tz=tz.tzutc()).replace(second=0, microsecond=0, minute=0)
 
-    if granularity == TimeGranularity.H:
-        trunc = dt
-    elif granularity == TimeGranularity.D:
-        trunc = dt.replace(hour=0)
+def group_by_bucket(timestamps: np.ndarray, granularity: Bucketing) -> List[Tuple[int, np.ndarray]]:
+    """
+    Group the indexes of timestamps by the bucket they fall in. Returns (bucket start time, indexes) in order
+    of time, with the indexes in their original order.
+    """
+    buckets, inverse = np.unique(truncate_times_ms(timestamps, granularity), return_inverse=True)
+    if len(buckets) == 1:
+        return [(int(buckets[0]), np.arange(len(inverse)))]
 
-    return int(trunc.timestamp() * 1000)
+    # A stable sort keeps rows in their original order within each bucket
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.cumsum(np.bincount(inverse))[:-1]
+    return [(int(bucket), indexes) for bucket, indexes in zip(buckets, np.split(order, bounds))]
@@ -0,0 +1,54 @@
+"""
+Compare bucketing timestamps one at a time with datetime, one at a time with integer math and all at once
+with numpy.
+
+Run with `python -m ai.util.time_bench` from the src directory.
+"""
+import time
+from datetime import datetime
+from typing import Callable, List
+
+import numpy as np
+from dateutil import tz
+
+from .time import TimeGranularity, truncate_time_ms, truncate_times_ms
+
+_TIMESTAMPS = 1_000_000
+
+
+def _datetime_path(timestamps: np.ndarray) -> List[int]:
+    # How truncate_time_ms used to work
+    result: List[int] = []
+    for t in timestamps.tolist():
+        dt = datetime.fromtimestamp(t / 1000, tz=tz.tzutc()).replace(second=0, microsecond=0, minute=0)
+        result.append(int(dt.timestamp() * 1000))
+    return result
+
+
+def _scalar_path(timestamps: np.ndarray) -> List[int]:
+    granularity = TimeGranularity.H
+    return [truncate_time_ms(t, granularity) for t in timestamps.tolist()]
+
+
+def _vectorized_path(timestamps: np.ndarray) -> np.ndarray:
+    return truncate_times_ms(timestamps, TimeGranularity.H)
+
+
+def _time(name: str, timestamps: np.ndarray, fn: Callable[[np.ndarray], object], iterations: int = 5) -> None:
+    times: List[float] = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(timestamps)
+        times.append(time.perf_counter() - start)
+
+    best = min(times)
+    print(f"{name:<12} {best:.4f}s  {best / len(timestamps) * 1e9:.1f}ns per timestamp")
+
+
+if __name__ == "__main__":
+    now = truncate_time_ms(int(time.time() * 1000), TimeGranularity.D)
+    timestamps = np.random.default_rng(0).integers(now - 7 * 24 * 60 * 60 * 1000, now, _TIMESTAMPS)
+
+    _time("datetime", timestamps, _datetime_path)
+    _time("scalar", timestamps, _scalar_path)
+    _time("vectorized", timestamps, _vectorized_path)
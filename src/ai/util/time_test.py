@@ -1,4 +1,8 @@
-from .time import truncate_time_ms, TimeGranularity
+from datetime import datetime, timezone
+
+import numpy as np
+
+from .time import TimeGranularity, TimeWindow, group_by_bucket, truncate_time_ms, truncate_times_ms
 
 
 def test_truncate_hour() -> None:
@@ -19,3 +23,44 @@ def test_truncate_day() -> None:
 
     truncated = truncate_time_ms(t1, TimeGranularity.D)
     assert truncated == expected
+
+
+def test_truncate_matches_datetime() -> None:
+    # Every hour boundary around a day, a leap day and pre-1970 times
+    for t in [1677022075123, 1677024000000, 1677023999999, 1709164800000, 1709251199999, 0, -1, -3_600_001]:
+        dt = datetime.fromtimestamp(t / 1000, tz=timezone.utc).replace(minute=0, second=0, microsecond=0)
+        assert truncate_time_ms(t, TimeGranularity.H) == int(dt.timestamp() * 1000)
+        assert truncate_time_ms(t, TimeGranularity.D) == int(dt.replace(hour=0).timestamp() * 1000)
+
+
+def test_truncate_week_and_windows() -> None:
+    # UTC Tuesday, February 21, 2023 11:27:55.123 PM
+    t1 = 1677022075123
+    assert truncate_time_ms(t1, TimeGranularity.M) == 1677022020000
+    # UTC Monday, February 20, 2023 0:00:00
+    assert truncate_time_ms(t1, TimeGranularity.W) == 1676851200000
+    # UTC 11:15 PM
+    assert truncate_time_ms(t1, TimeWindow(minutes=15)) == 1677021300000
+    assert truncate_time_ms(t1, TimeWindow(minutes=60)) == truncate_time_ms(t1, TimeGranularity.H)
+
+
+def test_truncate_times_matches_scalar() -> None:
+    rng = np.random.default_rng(0)
+    timestamps = np.concatenate([rng.integers(-(10**12), 2 * 10**12, 10_000), [0, -1, 1677022075123]])
+    for bucketing in [*TimeGranularity, TimeWindow(minutes=7), TimeWindow(minutes=15)]:
+        expected = [truncate_time_ms(int(it), bucketing) for it in timestamps]
+        result = truncate_times_ms(timestamps, bucketing)
+        assert result.dtype == np.int64
+        assert result.tolist() == expected
+
+
+def test_group_by_bucket() -> None:
+    minute = 60 * 1000
+    timestamps = np.array([2 * minute + 1, 5, minute, 2 * minute, 7])
+
+    groups = group_by_bucket(timestamps, TimeGranularity.M)
+    assert [(bucket, indexes.tolist()) for bucket, indexes in groups] == [
+        (0, [1, 4]),
+        (minute, [2]),
+        (2 * minute, [0, 3]),
+    ]
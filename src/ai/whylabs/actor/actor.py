@@ -1,4 +1,6 @@
 from faster_fifo import Queue
+import asyncio
+from collections import OrderedDict
 import signal
 from ...util.signal_util import suspended_signals
 from typing import Optional
@@ -6,29 +8,115 @@ import time
 import os
 import logging
 from abc import ABC, abstractmethod
-from typing import TypeVar, Generic, List, Type, Union
-from queue import Full
+from dataclasses import dataclass
+from typing import TypeVar, Generic, List, Type, Union, cast
 from multiprocessing import Process, Event
 from queue import Empty, Full
-from ...util.list_util import get_like_items, type_batched_items
+from ...util.list_util import partition_by_type
+from ...util.metrics import (
+    BYTE_BUCKETS,
+    SIZE_BUCKETS,
+    MetricFamily,
+    MetricsRegistry,
+    SharedHistogram,
+    SharedSnapshot,
+    deserialize,
+)
+from .batch_policy import BatchPolicy
+from .fair_queue import FairQueue
+from .overflow import OverflowPolicy, QueueFullError
+from .spill_queue import SpillPosition, SpillQueue
 
 MessageType = TypeVar("MessageType")
 
-_DEFAULT_POLL_WAIT_SECONDS = 0.1
+_MIN_RETRY_WAIT_SECONDS = 0.001
+_MAX_RETRY_WAIT_SECONDS = 0.1
 
 
 class CloseMessage:
-    pass
+    def __init__(self) -> None:
+        # When shutdown was requested, so that shutdown deadlines include the time spent on the messages that
+        # were queued before this one.
+        self.request_time = time.time()
+
+
+@dataclass
+class SendStats:
+    """
+    Counts of messages that couldn't be put on the queue right away. These are tracked in the
+    process that calls send(), not the actor process.
+    """
+
+    delayed: int = 0
+    rejected: int = 0
+    spilled: int = 0
 
 
 class Actor(Process, ABC, Generic[MessageType]):
-    def __init__(self, queue: Queue) -> None:
+    def __init__(
+        self,
+        queue: Queue,
+        batch_policy: Optional[BatchPolicy] = None,
+        overflow_policy: OverflowPolicy = OverflowPolicy.BLOCK,
+        overflow_deadline_seconds: float = 30,
+        spill_queue: Optional[SpillQueue] = None,
+        durable: bool = False,
+        shutdown_timeout_seconds: Optional[float] = None,
+        fair_queue: Optional[FairQueue[MessageType]] = None,
+    ) -> None:
+        if spill_queue is None and (durable or overflow_policy == OverflowPolicy.SPILL):
+            raise Exception("A spill queue is required for durable mode and the SPILL overflow policy")
+
         self.queue = queue
+        # Data messages go here instead of the queue when it's full, or always in durable mode. Control
+        # messages always go through the queue.
+        self.spill_queue = spill_queue
+        self.durable = durable
+        self.batch_policy = batch_policy or BatchPolicy()
+        self.overflow_policy = overflow_policy
+        self.overflow_deadline_seconds = overflow_deadline_seconds
+        # How long to wait for the process to finish after asking it to shut down, or forever if None
+        self.shutdown_timeout_seconds = shutdown_timeout_seconds
+        # Messages are read ahead into this and batches are taken from it a dataset at a time, if it's set.
+        # Otherwise batches are made in the order that messages were sent.
+        self.fair_queue = fair_queue
+        # Where the messages that were read from the spill queue and are still in the fair queue start, oldest
+        # first. They're keyed by id since that's the only thing that tells identical messages apart.
+        self._spilled_positions: "OrderedDict[int, SpillPosition]" = OrderedDict()
+        self.send_stats = SendStats()
+        self._queue_full = False
         self._logger = logging.getLogger(f"{type(self).__name__}_{id(self)}")
         self._work_done_signal = Event()
+
+        # Updated in the actor process and published to the shared snapshot so that reading metrics from
+        # other processes never has to wait on the processing loop.
+        self.metrics = MetricsRegistry()
+        self.metrics.histogram("actor_batch_messages", "Messages in each batch read from the queue", SIZE_BUCKETS)
+        self.metrics.histogram("actor_batch_bytes", "Size of each batch read from the queue", BYTE_BUCKETS)
+        self.metrics.counter("actor_messages_total", "Messages processed by type")
+        self.metrics.histogram("actor_process_seconds", "Time to process the messages of one type in a batch")
+        if fair_queue is not None:
+            self.metrics.gauge(
+                "actor_pending_messages", "Messages read ahead into the fair queue that are still waiting"
+            )
+        self._metrics_snapshot = SharedSnapshot()
+        self._metrics_too_large = False
+        # Updated by every process that calls send()
+        self._enqueue_seconds = SharedHistogram()
         super().__init__()
 
-    async def send(self, message: Union[CloseMessage, MessageType]) -> None:
+    async def send(self, message: Union[CloseMessage, MessageType], force: bool = False) -> None:
+        """
+        Put a message on the queue. force makes a data message wait for room like a control message, however long
+        that takes, instead of being rejected. It can still be spilled.
+        """
+        start = time.perf_counter()
+        try:
+            await self._send(message, force)
+        finally:
+            self._enqueue_seconds.observe(time.perf_counter() - start)
+
+    async def _send(self, message: Union[CloseMessage, MessageType], force: bool) -> None:
         if self.queue.is_closed():
             self._logger.warn(f"Dropping message because queue is closed.")
             return
@@ -36,49 +124,270 @@ class Actor(Process, ABC, Generic[MessageType]):
         if isinstance(message, CloseMessage):
             self.queue.close()
 
-        done = False
-        while not done:
-            try:
-                self.queue.put(message, timeout=_DEFAULT_POLL_WAIT_SECONDS)
-                done = True
-            except Full:
-                self._logger.warn(f"Message queue full, trying again")
+        is_data = self.is_data_message(message)
+        if is_data and self.spill_queue is not None and self.durable:
+            await self._spill(self.spill_queue, message)
+            return
+
+        # Prepared once instead of on every attempt, so retries don't redo the work
+        queued = self._prepare_put(message)
+        try:
+            if await self._put_or_wait(queued, is_data, force):
+                return
+        except BaseException:
+            # Rejected, or the request went away while it was waiting
+            self._discard_put(queued)
+            raise
+
+        self._discard_put(queued)
+        self.send_stats.spilled += 1
+        await self._spill(cast(SpillQueue, self.spill_queue), message)
+
+    async def _spill(self, spill_queue: SpillQueue, message: Union[CloseMessage, MessageType]) -> None:
+        # Appending pickles the message and waits on a file lock that other processes hold while they append,
+        # neither of which should hold up the event loop
+        await asyncio.get_running_loop().run_in_executor(None, spill_queue.append, message)
+
+    async def _put_or_wait(self, message: Union[CloseMessage, MessageType], is_data: bool, force: bool) -> bool:
+        """
+        Put a message on the queue, waiting for room if the overflow policy says to. Returns False if it should be
+        spilled to disk instead and raises QueueFullError if it's rejected.
+        """
+        if self._try_put(message):
+            return True
+
+        if is_data and self.spill_queue is not None and self.overflow_policy == OverflowPolicy.SPILL:
+            return False
+
+        # Control messages always have to make it onto the queue eventually
+        if is_data and not force and self.overflow_policy == OverflowPolicy.REJECT:
+            self.send_stats.rejected += 1
+            raise QueueFullError("Message queue full")
+
+        self.send_stats.delayed += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.overflow_deadline_seconds
+        wait = _MIN_RETRY_WAIT_SECONDS
+        while True:
+            # Yield to the event loop instead of blocking it on the queue
+            await asyncio.sleep(wait)
+            if self._try_put(message):
+                return True
+
+            if is_data and not force and loop.time() >= deadline:
+                self.send_stats.rejected += 1
+                raise QueueFullError(f"Message queue still full after {self.overflow_deadline_seconds}s")
+
+            wait = min(wait * 2, _MAX_RETRY_WAIT_SECONDS)
+
+    def _prepare_put(self, message: Union[CloseMessage, MessageType]) -> Union[CloseMessage, MessageType]:
+        """
+        The version of a message that goes on the queue. This is only called once per send, however many times
+        putting it on the queue has to be retried.
+        """
+        return message
+
+    def _discard_put(self, message: Union[CloseMessage, MessageType]) -> None:
+        """
+        Clean up after a message from _prepare_put that didn't make it onto the queue.
+        """
+        pass
+
+    def is_data_message(self, message: Union[CloseMessage, MessageType]) -> bool:
+        """
+        Whether or not a message can be spilled to disk. Control messages always go through the queue.
+        """
+        return not isinstance(message, CloseMessage)
+
+    def _try_put(self, message: Union[CloseMessage, MessageType]) -> bool:
+        try:
+            self.queue.put(message, block=False)
+        except Full:
+            if not self._queue_full:
+                # Only warn on the transition to avoid flooding the logs while the queue stays full
+                self._logger.warning("Message queue full, requests will be delayed or rejected.")
+                self._queue_full = True
+            return False
+
+        if self._queue_full:
+            self._logger.info("Message queue has room again.")
+            self._queue_full = False
+        return True
 
     @abstractmethod
     def process_batch(self, batch: List[MessageType], batch_type: Type) -> None:
         pass
 
-    def _polling_condition(self, batch_len: int, max: int, last_message_time: float, remaining: int) -> bool:
+    def message_size(self, message: MessageType) -> int:
+        """
+        Size of a message in bytes, used to limit the size of batches. Defaults to 0, which means
+        that only message counts are used.
+        """
+        return 0
+
+    def _polling_condition(
+        self, batch_len: int, batch_bytes: int, batch_start_time: float, last_message_time: float, remaining: int
+    ) -> bool:
         if self._work_done_signal.is_set() and remaining == 0:
             self._logger.info("Stopping poll. Handled all messages and shutting down.")
             return False
 
-        if batch_len >= max:
-            self._logger.info(f"Stopping poll. Got {batch_len} messages.")
+        if self.batch_policy.is_full(batch_len, batch_bytes):
+            self._logger.info(f"Stopping poll. Got {batch_len} messages and {batch_bytes} bytes.")
+            return False
+
+        now = time.perf_counter()
+        if batch_len > 0 and self.batch_policy.is_expired(now - batch_start_time):
+            self._logger.info(f"Stopping poll. Spent {now - batch_start_time:.2f}s collecting {batch_len} messages.")
             return False
 
-        if time.perf_counter() - last_message_time > 0.5:
+        if self.batch_policy.is_idle(now - last_message_time):
             return False
 
         return True
 
     def _load_messages(self) -> Optional[List[MessageType]]:
-        max = 50_000  # TODO make configurable
+        if self.fair_queue is not None:
+            return self._load_fair_messages(self.fair_queue)
+
         batch: List[MessageType] = []
-        last_message_time = time.perf_counter()
+        batch_bytes = 0
+        batch_start_time = time.perf_counter()
+        last_message_time = batch_start_time
+
+        while self._polling_condition(len(batch), batch_bytes, batch_start_time, last_message_time, self.queue.qsize()):
+            messages = self._read_messages(self.batch_policy.remaining_messages(len(batch), batch_bytes), block=True)
+            if messages is None:
+                self._logger.info(f"Queue closed and no more messages to process.")
+                return None if batch == [] else batch
 
-        while self._polling_condition(len(batch), max, last_message_time, self.queue.qsize()):
-            try:
-                batch += self.queue.get_many(timeout=0.1, max_messages_to_get=max)
+            if messages:
+                batch += messages
+                batch_bytes += sum(self.message_size(it) for it in messages)
                 last_message_time = time.perf_counter()
-            except Empty:
-                if self.queue.is_closed():
-                    self._logger.info(f"Queue closed and no more messages to process.")
-                    return None if batch == [] else batch
 
         return batch
 
+    def _load_fair_messages(self, fair_queue: FairQueue[MessageType]) -> Optional[List[MessageType]]:
+        """
+        Like _load_messages, except that messages are read ahead into the fair queue, up to its limits, and the
+        batch is taken from it a dataset at a time.
+        """
+        # Messages left over from the last batch are processed right away instead of waiting for more
+        backlog = len(fair_queue) > 0
+        # Read everything that's already waiting first so that datasets that just sent something get a turn in
+        # this batch, even if the fair queue already has a full batch from the busy ones.
+        closed = False
+        while not fair_queue.is_full():
+            messages = self._read_messages(fair_queue.max_messages - len(fair_queue), block=False)
+            if messages is None:
+                closed = True
+            if not messages:
+                break
+            self._put_fair(fair_queue, messages)
+
+        batch_start_time = time.perf_counter()
+        last_message_time = batch_start_time
+        while (
+            not closed
+            and not backlog
+            and self._polling_condition(
+                len(fair_queue), fair_queue.size_bytes, batch_start_time, last_message_time, self.queue.qsize()
+            )
+        ):
+            messages = self._read_messages(self.batch_policy.remaining_messages(len(fair_queue)), block=True)
+            if messages is None:
+                closed = True
+            elif messages:
+                self._put_fair(fair_queue, messages)
+                last_message_time = time.perf_counter()
+
+        if closed and len(fair_queue) == 0:
+            self._logger.info(f"Queue closed and no more messages to process.")
+            return None
+        return fair_queue.take(self.batch_policy.remaining_messages(0), self.batch_policy.byte_limit)
+
+    def _put_fair(self, fair_queue: FairQueue[MessageType], messages: List[MessageType]) -> None:
+        for message in messages:
+            fair_queue.put(message, self.message_size(message), barrier=not self.is_data_message(message))
+
+    def _read_messages(self, max_messages: int, block: bool) -> Optional[List[MessageType]]:
+        """
+        Read up to max_messages from the spill queue and then the queue. Returns None once the queue is closed
+        and both are empty.
+        """
+        messages: List[MessageType] = self._read_spill(max_messages)
+        try:
+            # Control messages have to wait until the spill queue is drained so they stay after the data that
+            # was sent before them. Also don't wait on the queue if there was something to process.
+            if len(messages) < max_messages:
+                queued: List[MessageType] = self.queue.get_many(
+                    block=block and not messages,
+                    timeout=self.batch_policy.limits.poll_timeout_seconds,
+                    max_messages_to_get=max_messages - len(messages),
+                )
+                # Anything that was spilled while waiting on the queue was sent before the queued messages
+                messages += self._read_spill(max_messages - len(messages) - len(queued))
+                messages += queued
+        except Empty:
+            if not messages and self.queue.is_closed() and self._is_spill_empty():
+                return None
+        return messages
+
+    def _read_spill(self, max_messages: int) -> List[MessageType]:
+        if self.spill_queue is None:
+            return []
+        if self.fair_queue is None:
+            return self.spill_queue.read_many(max_messages)
+
+        messages = self.spill_queue.read_many_with_positions(max_messages)
+        for message, position in messages:
+            self._spilled_positions[id(message)] = position
+        return [message for message, _ in messages]
+
+    def _ack_spill(self, spill_queue: SpillQueue, processed: List[MessageType]) -> None:
+        """
+        Acknowledge the spilled messages that have been processed so that they aren't replayed after a restart.
+        The fair queue processes them out of order, so that's only up to the oldest one that's still waiting in it.
+        """
+        for message in processed:
+            self._spilled_positions.pop(id(message), None)
+        spill_queue.ack(next(iter(self._spilled_positions.values()), None))
+
+    def _is_spill_empty(self) -> bool:
+        return self.spill_queue is None or self.spill_queue.is_empty()
+
+    def collect_metrics(self) -> List[MetricFamily]:
+        """
+        The metrics that the actor process last published along with the queue's current state. This
+        can be called from any process.
+        """
+        snapshot = self._metrics_snapshot.read()
+        families = deserialize(snapshot) if snapshot is not None else []
+        families += [
+            MetricFamily(
+                "actor_queue_messages", "gauge", "Messages waiting in the queue", samples={(): self.queue.qsize()}
+            ),
+            MetricFamily(
+                "actor_queue_bytes", "gauge", "Bytes waiting in the queue", samples={(): self.queue.data_size()}
+            ),
+            MetricFamily(
+                "actor_enqueue_seconds",
+                "histogram",
+                "Time for send() to get a message onto the queue, including backpressure",
+                buckets=self._enqueue_seconds.buckets,
+                samples={(): self._enqueue_seconds.snapshot()},
+            ),
+        ]
+        return families
+
+    def _publish_metrics(self) -> None:
+        if not self._metrics_snapshot.publish(self.metrics.serialize()) and not self._metrics_too_large:
+            self._logger.warning("Metrics don't fit in the shared snapshot anymore and won't be updated.")
+            self._metrics_too_large = True
+
     def process_messages(self) -> None:
+        self._publish_metrics()
         messages: Optional[List[MessageType]] = []
         while messages is not None:
             messages = self._load_messages()
@@ -86,25 +395,64 @@ class Actor(Process, ABC, Generic[MessageType]):
             if messages is None:
                 continue
 
-            for (batch, batch_type) in type_batched_items(messages):
-                if batch == []:
-                    continue
+            start = time.perf_counter()
+            # Data messages are grouped by type between control messages, which have to stay where they are
+            for (batch, batch_type) in partition_by_type(messages, lambda it: not self.is_data_message(it)):
 
                 self._logger.info(
                     f"Processing batch of {len(batch)} {batch_type.__name__}. {self.queue.qsize()} remaining"
                 )
 
+                batch_start = time.perf_counter()
                 try:
                     self.process_batch(batch, batch_type)
                 except Exception as e:
                     self._logger.exception(e)
 
+                labels = {"type": batch_type.__name__}
+                self.metrics.inc("actor_messages_total", len(batch), labels)
+                self.metrics.observe("actor_process_seconds", time.perf_counter() - batch_start, labels)
+
+            pending = 0 if self.fair_queue is None else len(self.fair_queue)
+            if self.spill_queue is not None:
+                self._ack_spill(self.spill_queue, messages)
+
+            size_bytes = sum(self.message_size(it) for it in messages)
+            self.batch_policy.record(
+                messages=len(messages),
+                size_bytes=size_bytes,
+                processing_seconds=time.perf_counter() - start,
+                queue_depth=self.queue.qsize() + pending,
+            )
+
+            if messages:
+                self.metrics.observe("actor_batch_messages", len(messages))
+                self.metrics.observe("actor_batch_bytes", size_bytes)
+            if self.fair_queue is not None:
+                self.metrics.set("actor_pending_messages", pending)
+            self.after_poll()
+            self._publish_metrics()
+
         # Can only get here if we're done processing messages
         self._work_done_signal.set()
 
+    def on_start(self) -> None:
+        """
+        Called in the actor process before it starts processing messages.
+        """
+        pass
+
+    def after_poll(self) -> None:
+        """
+        Called in the actor process after every pass through the processing loop, including the ones that
+        didn't find any messages, so it's also called periodically while the queue is empty.
+        """
+        pass
+
     def run(self) -> None:
         try:
             with suspended_signals(signal.SIGINT, signal.SIGTERM):
+                self.on_start()
                 self.process_messages()
         except KeyboardInterrupt:
             # Swallow this to prevent annoying stack traces in dev.
@@ -112,12 +460,23 @@ class Actor(Process, ABC, Generic[MessageType]):
         except Exception as e:
             self._logger.exception(e)
 
-    async def shutdown(self) -> None:
+    async def request_shutdown(self) -> None:
+        """
+        Ask the process to finish up. It will handle all of the pending messages before stopping.
+        """
         self._logger.info("Sending Close message to work queue.")
         await self.send(CloseMessage())
         self._logger.info(
             f"Process will shutdown after all pending {self.queue.qsize()} data has been processed and uploaded."
         )
-        self._work_done_signal.wait()
+
+    def wait_until_done(self) -> None:
+        if not self._work_done_signal.wait(self.shutdown_timeout_seconds):
+            self._logger.error(f"Process didn't finish within {self.shutdown_timeout_seconds}s, killing it.")
+            self.kill()
+
+    async def shutdown(self) -> None:
+        await self.request_shutdown()
+        self.wait_until_done()
         self._logger.info("Process shutting down.")
         os._exit(0)  # Not sure why I need this but I definitely do
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+from typing import Callable, Generic, List, Optional, Union
+
+from ...util.metrics import MetricFamily
+from ...util.string_util import consistent_shard
+from .actor import Actor, CloseMessage, MessageType, SendStats
+from .spill_queue import SpillQueue
+
+# How many messages are moved at a time by reroute_spilled
+_REROUTE_BATCH_SIZE = 1000
+
+
+class ActorPool(Generic[MessageType]):
+    """
+    A group of actor processes that each own their own queue. Messages are routed to a single actor
+    by a consistent hash of their shard key so that all of the state for a given key, like a dataset's
+    logger, is only ever owned by one process.
+    """
+
+    def __init__(self, actors: List[Actor[MessageType]], shard_key: Callable[[MessageType], Optional[str]]) -> None:
+        if not actors:
+            raise Exception("Need at least one actor in the pool")
+
+        self.actors = actors
+        self._shard_key = shard_key
+        self._logger = logging.getLogger(f"{type(self).__name__}_{id(self)}")
+        self._owner_pid: Optional[int] = None
+
+    def start(self) -> None:
+        self._owner_pid = os.getpid()
+        for actor in self.actors:
+            actor.daemon = True
+            actor.start()
+
+    def is_owner(self) -> bool:
+        """
+        Whether or not this process started the pool. Processes forked after the pool was started, like http
+        workers, can send messages to it but only the owner can shut it down.
+        """
+        return self._owner_pid == os.getpid()
+
+    def pids(self) -> List[int]:
+        return [actor.pid for actor in self.actors if actor.pid is not None]
+
+    def qsize(self) -> int:
+        return sum(actor.queue.qsize() for actor in self.actors)
+
+    def send_stats(self) -> SendStats:
+        return SendStats(
+            delayed=sum(actor.send_stats.delayed for actor in self.actors),
+            rejected=sum(actor.send_stats.rejected for actor in self.actors),
+            spilled=sum(actor.send_stats.spilled for actor in self.actors),
+        )
+
+    def collect_metrics(self) -> List[MetricFamily]:
+        """
+        Metrics from every actor, labeled with the shard they came from.
+        """
+        return [
+            family.with_labels({"shard": str(i)})
+            for i, actor in enumerate(self.actors)
+            for family in actor.collect_metrics()
+        ]
+
+    def get_actor(self, message: MessageType) -> Actor[MessageType]:
+        key = self._shard_key(message)
+        if key is None:
+            # Can't route it anywhere meaningful. The actor will end up reporting the error.
+            return self.actors[0]
+
+        return self.actors[consistent_shard(key, len(self.actors))]
+
+    def reroute_spilled(self, spill_queue: SpillQueue) -> int:
+        """
+        Move the messages in a spill queue that doesn't belong to any of the actors, like one from before the
+        number of actors changed, to the spill queues of the actors that own them now. Returns how many were
+        moved. This has to be called before the pool is started.
+        """
+        moved = 0
+        while True:
+            messages: List[MessageType] = spill_queue.read_many(_REROUTE_BATCH_SIZE)
+            if not messages:
+                break
+            for message in messages:
+                actor = self.get_actor(message)
+                if actor.spill_queue is None:
+                    raise Exception("Can't reroute spilled messages to an actor without a spill queue")
+                actor.spill_queue.append(message)
+            # Anything appended but not acknowledged is moved again after a crash, same as it would be replayed
+            spill_queue.ack()
+            moved += len(messages)
+
+        spill_queue.close()
+        # The writers were opened in this process, the actors and http workers have to open their own
+        for actor in self.actors:
+            if actor.spill_queue is not None:
+                actor.spill_queue.close()
+        return moved
+
+    async def send(self, message: MessageType, force: bool = False) -> None:
+        await self.get_actor(message).send(message, force)
+
+    async def broadcast(self, message: Union[CloseMessage, MessageType]) -> None:
+        """
+        Send a message to every actor, like a publish or debug message that applies to all of the state.
+        """
+        await asyncio.gather(*[actor.send(message) for actor in self.actors])
+
+    async def shutdown(self) -> None:
+        await asyncio.gather(*[actor.request_shutdown() for actor in self.actors])
+        for actor in self.actors:
+            actor.wait_until_done()
+        self._logger.info(f"All {len(self.actors)} processes shutting down.")
+        os._exit(0)  # Same as Actor.shutdown
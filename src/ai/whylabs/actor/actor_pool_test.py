@@ -0,0 +1,37 @@
+import os
+from typing import List, Optional, Type
+
+from faster_fifo import Queue
+
+from .actor import Actor
+from .actor_pool import ActorPool
+from .spill_queue import SpillQueue
+
+
+class _NoopActor(Actor[bytes]):
+    def process_batch(self, batch: List[bytes], batch_type: Type) -> None:
+        pass
+
+
+def _shard_key(message: bytes) -> Optional[str]:
+    return message.decode()
+
+
+def test_reroute_spilled(tmp_path: str) -> None:
+    actors: List[Actor[bytes]] = [
+        _NoopActor(Queue(1000), spill_queue=SpillQueue(os.path.join(tmp_path, f"shard-{i}"))) for i in range(3)
+    ]
+    pool = ActorPool(actors, _shard_key)
+    old = SpillQueue(os.path.join(tmp_path, "old"))
+    messages = [f"dataset-{i}".encode() for i in range(20)]
+    for message in messages:
+        old.append(message)
+
+    assert pool.reroute_spilled(old) == 20
+    assert SpillQueue(os.path.join(tmp_path, "old")).is_empty()
+
+    for actor in actors:
+        assert actor.spill_queue is not None
+        expected = [it for it in messages if pool.get_actor(it) is actor]
+        assert actor.spill_queue.read_many(100) == expected
+        actor.spill_queue.close()
@@ -0,0 +1,178 @@
+import asyncio
+from typing import List, Type
+
+import pytest
+from faster_fifo import Queue
+
+from .actor import Actor, CloseMessage
+from .batch_policy import BatchLimits, BatchPolicy
+from .fair_queue import FairQueue
+from .overflow import OverflowPolicy, QueueFullError
+from .spill_queue import SpillQueue
+
+
+class _NoopActor(Actor[bytes]):
+    def process_batch(self, batch: List[bytes], batch_type: Type) -> None:
+        pass
+
+
+def _full_actor(policy: OverflowPolicy, deadline: float = 0.05) -> _NoopActor:
+    actor = _NoopActor(Queue(1000), overflow_policy=policy, overflow_deadline_seconds=deadline)
+    while actor._try_put(b"x" * 100):
+        pass
+    return actor
+
+
+def test_reject_when_full() -> None:
+    actor = _full_actor(OverflowPolicy.REJECT)
+
+    with pytest.raises(QueueFullError):
+        asyncio.run(actor.send(b"x"))
+
+    assert actor.send_stats.rejected == 1
+    assert actor.send_stats.delayed == 0
+
+
+def test_block_until_deadline() -> None:
+    actor = _full_actor(OverflowPolicy.BLOCK)
+
+    with pytest.raises(QueueFullError):
+        asyncio.run(actor.send(b"x"))
+
+    assert actor.send_stats.delayed == 1
+    assert actor.send_stats.rejected == 1
+
+
+def test_block_until_room() -> None:
+    actor = _full_actor(OverflowPolicy.BLOCK, deadline=5)
+
+    async def drain_later() -> None:
+        await asyncio.sleep(0.01)
+        actor.queue.get_many(block=False)
+
+    async def run() -> None:
+        await asyncio.gather(actor.send(b"x"), drain_later())
+
+    asyncio.run(run())
+
+    assert actor.send_stats.delayed == 1
+    assert actor.send_stats.rejected == 0
+
+
+def test_forced_send_waits_instead_of_rejecting() -> None:
+    actor = _full_actor(OverflowPolicy.REJECT)
+
+    async def drain_later() -> None:
+        await asyncio.sleep(0.1)
+        actor.queue.get_many(block=False)
+
+    async def run() -> None:
+        await asyncio.gather(actor.send(b"x", force=True), drain_later())
+
+    # Past the deadline, which only applies to sends that aren't forced
+    asyncio.run(run())
+
+    assert actor.send_stats.delayed == 1
+    assert actor.send_stats.rejected == 0
+
+
+def test_spill_when_full(tmp_path: str) -> None:
+    actor = _NoopActor(Queue(1000), overflow_policy=OverflowPolicy.SPILL, spill_queue=SpillQueue(str(tmp_path)))
+    while actor._try_put(b"x" * 100):
+        pass
+
+    asyncio.run(actor.send(b"spilled"))
+
+    assert actor.send_stats.spilled == 1
+    assert actor.spill_queue is not None
+    assert actor.spill_queue.read_many(10) == [b"spilled"]
+
+
+def test_load_messages_drains_spill_first(tmp_path: str) -> None:
+    actor = _NoopActor(Queue(100_000), spill_queue=SpillQueue(str(tmp_path)), durable=True)
+
+    async def run() -> None:
+        await actor.send(b"a")
+        await actor.send(b"b")
+        await actor.send(CloseMessage())
+
+    asyncio.run(run())
+
+    assert actor.queue.qsize() == 1
+    messages = actor._load_messages()
+    assert messages is not None
+    assert messages[:2] == [b"a", b"b"]
+    assert isinstance(messages[2], CloseMessage)
+
+
+def test_ack_spill_with_fair_queue(tmp_path: str) -> None:
+    actor = _NoopActor(
+        Queue(100_000),
+        BatchPolicy(BatchLimits(max_messages=2, idle_seconds=0.01)),
+        spill_queue=SpillQueue(str(tmp_path)),
+        durable=True,
+        fair_queue=FairQueue(lambda it: it[:1]),
+    )
+
+    async def run() -> None:
+        for message in [b"a0", b"a1", b"a2", b"b0"]:
+            await actor.send(message)
+
+    asyncio.run(run())
+
+    messages = actor._load_messages()
+    assert messages == [b"a0", b"b0"]
+    assert actor.spill_queue is not None
+    actor._ack_spill(actor.spill_queue, messages)
+
+    # b0 was processed, but it comes after a1 in the spill queue, which hasn't been
+    assert SpillQueue(str(tmp_path)).read_many(10) == [b"a1", b"a2", b"b0"]
+
+    messages = actor._load_messages()
+    assert messages == [b"a1", b"a2"]
+    actor._ack_spill(actor.spill_queue, messages)
+    assert SpillQueue(str(tmp_path)).read_many(10) == []
+
+
+def test_load_messages_takes_turns() -> None:
+    actor = _NoopActor(
+        Queue(100_000),
+        BatchPolicy(BatchLimits(max_messages=4, idle_seconds=0.01)),
+        fair_queue=FairQueue(lambda it: it[:1]),
+    )
+
+    async def run() -> None:
+        for i in range(6):
+            await actor.send(b"a%d" % i)
+        await actor.send(b"b0")
+        await actor.send(CloseMessage())
+
+    asyncio.run(run())
+
+    # The quiet dataset gets into the first batch instead of waiting behind the busy one
+    assert actor._load_messages() == [b"a0", b"b0", b"a1", b"a2"]
+    messages = actor._load_messages()
+    assert messages is not None
+    assert messages[:3] == [b"a3", b"a4", b"a5"]
+    assert isinstance(messages[3], CloseMessage)
+    assert actor._load_messages() is None
+
+
+def test_collect_metrics() -> None:
+    actor = _NoopActor(Queue(1000 * 1000))
+
+    async def send() -> None:
+        await actor.send(b"a")
+        await actor.send(b"b")
+        await actor.send(CloseMessage())
+
+    asyncio.run(send())
+    # Run the processing loop in this process, it returns once the close message is handled
+    actor.process_messages()
+
+    families = {it.name: it for it in actor.collect_metrics()}
+    assert families["actor_messages_total"].samples[(("type", "bytes"),)] == 2
+    assert families["actor_messages_total"].samples[(("type", "CloseMessage"),)] == 1
+    assert families["actor_queue_messages"].samples[()] == 0
+    enqueue = families["actor_enqueue_seconds"].samples[()]
+    assert not isinstance(enqueue, float) and enqueue.count == 3
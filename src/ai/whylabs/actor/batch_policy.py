@@ -0,0 +1,90 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class BatchLimits:
+    """
+    Limits on how many messages an actor pulls off of its queue before processing them.
+
+    Attributes:
+        max_messages: Stop collecting once the batch has this many messages.
+        max_bytes: Stop collecting once the batch has this many bytes of requests. This is a soft limit, message
+            sizes are only known once they've been read, so a batch can go over by part of one read.
+        max_latency_seconds: Stop collecting once this much time has passed since the batch was started,
+            even if messages are still coming in.
+        idle_seconds: Stop collecting when no messages have come in for this long.
+        poll_timeout_seconds: How long a single read from the queue waits for messages.
+        adaptive: Tune the message and byte limits based on how long batches take to process.
+        target_batch_seconds: How long processing a batch should take when adaptive is on.
+    """
+
+    max_messages: int = 50_000
+    max_bytes: int = 256 * 1024 * 1024
+    max_latency_seconds: float = 5.0
+    idle_seconds: float = 0.5
+    poll_timeout_seconds: float = 0.1
+    adaptive: bool = False
+    target_batch_seconds: float = 1.0
+
+
+_MIN_ADAPTIVE_MESSAGES = 100
+_MIN_ADAPTIVE_BYTES = 1024 * 1024
+
+
+class BatchPolicy:
+    """
+    Decides when a batch is done. The configured limits are upper bounds. In adaptive mode the effective
+    message and byte limits are adjusted after each batch so that processing a batch takes roughly
+    target_batch_seconds, and they're allowed to grow faster while the queue has a backlog since larger
+    batches have less overhead per message.
+    """
+
+    def __init__(self, limits: BatchLimits = BatchLimits()) -> None:
+        self.limits = limits
+        self.message_limit = limits.max_messages
+        self.byte_limit = limits.max_bytes
+
+    def is_full(self, messages: int, size_bytes: int) -> bool:
+        return messages >= self.message_limit or size_bytes >= self.byte_limit
+
+    def is_expired(self, batch_age_seconds: float) -> bool:
+        return batch_age_seconds >= self.limits.max_latency_seconds
+
+    def is_idle(self, idle_seconds: float) -> bool:
+        return idle_seconds > self.limits.idle_seconds
+
+    def remaining_messages(self, messages: int, size_bytes: int = 0) -> int:
+        """
+        How many more messages to read into a batch. Once it has some, this also stops at how many more of
+        their average size fit under the byte limit.
+        """
+        remaining = self.message_limit - messages
+        if messages > 0 and size_bytes > 0:
+            remaining = min(remaining, (self.byte_limit - size_bytes) * messages // size_bytes)
+        return max(1, remaining)
+
+    def record(self, messages: int, size_bytes: int, processing_seconds: float, queue_depth: int) -> None:
+        """
+        Record how long a batch took to process so the limits can adapt. Does nothing unless adaptive.
+        """
+        if not self.limits.adaptive or messages == 0:
+            return
+
+        if queue_depth > 2 * self.message_limit:
+            # Falling behind, larger batches amortize the fixed cost of each batch.
+            ideal_messages = 2 * self.message_limit
+            ideal_bytes = 2 * self.byte_limit
+        else:
+            seconds = max(processing_seconds, 1e-3)
+            ideal_messages = int(messages / seconds * self.limits.target_batch_seconds)
+            ideal_bytes = int(size_bytes / seconds * self.limits.target_batch_seconds)
+
+        # Smooth out the changes so a single outlier batch doesn't swing the limits
+        self.message_limit = _clamp(
+            (self.message_limit + ideal_messages) // 2, _MIN_ADAPTIVE_MESSAGES, self.limits.max_messages
+        )
+        self.byte_limit = _clamp((self.byte_limit + ideal_bytes) // 2, _MIN_ADAPTIVE_BYTES, self.limits.max_bytes)
+
+
+def _clamp(value: int, lower: int, upper: int) -> int:
+    return max(min(value, upper), min(lower, upper))
@@ -0,0 +1,54 @@
+from .batch_policy import BatchLimits, BatchPolicy
+
+
+def test_static_limits() -> None:
+    policy = BatchPolicy(BatchLimits(max_messages=10, max_bytes=100))
+
+    assert not policy.is_full(9, 99)
+    assert policy.is_full(10, 0)
+    assert policy.is_full(0, 100)
+    assert policy.remaining_messages(4) == 6
+
+
+def test_remaining_messages_by_size() -> None:
+    policy = BatchPolicy(BatchLimits(max_messages=10, max_bytes=100))
+
+    # 2 messages of 20 bytes each so far, 3 more of those fit
+    assert policy.remaining_messages(2, 40) == 3
+    assert policy.remaining_messages(2, 0) == 8
+    # Always at least one, the byte limit is checked again after each read
+    assert policy.remaining_messages(2, 100) == 1
+
+
+def test_static_ignores_record() -> None:
+    policy = BatchPolicy(BatchLimits(max_messages=10_000))
+    policy.record(messages=10_000, size_bytes=1000, processing_seconds=100, queue_depth=0)
+
+    assert policy.message_limit == 10_000
+
+
+def test_adaptive_shrinks_slow_batches() -> None:
+    policy = BatchPolicy(BatchLimits(max_messages=10_000, adaptive=True, target_batch_seconds=1))
+    # 10k messages in 10s is 1k messages per second, so the ideal batch is 1k
+    for _ in range(10):
+        policy.record(messages=10_000, size_bytes=0, processing_seconds=10, queue_depth=0)
+
+    assert 1000 <= policy.message_limit < 1100
+
+
+def test_adaptive_grows_with_backlog() -> None:
+    policy = BatchPolicy(BatchLimits(max_messages=10_000, adaptive=True, target_batch_seconds=1))
+    policy.record(messages=10_000, size_bytes=0, processing_seconds=100, queue_depth=0)
+    shrunk = policy.message_limit
+
+    policy.record(messages=shrunk, size_bytes=0, processing_seconds=10, queue_depth=1_000_000)
+
+    assert policy.message_limit > shrunk
+
+
+def test_adaptive_respects_bounds() -> None:
+    policy = BatchPolicy(BatchLimits(max_messages=10_000, max_bytes=10_000_000, adaptive=True))
+    policy.record(messages=10_000, size_bytes=10_000_000, processing_seconds=0.001, queue_depth=10**9)
+
+    assert policy.message_limit == 10_000
+    assert policy.byte_limit == 10_000_000
@@ -0,0 +1,275 @@
+import logging
+import os
+import pickle
+import shutil
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Union
+from urllib.parse import quote, unquote
+
+from whylogs.api.logger.experimental.multi_dataset_logger.future_util import wait_result
+from whylogs.api.logger.experimental.multi_dataset_logger.message_processor import CloseMessage
+from whylogs.api.logger.experimental.multi_dataset_logger.multi_dataset_rolling_logger import (
+    DatasetProfileContainer,
+    FlushMessage,
+    LoggerMessage,
+    MultiDatasetRollingLogger,
+    TrackMessage,
+)
+from whylogs.api.logger.experimental.multi_dataset_logger.time_util import (
+    Schedule,
+    TimeGranularity,
+    current_time_ms,
+    truncate_time_ms,
+)
+from whylogs.api.logger.result_set import ResultSet, SegmentedResultSet, ViewResultSet
+from whylogs.api.writer import Writer
+from whylogs.core import DatasetProfile, DatasetProfileView, DatasetSchema
+from whylogs.core.segment import Segment
+
+_SUFFIX = ".checkpoint"
+
+
+@dataclass
+class ProfileSnapshot:
+    """
+    The serialized profile for one dataset timestamp, or its segments if the dataset is segmented.
+    """
+
+    profile: Optional[bytes] = None
+    segments: Dict[Segment, bytes] = field(default_factory=dict)
+
+
+@dataclass
+class LoggerSnapshot:
+    """
+    Every dataset timestamp that a logger has profiles for, and the snapshots of the ones that were asked for.
+    """
+
+    dataset_timestamps: Set[int]
+    profiles: Dict[int, ProfileSnapshot]
+
+
+@dataclass
+class SnapshotMessage:
+    result: "Future[LoggerSnapshot]"
+    changed_only: bool
+
+
+@dataclass
+class RestoreMessage:
+    profiles: Dict[int, ProfileSnapshot]
+    result: "Future[None]"
+
+
+class _RestorableContainer(DatasetProfileContainer):
+    """
+    A profile container that also holds profiles restored from a checkpoint. Those are kept as views since
+    whylogs can't turn a view back into a profile, and merged in when the container is flushed.
+    """
+
+    def __init__(self, dataset_timestamp: int, schema: Optional[DatasetSchema]) -> None:
+        super().__init__(dataset_timestamp, schema)
+        self._restored: Optional[DatasetProfileView] = None
+        self._restored_segments: Dict[Segment, DatasetProfileView] = {}
+
+    def restore(self, snapshot: ProfileSnapshot) -> None:
+        if snapshot.profile is not None:
+            view = DatasetProfileView.deserialize(snapshot.profile)
+            self._restored = view if self._restored is None else self._restored.merge(view)
+
+        for segment, data in snapshot.segments.items():
+            view = DatasetProfileView.deserialize(data)
+            existing = self._restored_segments.get(segment)
+            self._restored_segments[segment] = view if existing is None else existing.merge(view)
+
+    def _profile_view(self) -> Optional[DatasetProfileView]:
+        if not isinstance(self._target, DatasetProfile):
+            return None
+        view = self._target.view()
+        return view if self._restored is None else self._restored.merge(view)
+
+    def _segment_views(self) -> Dict[Segment, DatasetProfileView]:
+        if isinstance(self._target, DatasetProfile):
+            return {}
+        views = dict(self._restored_segments)
+        for segment, profile in self._target.get_segments().items():
+            view = profile.view()
+            views[segment] = view if segment not in views else views[segment].merge(view)
+        for view in views.values():
+            # Segment profiles don't get the dataset timestamp until the segment cache is flushed
+            view.dataset_timestamp = self._dataset_timestamp
+        return views
+
+    def snapshot(self) -> ProfileSnapshot:
+        """
+        Serialize everything in the container without flushing it.
+        """
+        view = self._profile_view()
+        return ProfileSnapshot(
+            profile=None if view is None else view.serialize(),
+            segments={segment: it.serialize() for segment, it in self._segment_views().items()},
+        )
+
+    def to_result_set(self) -> ResultSet:
+        if self._restored is None and not self._restored_segments:
+            return super().to_result_set()
+
+        if isinstance(self._target, DatasetProfile):
+            view = self._profile_view()
+            self._active = False
+            return ViewResultSet(view) if view is not None else super().to_result_set()
+
+        by_partition: Dict[str, Dict[Segment, Union[DatasetProfile, DatasetProfileView]]] = {}
+        for segment, view in self._segment_views().items():
+            by_partition.setdefault(segment.parent_id, {})[segment] = view
+        self._active = False
+        partitions = list(self._schema.segments.values()) if self._schema is not None else None
+        return SegmentedResultSet(segments=by_partition, partitions=partitions)
+
+
+class CheckpointingLogger(MultiDatasetRollingLogger):
+    """
+    A MultiDatasetRollingLogger that can snapshot its profiles without flushing them and restore them from those
+    snapshots. Snapshots are taken on the logger's own thread since whylogs profiles aren't safe to read while
+    they're being tracked to, so they only hold up logging to this dataset while they're being serialized.
+    """
+
+    def __init__(
+        self,
+        aggregate_by: TimeGranularity = TimeGranularity.Hour,
+        write_schedule: Schedule = Schedule(cadence=TimeGranularity.Minute, interval=10),
+        schema: Optional[DatasetSchema] = None,
+        writers: List[Writer] = [],
+    ) -> None:
+        # Dataset timestamps that were tracked to since the last snapshot of changes
+        self._changed: Set[int] = set()
+        super().__init__(aggregate_by=aggregate_by, write_schedule=write_schedule, schema=schema, writers=writers)
+
+    def _process_message(self, message: Union[LoggerMessage, CloseMessage]) -> None:
+        if isinstance(message, SnapshotMessage):
+            self._process_snapshot_message(message)
+        elif isinstance(message, RestoreMessage):
+            self._process_restore_message(message)
+        else:
+            super()._process_message(message)
+
+    def _get_profile_container(self, dataset_timestamp: int) -> DatasetProfileContainer:
+        if dataset_timestamp not in self._cache:
+            self._cache[dataset_timestamp] = _RestorableContainer(dataset_timestamp, schema=self._schema)
+        return self._cache[dataset_timestamp]
+
+    def _process_track_message(self, message: TrackMessage) -> None:
+        super()._process_track_message(message)
+        self._changed.add(truncate_time_ms(message.timestamp_ms or current_time_ms(), self._aggregate_by))
+
+    def _process_flush_message(self, message: FlushMessage) -> None:
+        super()._process_flush_message(message)
+        self._changed.clear()
+
+    def _process_snapshot_message(self, message: SnapshotMessage) -> None:
+        try:
+            timestamps = self._changed & self._cache.keys() if message.changed_only else self._cache.keys()
+            profiles = {ts: _as_restorable(self._cache[ts]).snapshot() for ts in timestamps}
+            if message.changed_only:
+                self._changed.clear()
+            message.result.set_result(LoggerSnapshot(dataset_timestamps=set(self._cache.keys()), profiles=profiles))
+        except Exception as e:
+            message.result.set_exception(e)
+
+    def _process_restore_message(self, message: RestoreMessage) -> None:
+        try:
+            for dataset_timestamp, snapshot in message.profiles.items():
+                _as_restorable(self._get_profile_container(dataset_timestamp)).restore(snapshot)
+            message.result.set_result(None)
+        except Exception as e:
+            message.result.set_exception(e)
+
+    def snapshot(self, changed_only: bool = False) -> "Future[LoggerSnapshot]":
+        """
+        Serialize the profiles that haven't been flushed yet. With changed_only, only the ones that were logged to
+        since the last time this was called with changed_only are serialized.
+        """
+        result: Future[LoggerSnapshot] = Future()
+        self.send(SnapshotMessage(result, changed_only))
+        return result
+
+    def restore(self, profiles: Dict[int, ProfileSnapshot]) -> None:
+        """
+        Merge snapshots back into the logger. They're uploaded along with everything else for their dataset
+        timestamp the next time the logger flushes.
+        """
+        result: Future[None] = Future()
+        self.send(RestoreMessage(profiles, result))
+        wait_result(result)
+
+
+def _as_restorable(container: DatasetProfileContainer) -> _RestorableContainer:
+    if not isinstance(container, _RestorableContainer):
+        raise Exception(f"Expected a restorable profile container, got {type(container).__name__}")
+    return container
+
+
+class Checkpoints:
+    """
+    Snapshots of in-progress profiles saved to a directory so that they survive the process crashing. There's a
+    file for each dataset id and dataset timestamp so that a checkpoint only has to rewrite the ones that changed.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._logger = logging.getLogger(f"{type(self).__name__}_{id(self)}")
+        os.makedirs(directory, exist_ok=True)
+
+    def _dataset_directory(self, dataset_id: str) -> str:
+        # Dataset ids come from requests, so escape them to keep them from pointing anywhere else
+        return os.path.join(self.directory, quote(dataset_id, safe=""))
+
+    def save(self, dataset_id: str, dataset_timestamp: int, snapshot: ProfileSnapshot) -> None:
+        directory = self._dataset_directory(dataset_id)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{dataset_timestamp}{_SUFFIX}")
+        # Write it under a temporary name so that a partially written file never replaces the last checkpoint
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def retain(self, dataset_id: str, dataset_timestamps: Set[int]) -> None:
+        """
+        Remove the checkpoints for every other dataset timestamp, like the ones that were flushed since.
+        """
+        directory = self._dataset_directory(dataset_id)
+        if not os.path.isdir(directory):
+            return
+
+        for name in os.listdir(directory):
+            if name.endswith(_SUFFIX) and int(name[: -len(_SUFFIX)]) not in dataset_timestamps:
+                os.remove(os.path.join(directory, name))
+
+    def remove(self, dataset_id: str) -> None:
+        shutil.rmtree(self._dataset_directory(dataset_id), ignore_errors=True)
+
+    def load(self) -> Dict[str, Dict[int, ProfileSnapshot]]:
+        """
+        Every saved snapshot by dataset id and then dataset timestamp.
+        """
+        checkpoints: Dict[str, Dict[int, ProfileSnapshot]] = {}
+        for dataset_name in sorted(os.listdir(self.directory)):
+            directory = os.path.join(self.directory, dataset_name)
+            if not os.path.isdir(directory):
+                continue
+
+            for name in sorted(os.listdir(directory)):
+                if not name.endswith(_SUFFIX):
+                    continue
+
+                path = os.path.join(directory, name)
+                try:
+                    with open(path, "rb") as f:
+                        snapshot: ProfileSnapshot = pickle.load(f)
+                    checkpoints.setdefault(unquote(dataset_name), {})[int(name[: -len(_SUFFIX)])] = snapshot
+                except Exception as e:
+                    self._logger.error(f"Skipping unreadable checkpoint {path}: {e}")
+
+        return checkpoints
@@ -0,0 +1,97 @@
+from typing import Any, List, Optional, Tuple
+
+import pandas as pd
+from whylogs.api.logger.experimental.multi_dataset_logger.time_util import TimeGranularity
+from whylogs.api.writer import Writer
+from whylogs.api.writer.writer import Writable
+from whylogs.core import DatasetProfileView
+
+from .checkpoints import CheckpointingLogger, Checkpoints
+
+_DAY_MS = 24 * 60 * 60 * 1000
+_DAY_1 = 1677024000000  # 2023-02-22
+_DAY_2 = _DAY_1 + _DAY_MS
+
+
+class _CollectingWriter(Writer):
+    def __init__(self) -> None:
+        self.writables: List[Writable] = []
+
+    def write(self, file: Writable, dest: Optional[str] = None, **kwargs: Any) -> Tuple[bool, str]:
+        self.writables.append(file)
+        return True, "ok"
+
+    def option(self, **kwargs: Any) -> "_CollectingWriter":
+        return self
+
+
+def _count(view: DatasetProfileView, column: str) -> int:
+    counts = view.get_column(column).get_metric("counts")
+    assert counts is not None
+    return int(counts.n.value)
+
+
+def test_snapshot_only_changed() -> None:
+    logger = CheckpointingLogger(aggregate_by=TimeGranularity.Day)
+    logger.log(pd.DataFrame({"a": [1, 2]}), timestamp_ms=_DAY_1, sync=True)
+    logger.log(pd.DataFrame({"a": [3]}), timestamp_ms=_DAY_2, sync=True)
+
+    first = logger.snapshot(changed_only=True).result()
+    assert first.dataset_timestamps == {_DAY_1, _DAY_2}
+    assert first.profiles.keys() == {_DAY_1, _DAY_2}
+
+    logger.log(pd.DataFrame({"a": [4]}), timestamp_ms=_DAY_2 + 1000, sync=True)
+    second = logger.snapshot(changed_only=True).result()
+    assert second.profiles.keys() == {_DAY_2}
+    profile = second.profiles[_DAY_2].profile
+    assert profile is not None
+    assert _count(DatasetProfileView.deserialize(profile), "a") == 2
+
+    # Snapshots of everything don't affect what counts as changed
+    assert logger.snapshot().result().profiles.keys() == {_DAY_1, _DAY_2}
+    assert logger.snapshot(changed_only=True).result().profiles == {}
+    logger.close()
+
+
+def test_restore_from_checkpoint(tmp_path: str) -> None:
+    checkpoints = Checkpoints(str(tmp_path))
+    logger = CheckpointingLogger(aggregate_by=TimeGranularity.Day)
+    logger.log(pd.DataFrame({"a": [1, 2, 3]}), timestamp_ms=_DAY_1, sync=True)
+    logger.log(pd.DataFrame({"a": [4]}), timestamp_ms=_DAY_2, sync=True)
+    snapshot = logger.snapshot(changed_only=True).result()
+    for dataset_timestamp, profile in snapshot.profiles.items():
+        checkpoints.save("model/1", dataset_timestamp, profile)
+    logger.close()
+
+    # Data logged after restoring gets merged with the restored profiles when they're written
+    writer = _CollectingWriter()
+    restored = CheckpointingLogger(aggregate_by=TimeGranularity.Day, writers=[writer])
+    loaded = Checkpoints(str(tmp_path)).load()
+    assert list(loaded.keys()) == ["model/1"]
+    restored.restore(loaded["model/1"])
+    restored.log(pd.DataFrame({"a": [5, 6]}), timestamp_ms=_DAY_1, sync=True)
+    restored.close()
+
+    counts = {
+        int(it.dataset_timestamp.timestamp() * 1000): _count(it, "a")
+        for it in writer.writables
+        if isinstance(it, DatasetProfileView)
+    }
+    assert counts == {_DAY_1: 5, _DAY_2: 1}
+
+
+def test_retain_and_remove(tmp_path: str) -> None:
+    checkpoints = Checkpoints(str(tmp_path))
+    logger = CheckpointingLogger(aggregate_by=TimeGranularity.Day)
+    logger.log(pd.DataFrame({"a": [1]}), timestamp_ms=_DAY_1, sync=True)
+    logger.log(pd.DataFrame({"a": [1]}), timestamp_ms=_DAY_2, sync=True)
+    for dataset_timestamp, profile in logger.snapshot().result().profiles.items():
+        checkpoints.save("model-1", dataset_timestamp, profile)
+        checkpoints.save("model-2", dataset_timestamp, profile)
+    logger.close()
+
+    checkpoints.retain("model-1", {_DAY_2})
+    checkpoints.remove("model-2")
+    loaded = checkpoints.load()
+    assert loaded.keys() == {"model-1"}
+    assert loaded["model-1"].keys() == {_DAY_2}
@@ -0,0 +1,97 @@
+from collections import deque
+from typing import Callable, Deque, Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+M = TypeVar("M")
+
+
+class _Segment(Generic[M]):
+    """
+    The data messages between two barriers, one sub-queue per key. The dict's order is the round robin order,
+    a key goes to the back once it's had its turn.
+    """
+
+    def __init__(self) -> None:
+        self.queues: Dict[Optional[Hashable], Deque[Tuple[M, int]]] = {}
+        self.barrier: Optional[M] = None
+
+
+class FairQueue(Generic[M]):
+    """
+    Messages that an actor has read off of its queue but hasn't processed yet, in a sub-queue per key (the
+    dataset id). Batches are taken from the keys in turn instead of in the order the messages arrived, so one
+    busy dataset only gets its share of each batch and a quiet dataset doesn't wait behind its backlog. Each
+    turn takes up to weight(key) messages from a key.
+
+    Barriers keep their place. Everything that was put before one is taken before it and nothing that was put
+    after it is taken until it has been. Messages with the same key are always taken in order.
+    """
+
+    def __init__(
+        self,
+        key: Callable[[M], Optional[Hashable]],
+        weight: Callable[[Optional[Hashable]], int] = lambda _: 1,
+        max_messages: int = 100_000,
+        max_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        self.key = key
+        self.weight = weight
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._messages = 0
+        self._segments: Deque[_Segment[M]] = deque()
+
+    def __len__(self) -> int:
+        return self._messages
+
+    def is_full(self) -> bool:
+        """
+        Whether the actor should stop reading ahead from its queue until some of these have been processed.
+        """
+        return self._messages >= self.max_messages or self.size_bytes >= self.max_bytes
+
+    def put(self, message: M, size_bytes: int = 0, barrier: bool = False) -> None:
+        if not self._segments or self._segments[-1].barrier is not None:
+            self._segments.append(_Segment())
+        segment = self._segments[-1]
+        self._messages += 1
+        if barrier:
+            segment.barrier = message
+            return
+
+        self.size_bytes += size_bytes
+        key = self.key(message)
+        queue = segment.queues.get(key)
+        if queue is None:
+            queue = segment.queues[key] = deque()
+        queue.append((message, size_bytes))
+
+    def take(self, max_messages: int, max_bytes: int) -> List[M]:
+        """
+        Take up to max_messages messages, stopping early once they add up to max_bytes.
+        """
+        batch: List[M] = []
+        batch_bytes = 0
+        while self._segments and len(batch) < max_messages and batch_bytes < max_bytes:
+            segment = self._segments[0]
+            if segment.queues:
+                key = next(iter(segment.queues))
+                queue = segment.queues.pop(key)
+                for _ in range(max(1, self.weight(key))):
+                    message, size_bytes = queue.popleft()
+                    batch.append(message)
+                    batch_bytes += size_bytes
+                    if not queue or len(batch) >= max_messages or batch_bytes >= max_bytes:
+                        break
+                if queue:
+                    segment.queues[key] = queue
+            elif segment.barrier is not None:
+                batch.append(segment.barrier)
+                self._segments.popleft()
+            else:
+                # Only the last segment can be without a barrier, and it's empty
+                break
+
+        self._messages -= len(batch)
+        self.size_bytes -= batch_bytes
+        return batch
@@ -0,0 +1,54 @@
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+from .fair_queue import FairQueue
+
+Message = Tuple[Optional[str], int]
+
+
+def _queue(weights: Optional[Dict[Hashable, int]] = None) -> FairQueue[Message]:
+    return FairQueue(lambda it: it[0], weight=lambda key: (weights or {}).get(key, 1))
+
+
+def _put(queue: FairQueue[Message], messages: Iterable[Message]) -> None:
+    for message in messages:
+        # Messages without a key are barriers in these tests
+        queue.put(message, size_bytes=10, barrier=message[0] is None)
+
+
+def test_round_robin() -> None:
+    queue = _queue()
+    _put(queue, [("a", i) for i in range(5)] + [("b", 0), ("c", 0), ("b", 1)])
+
+    assert queue.take(4, 1000) == [("a", 0), ("b", 0), ("c", 0), ("a", 1)]
+    # Whoever didn't get a turn in the last batch goes first
+    assert queue.take(10, 1000) == [("b", 1), ("a", 2), ("a", 3), ("a", 4)]
+    assert len(queue) == 0
+    assert queue.size_bytes == 0
+
+
+def test_weights() -> None:
+    queue = _queue({"a": 3})
+    _put(queue, [("a", i) for i in range(6)] + [("b", i) for i in range(2)])
+
+    assert queue.take(100, 1000) == [("a", 0), ("a", 1), ("a", 2), ("b", 0), ("a", 3), ("a", 4), ("a", 5), ("b", 1)]
+
+
+def test_barriers_keep_their_place() -> None:
+    queue = _queue()
+    _put(queue, [("a", 0), ("a", 1), ("b", 0), (None, 0), ("b", 1), (None, 1), (None, 2), ("a", 2)])
+
+    assert queue.take(2, 1000) == [("a", 0), ("b", 0)]
+    assert queue.take(100, 1000) == [("a", 1), (None, 0), ("b", 1), (None, 1), (None, 2), ("a", 2)]
+
+
+def test_limits() -> None:
+    queue = FairQueue[Message](lambda it: it[0], max_messages=3, max_bytes=1000)
+    _put(queue, [("a", 0), ("b", 0)])
+    assert not queue.is_full()
+    _put(queue, [("a", 1)])
+    assert queue.is_full()
+
+    assert queue.take(100, 15) == [("a", 0), ("b", 0)]
+    assert len(queue) == 1
+    assert queue.size_bytes == 10
+    assert not queue.is_full()
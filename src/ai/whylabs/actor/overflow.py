@@ -0,0 +1,19 @@
+from enum import Enum
+
+
+class OverflowPolicy(Enum):
+    """
+    What send() does when the queue is full.
+
+    BLOCK: Wait for room in the queue without blocking the event loop, up to a deadline.
+    REJECT: Fail immediately.
+    SPILL: Write the message to the actor's spill queue on disk instead.
+    """
+
+    BLOCK = "BLOCK"
+    REJECT = "REJECT"
+    SPILL = "SPILL"
+
+
+class QueueFullError(Exception):
+    pass
@@ -0,0 +1,55 @@
+import logging
+import os
+import pickle
+import uuid
+from typing import List, Tuple
+
+from whylogs.api.writer.writer import Writable
+
+_SUFFIX = ".profile"
+
+
+class PendingUploads:
+    """
+    Profiles that couldn't be uploaded before shutdown, saved to a directory so that they can be
+    uploaded on the next start. Each one is a separate file that's deleted once it's been uploaded.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._logger = logging.getLogger(f"{type(self).__name__}_{id(self)}")
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, dataset_id: str, writable: Writable) -> str:
+        path = os.path.join(self.directory, f"{uuid.uuid4().hex}{_SUFFIX}")
+        # Write it under a temporary name so that a partially written file is never loaded
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((dataset_id, writable), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        return path
+
+    def load(self) -> List[Tuple[str, str, Writable]]:
+        """
+        Every saved profile as (path, dataset id, profile).
+        """
+        pending: List[Tuple[str, str, Writable]] = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(_SUFFIX):
+                continue
+
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, "rb") as f:
+                    dataset_id, writable = pickle.load(f)
+                pending.append((path, dataset_id, writable))
+            except Exception as e:
+                self._logger.error(f"Skipping unreadable pending upload {path}: {e}")
+
+        return pending
+
+    def remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
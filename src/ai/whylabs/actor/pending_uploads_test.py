@@ -0,0 +1,29 @@
+import os
+
+import pandas as pd
+import whylogs as why
+
+from .pending_uploads import PendingUploads
+
+
+def test_save_load_remove(tmp_path: str) -> None:
+    pending = PendingUploads(str(tmp_path))
+    view = why.log(pd.DataFrame({"a": [1, 2, 3]})).view()
+    path = pending.save("model-1", view)
+
+    loaded = PendingUploads(str(tmp_path)).load()
+    assert [(it[0], it[1]) for it in loaded] == [(path, "model-1")]
+    assert loaded[0][2].get_column("a").get_metric("counts").n.value == 3
+
+    pending.remove(path)
+    assert pending.load() == []
+
+
+def test_skips_unreadable_files(tmp_path: str) -> None:
+    pending = PendingUploads(str(tmp_path))
+    with open(os.path.join(tmp_path, "broken.profile"), "wb") as f:
+        f.write(b"not a pickle")
+    with open(os.path.join(tmp_path, "partial.profile.tmp"), "wb") as f:
+        f.write(b"")
+
+    assert pending.load() == []
@@ -1,47 +1,317 @@
 import os
 import time
-from functools import reduce
-from itertools import groupby
-from typing import Dict, List, Optional, Type, Union, cast
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import partial
+from collections import defaultdict, deque
+from dataclasses import dataclass, replace
+from typing import Callable, DefaultDict, Deque, Dict, List, Optional, Tuple, Type, TypeVar, Union, cast
 
+import numpy as np
+import pandas as pd
 from faster_fifo import Queue
+from whylabs_client import ApiClient, Configuration
 from whylabs_toolkit.container.config_types import DatasetCadence, DatasetUploadCadenceGranularity
-from whylogs.api.logger.experimental.multi_dataset_logger.multi_dataset_rolling_logger import MultiDatasetRollingLogger
 from whylogs.api.logger.experimental.multi_dataset_logger.time_util import Schedule
 from whylogs.api.logger.experimental.multi_dataset_logger.time_util import TimeGranularity as yTimeGranularity
-from whylogs.api.writer import Writers
+from whylogs.api.logger.experimental.multi_dataset_logger.message_processor import (
+    CloseMessage as LoggerCloseMessage,
+)
+from whylogs.api.writer import Writer, Writers
+from whylogs.api.writer.writer import Writable
+from whylogs import __version__ as whylogs_version
+from whylogs.core import DatasetProfileView, DatasetSchema
 
-from ...util.string_util import encode_strings
-from ..container.config import ContainerConfig, get_dataset_options
+from ...util.cache_util import BoundedCache
+from ...util.list_util import group_by_key
+from ...util.metrics import MetricFamily
+from ...util.time import TimeGranularity, truncate_time_ms, truncate_times_ms
+from ..container.config import ContainerConfig, EnvVarNames, get_dataset_options
 from .actor import Actor, CloseMessage
+from .batch_policy import BatchLimits, BatchPolicy
+from .checkpoints import CheckpointingLogger, Checkpoints, LoggerSnapshot
+from .fair_queue import FairQueue
+from .spill_queue import SpillQueue
+from .pending_uploads import PendingUploads
+from .quarantine import Quarantine
+from .shared_arena import SharedArena
+from .writers import MeteredWriter, PooledWriter, UploadPool
 from .profile_actor_messages import (
     DebugMessage,
-    LogEmbeddingRequestDict,
+    InvalidRequestError,
     LogRequestDict,
     PublishMessage,
+    RawLogArrowMessage,
     RawLogEmbeddingsMessage,
     RawLogMessage,
-    determine_dataset_timestamp,
     get_columns,
     get_embeddings_columns,
-    log_dict_to_data_frame,
-    log_dict_to_embedding_matrix,
-    reduce_embeddings_request,
-    reduce_log_requests,
+    get_message_dataset_id,
+    get_timestamp_column,
+    log_dicts_to_data_frame,
+    log_dicts_to_embedding_matrix,
+    split_by_row_timestamp,
 )
 
-MessageType = Union[DebugMessage, PublishMessage, RawLogMessage, RawLogEmbeddingsMessage]
+# Extra time to wait for the profiling process past the shutdown deadline before killing it
+_SHUTDOWN_GRACE_SECONDS = 5
+_MIN_FLUSH_SECONDS = 1
+
+# Keep warnings about bad requests readable, the quarantine has the full error
+_MAX_ERROR_LENGTH = 500
+
+LogMessageType = Union[RawLogMessage, RawLogEmbeddingsMessage, RawLogArrowMessage]
+MessageType = Union[DebugMessage, PublishMessage, LogMessageType]
+M = TypeVar("M", bound=LogMessageType)
+R = TypeVar("R")
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class DatasetSettings:
+    """
+    A dataset's custom options merged with the container's defaults.
+    """
+
+    dataset_cadence: DatasetCadence
+    # How data is bucketed into dataset timestamps, the same as aggregate_by
+    granularity: TimeGranularity
+    aggregate_by: yTimeGranularity
+    upload_cadence: DatasetUploadCadenceGranularity
+    upload_interval: int
+    write_schedule: Schedule
+    schema: Optional[DatasetSchema]
+
+
+@dataclass
+class GroupingStats:
+    """
+    How well the messages in a batch were combined before being logged. Every group is one call to
+    the whylogs logger, so fewer and larger groups are better.
+    """
+
+    messages: int = 0
+    groups: int = 0
+    rows: int = 0
+    max_rows_per_group: int = 0
+
+    def add_group(self, rows: int) -> None:
+        self.groups += 1
+        self.rows += rows
+        self.max_rows_per_group = max(self.max_rows_per_group, rows)
+
+    def mean_rows_per_group(self) -> float:
+        return self.rows / self.groups if self.groups else 0.0
+
+    def merge(self, other: "GroupingStats") -> None:
+        self.messages += other.messages
+        self.groups += other.groups
+        self.rows += other.rows
+        self.max_rows_per_group = max(self.max_rows_per_group, other.max_rows_per_group)
 
 
 class ProfileActor(Actor[MessageType]):
-    def __init__(self, queue: Queue, env_vars: ContainerConfig = ContainerConfig()) -> None:
-        super().__init__(queue)
+    def __init__(
+        self,
+        queue: Queue,
+        env_vars: ContainerConfig = ContainerConfig(),
+        spill_queue: Optional[SpillQueue] = None,
+        pending_uploads: Optional[PendingUploads] = None,
+        checkpoints: Optional[Checkpoints] = None,
+        shared_arena: Optional[SharedArena] = None,
+        quarantine: Optional[Quarantine] = None,
+    ) -> None:
+        batch_limits = BatchLimits(
+            max_messages=env_vars.max_batch_messages,
+            max_bytes=env_vars.max_batch_bytes,
+            max_latency_seconds=env_vars.max_batch_latency_seconds,
+            idle_seconds=env_vars.batch_idle_seconds,
+            adaptive=env_vars.adaptive_batching,
+        )
+        deadline_seconds = env_vars.shutdown_deadline_seconds
+        weights = env_vars.dataset_weights
+        fair_queue: Optional[FairQueue[MessageType]] = (
+            FairQueue(
+                get_message_dataset_id,
+                weight=lambda dataset_id: weights.get(cast(str, dataset_id), 1),
+                max_messages=env_vars.fair_queue_max_messages,
+                max_bytes=env_vars.fair_queue_max_bytes,
+            )
+            if env_vars.fair_queue_max_messages > 0
+            else None
+        )
+        super().__init__(
+            queue,
+            BatchPolicy(batch_limits),
+            overflow_policy=env_vars.queue_overflow_policy,
+            overflow_deadline_seconds=env_vars.queue_overflow_deadline_seconds,
+            spill_queue=spill_queue,
+            durable=env_vars.durable_queue,
+            # The process enforces the deadline itself, this is only a backstop in case it gets stuck.
+            shutdown_timeout_seconds=None if deadline_seconds is None else deadline_seconds + _SHUTDOWN_GRACE_SECONDS,
+            fair_queue=fair_queue,
+        )
         # NOTE, this is created before the process forks. You can't access this from the original process via
         # a method. You need some sort of IPC signal.
-        self.loggers: Dict[str, MultiDatasetRollingLogger] = {}
+        # Loggers for datasets that haven't been used in a while are flushed and dropped to bound memory
+        self.loggers: BoundedCache[str, CheckpointingLogger] = BoundedCache(
+            max_size=env_vars.max_loggers, idle_seconds=env_vars.logger_idle_seconds
+        )
         self.env_vars = env_vars
+        # Resolved once per dataset since looking up the options and working out the schedule isn't free
+        self._settings: Dict[str, DatasetSettings] = {}
+        # Totals since startup for each message type, logged along with the debug info.
+        self.grouping_stats: DefaultDict[str, GroupingStats] = defaultdict(GroupingStats)
+        # Every dataset gets its own samples, which have to fit in the actor's metrics snapshot
+        self.metrics.limit_label("dataset_id", env_vars.metrics_max_datasets)
+        self.metrics.counter("profile_rows_total", "Rows profiled by dataset")
+        self.metrics.gauge("profile_columns", "Columns in the most recently profiled data by dataset")
+        self.metrics.histogram("profile_parse_seconds", "Time spent parsing and combining requests in a batch")
+        self.metrics.histogram("profile_log_seconds", "Time spent in whylogs profiling the data in a batch")
+        self.upload_pool = UploadPool(
+            self.metrics,
+            max_workers=env_vars.upload_workers,
+            max_pending=env_vars.upload_max_pending,
+            max_attempts=env_vars.upload_max_attempts,
+        )
+        # Shared by every dataset's writer so that they reuse the same connections
+        self._api_client: Optional[ApiClient] = None
+        # Where profiles that can't be uploaded before the shutdown deadline go
+        self.pending_uploads = pending_uploads
+        # Profiles saved during the last shutdown that haven't been handed to the upload pool yet
+        self._recovered: Deque[Tuple[str, str, Writable]] = deque()
+        self.metrics.counter("profiles_saved_total", "Profiles saved to disk at shutdown instead of uploaded")
+        # Where in-progress profiles are periodically saved so that they survive a crash
+        self.checkpoints = checkpoints
+        self._last_checkpoint_time = time.monotonic()
+        self._checkpoint_job: Optional[Future[None]] = None
+        # Created on first use so that the thread is started in the actor process
+        self._checkpoint_executor: Optional[ThreadPoolExecutor] = None
+        self.metrics.gauge("profile_loggers", "Dataset loggers in memory")
+        self.metrics.counter("logger_evictions_total", "Loggers flushed and dropped by reason")
+        self.metrics.histogram("checkpoint_seconds", "Time to save the profiles that changed since the last checkpoint")
+        self.metrics.counter("checkpoint_profiles_total", "Profiles saved by checkpoints")
+        # Large request bodies are written here by the http processes and only a reference goes through the queue
+        self.shared_arena = shared_arena
+        # Where requests that can't be logged go, instead of failing the rest of their batch
+        self.quarantine = quarantine
+        self.metrics.counter("messages_quarantined_total", "Requests that couldn't be logged by type and reason")
+
+    def message_size(self, message: MessageType) -> int:
+        if isinstance(message, (RawLogMessage, RawLogEmbeddingsMessage)) and message.shared_request is not None:
+            return message.shared_request.length
+        if isinstance(message, (RawLogMessage, RawLogEmbeddingsMessage, RawLogArrowMessage)):
+            return len(message.request)
+        return 0
+
+    def _prepare_put(self, message: Union[CloseMessage, MessageType]) -> Union[CloseMessage, MessageType]:
+        """
+        Move a large request body into shared memory so that only a small reference is pickled through the
+        queue. The original message is used if the body is small or the shared memory is full. Arrow messages
+        are always sent as they are since their tables would keep pointing into the shared memory.
+        """
+        if (
+            self.shared_arena is None
+            or not isinstance(message, (RawLogMessage, RawLogEmbeddingsMessage))
+            or len(message.request) < self.env_vars.shared_memory_min_request_bytes
+        ):
+            return message
 
-    def _create_logger(self, dataset_id: str) -> MultiDatasetRollingLogger:
+        slot = self.shared_arena.allocate(message.request)
+        if slot is None:
+            return message
+        return replace(message, request=b"", shared_request=slot)
+
+    def _discard_put(self, message: Union[CloseMessage, MessageType]) -> None:
+        # Spilled messages keep their original body, so the slot can be reused right away
+        if (
+            self.shared_arena is not None
+            and isinstance(message, (RawLogMessage, RawLogEmbeddingsMessage))
+            and message.shared_request is not None
+        ):
+            self.shared_arena.release(message.shared_request)
+
+    def collect_metrics(self) -> List[MetricFamily]:
+        families = super().collect_metrics()
+        if self.shared_arena is not None:
+            families.append(
+                MetricFamily(
+                    "shared_memory_used_bytes",
+                    "gauge",
+                    "Shared memory held by requests that haven't been processed yet",
+                    samples={(): self.shared_arena.used_bytes()},
+                )
+            )
+        return families
+
+    def is_data_message(self, message: Union[CloseMessage, MessageType]) -> bool:
+        return isinstance(message, (RawLogMessage, RawLogEmbeddingsMessage, RawLogArrowMessage))
+
+    def _get_api_client(self) -> ApiClient:
+        if self._api_client is None:
+            # Configured the way the whylabs writer configures the one it would otherwise create for each writer
+            config = Configuration(host=self.env_vars.whylabs_api_endpoint)
+            config.api_key = {"ApiKeyAuth": self.env_vars.whylabs_api_key}
+            config.discard_unknown_keys = True
+            config.client_side_validation = False
+            self._api_client = ApiClient(config)
+            self._api_client.user_agent = f"whylogs/python/{whylogs_version}"
+        return self._api_client
+
+    def _create_writer(self, dataset_id: str) -> Writer:
+        whylabs_writer = Writers.get(
+            "whylabs",
+            org_id=self.env_vars.whylabs_org_id,
+            api_key=self.env_vars.whylabs_api_key,
+            dataset_id=dataset_id,
+            api_client=self._get_api_client(),
+        )
+        return MeteredWriter(whylabs_writer, self.metrics, dataset_id)
+
+    def on_start(self) -> None:
+        self._restore_checkpoints()
+        self._upload_pending()
+
+    def _restore_checkpoints(self) -> None:
+        if self.checkpoints is None:
+            return
+
+        restored = self.checkpoints.load()
+        for dataset_id, profiles in restored.items():
+            self._logger.info(f"Restoring {len(profiles)} profiles for {dataset_id} from the last checkpoint")
+            self._get_logger(dataset_id).restore(profiles)
+        self._last_checkpoint_time = time.monotonic()
+
+    def _upload_pending(self) -> None:
+        if self.pending_uploads is None:
+            return
+
+        self._recovered.extend(self.pending_uploads.load())
+        if self._recovered:
+            self._logger.info(f"Uploading {len(self._recovered)} profiles that were saved during the last shutdown")
+        self._submit_recovered()
+
+    def _submit_recovered(self) -> None:
+        # These only go to the upload pool as it has room, waiting for it would hold up processing messages
+        while self._recovered:
+            path, dataset_id, writable = self._recovered[0]
+            submitted = self.upload_pool.submit(
+                self._create_writer(dataset_id),
+                writable,
+                dataset_id,
+                on_done=partial(self._on_recovered_upload, path),
+                saved_path=path,
+                block=False,
+            )
+            if not submitted:
+                return
+            self._recovered.popleft()
+
+    def _on_recovered_upload(self, path: str, success: bool) -> None:
+        # Failed uploads stay on disk to be retried on the next start
+        if success and self.pending_uploads is not None:
+            self.pending_uploads.remove(path)
+
+    def _resolve_settings(self, dataset_id: str) -> DatasetSettings:
         options = get_dataset_options(dataset_id)
         upload_interval = (
             options and options.whylabs_upload_cadence.interval
@@ -65,34 +335,173 @@ class ProfileActor(Actor[MessageType]):
             schedule = Schedule(cadence=yTimeGranularity.Hour, interval=upload_interval)
         elif upload_cadence == DatasetUploadCadenceGranularity.MINUTE:
             schedule = Schedule(cadence=yTimeGranularity.Minute, interval=upload_interval)
+        else:
+            raise Exception(f"Unknown upload cadence {upload_cadence}")
 
-        whylabs_writer = Writers.get(
-            "whylabs", org_id=self.env_vars.whylabs_org_id, api_key=self.env_vars.whylabs_api_key, dataset_id=dataset_id
-        )
-        logger = MultiDatasetRollingLogger(
+        return DatasetSettings(
+            dataset_cadence=dataset_cadence,
+            granularity=TimeGranularity.D if dataset_cadence == DatasetCadence.DAILY else TimeGranularity.H,
             aggregate_by=aggregate_by,
-            writers=[whylabs_writer],
-            schema=options and options.schema,
+            upload_cadence=upload_cadence,
+            upload_interval=upload_interval,
             write_schedule=schedule,
+            schema=options and options.schema,
+        )
+
+    def _get_settings(self, dataset_id: str) -> DatasetSettings:
+        settings = self._settings.get(dataset_id)
+        if settings is None:
+            settings = self._resolve_settings(dataset_id)
+            self._settings[dataset_id] = settings
+        return settings
+
+    def _dataset_timestamp(self, dataset_id: str, timestamp: int) -> int:
+        return truncate_time_ms(timestamp, self._get_settings(dataset_id).granularity)
+
+    def _dataset_timestamps(self, timestamps: List[Tuple[str, int]]) -> List[int]:
+        """
+        _dataset_timestamp for a whole batch of (dataset id, timestamp) pairs, truncated a dataset at a time
+        instead of one message at a time.
+        """
+        try:
+            values = np.fromiter((it[1] for it in timestamps), dtype=np.int64, count=len(timestamps))
+        except OverflowError:
+            # Only timestamps that fit in 64 bits can be truncated together
+            return [self._dataset_timestamp(dataset_id, timestamp) for dataset_id, timestamp in timestamps]
+
+        result = np.empty(len(timestamps), dtype=np.int64)
+        for dataset_id, indexes in group_by_key(range(len(timestamps)), lambda i: timestamps[i][0]).items():
+            positions = np.array(indexes)
+            result[positions] = truncate_times_ms(values[positions], self._get_settings(dataset_id).granularity)
+        truncated: List[int] = result.tolist()
+        return truncated
+
+    def _create_logger(self, dataset_id: str) -> CheckpointingLogger:
+        settings = self._get_settings(dataset_id)
+        logger = CheckpointingLogger(
+            aggregate_by=settings.aggregate_by,
+            writers=[PooledWriter(self._create_writer(dataset_id), self.upload_pool, dataset_id)],
+            schema=settings.schema,
+            write_schedule=settings.write_schedule,
         )
 
         self._logger.info(
-            f"Created logger for {dataset_id} with interval {upload_interval} and upload cadence {upload_cadence}"
+            f"Created logger for {dataset_id} with interval {settings.upload_interval} and upload cadence "
+            f"{settings.upload_cadence}"
         )
         return logger
 
-    def _get_logger(self, dataset_id: str) -> MultiDatasetRollingLogger:
-        if not dataset_id in self.loggers:
-            self.loggers[dataset_id] = self._create_logger(dataset_id)
-        return self.loggers[dataset_id]
+    def _get_logger(self, dataset_id: str) -> CheckpointingLogger:
+        logger = self.loggers.get(dataset_id)
+        if logger is not None:
+            return logger
+
+        logger = self._create_logger(dataset_id)
+        for evicted_id, evicted in self.loggers.put(dataset_id, logger):
+            self._evict_logger(evicted_id, evicted, "lru")
+        self.metrics.set("profile_loggers", len(self.loggers))
+        return logger
+
+    def _evict_logger(self, dataset_id: str, logger: CheckpointingLogger, reason: str) -> None:
+        self._logger.info(f"Evicting the logger for {dataset_id} ({reason})")
+        # Closing flushes everything to the upload pool
+        logger.close()
+        if self.checkpoints is not None:
+            checkpoints = self.checkpoints
+            if self._checkpoint_job is None:
+                checkpoints.remove(dataset_id)
+            else:
+                # A checkpoint that's still being saved could write this dataset's profiles after they're removed,
+                # so they're removed once it's done instead of waiting on it here. The next checkpoint runs on the
+                # same thread, after this.
+                self._checkpoint_job.add_done_callback(lambda _: checkpoints.remove(dataset_id))
+        self._settings.pop(dataset_id, None)
+        self.metrics.inc("logger_evictions_total", labels={"reason": reason})
+        self.metrics.set("profile_loggers", len(self.loggers))
+
+    def after_poll(self) -> None:
+        self._submit_recovered()
+        for dataset_id, logger in self.loggers.evict_idle():
+            self._evict_logger(dataset_id, logger, "idle")
+
+        if (
+            self.checkpoints is None
+            or time.monotonic() - self._last_checkpoint_time < self.env_vars.checkpoint_interval_seconds
+        ):
+            return
+
+        if self._checkpoint_job is not None and not self._checkpoint_job.done():
+            self._logger.warning("Skipping a checkpoint, the last one is still being saved")
+            return
+
+        self._last_checkpoint_time = time.monotonic()
+        self._checkpoint_job = self.checkpoint()
+
+    def checkpoint(self) -> "Future[None]":
+        """
+        Save the profiles that changed since the last checkpoint. The loggers serialize them on their own threads
+        and they're written to disk in the background, so this doesn't wait on either.
+        """
+        snapshots = {dataset_id: logger.snapshot(changed_only=True) for dataset_id, logger in self.loggers.items()}
+        if self._checkpoint_executor is None:
+            self._checkpoint_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        return self._checkpoint_executor.submit(self._save_checkpoint, snapshots, time.perf_counter())
+
+    def _save_checkpoint(self, snapshots: Dict[str, "Future[LoggerSnapshot]"], start: float) -> None:
+        if self.checkpoints is None:
+            return
+
+        saved = 0
+        for dataset_id, future in snapshots.items():
+            try:
+                snapshot = future.result()
+                for dataset_timestamp, profile in snapshot.profiles.items():
+                    self.checkpoints.save(dataset_id, dataset_timestamp, profile)
+                # Whatever was flushed since the last checkpoint has been handed off to be uploaded
+                self.checkpoints.retain(dataset_id, snapshot.dataset_timestamps)
+                saved += len(snapshot.profiles)
+                self.metrics.inc("checkpoint_profiles_total", len(snapshot.profiles), labels={"dataset_id": dataset_id})
+            except Exception as e:
+                self._logger.exception(f"Couldn't checkpoint the profiles for {dataset_id}: {e}")
+
+        self.metrics.observe("checkpoint_seconds", time.perf_counter() - start)
+        self._logger.debug(f"Checkpointed {saved} profiles in {time.perf_counter() - start}s")
 
     def process_batch(self, batch: List[MessageType], batch_type: Type) -> None:
+        slots = [
+            it.shared_request
+            for it in batch
+            if isinstance(it, (RawLogMessage, RawLogEmbeddingsMessage)) and it.shared_request is not None
+        ]
+        if self.shared_arena is None or not slots:
+            self._process_batch(batch, batch_type)
+            return
+
+        # The bodies are parsed straight out of shared memory, which can be reused once they've been logged
+        arena = self.shared_arena
+        try:
+            self._process_batch(
+                [
+                    replace(it, request=arena.view(it.shared_request), shared_request=None)
+                    if isinstance(it, (RawLogMessage, RawLogEmbeddingsMessage)) and it.shared_request is not None
+                    else it
+                    for it in batch
+                ],
+                batch_type,
+            )
+        finally:
+            for slot in slots:
+                arena.release(slot)
+
+    def _process_batch(self, batch: List[MessageType], batch_type: Type) -> None:
         if batch_type == DebugMessage:
             self.process_debug_message(cast(List[DebugMessage], batch))
         elif batch_type == PublishMessage:
             self.process_publish_message(cast(List[PublishMessage], batch))
         elif batch_type == RawLogMessage:
             self.process_log_dicts(cast(List[RawLogMessage], batch))
+        elif batch_type == RawLogArrowMessage:
+            self.process_log_arrow(cast(List[RawLogArrowMessage], batch))
         elif batch_type == RawLogEmbeddingsMessage:
             self.process_log_embeddings_dicts(cast(List[RawLogEmbeddingsMessage], batch))
         elif batch_type == CloseMessage:
@@ -102,63 +511,276 @@ class ProfileActor(Actor[MessageType]):
 
     def process_close_message(self, messages: List[CloseMessage]) -> None:
         self._logger.info("Running pre shutdown operations")
+        deadline_seconds = self.env_vars.shutdown_deadline_seconds
+        deadline = None if deadline_seconds is None else messages[0].request_time + deadline_seconds
+
+        def remaining(min_seconds: float) -> Optional[float]:
+            return None if deadline is None else max(min_seconds, deadline - time.time())
+
+        # Don't let an old checkpoint land after the ones that are removed below. If it's still being saved at the
+        # deadline they're all kept instead, and restored on the next start.
+        checkpoint_saved = True
+        if self._checkpoint_job is not None:
+            try:
+                self._checkpoint_job.result(timeout=remaining(0))
+            except FutureTimeoutError:
+                self._logger.error("The last checkpoint wasn't saved before the shutdown deadline, keeping them all")
+                checkpoint_saved = False
+
+        self.upload_pool.begin_shutdown()
         self._logger.info(f"Closing down {len(self.loggers)} loggers")
-        for datasetId, logger in self.loggers.items():
-            self._logger.info(f"Closing whylogs logger for {datasetId}")
-            logger.close()
+        # Ask every logger to flush at once so that they serialize their profiles in parallel
+        for logger in self.loggers.values():
+            logger.send(LoggerCloseMessage())
+        for dataset_id, logger in self.loggers.items():
+            # Always give the loggers a moment to flush, their profiles can't be saved otherwise.
+            logger.join(remaining(_MIN_FLUSH_SECONDS))
+            if logger.is_alive():
+                # Its last checkpoint is kept so that it's restored on the next start
+                self._logger.error(f"Logger for {dataset_id} didn't flush before the shutdown deadline")
+            elif self.checkpoints is not None and checkpoint_saved:
+                self.checkpoints.remove(dataset_id)
+
+        self._logger.info("Waiting for uploads to finish")
+        abandoned = self.upload_pool.close(remaining(0))
+        for dataset_id, writable, saved_path in abandoned:
+            if saved_path is not None:
+                # Its file is still there, saving it again would upload it twice on the next start
+                self._logger.info(f"Leaving a profile for {dataset_id} in {saved_path} to upload on the next start")
+                continue
+            if self.pending_uploads is None:
+                self._logger.error(
+                    f"Dropping a profile for {dataset_id}, no {EnvVarNames.PENDING_UPLOAD_DIRECTORY.name}"
+                )
+                continue
+
+            path = self.pending_uploads.save(dataset_id, writable)
+            self.metrics.inc("profiles_saved_total", labels={"dataset_id": dataset_id})
+            self._logger.info(f"Saved a profile for {dataset_id} to {path} to upload on the next start")
+
+    def _record_logged(self, dataset_id: str, rows: int, columns: int) -> None:
+        labels = {"dataset_id": dataset_id}
+        self.metrics.inc("profile_rows_total", rows, labels)
+        self.metrics.set("profile_columns", columns, labels)
+
+    def _record_batch_timing(self, batch_type: Type, start: float, log_seconds: float) -> None:
+        # Everything that wasn't spent in whylogs, including creating loggers, was spent turning the requests
+        # into something it can log
+        labels = {"type": batch_type.__name__}
+        self.metrics.observe("profile_parse_seconds", time.perf_counter() - start - log_seconds, labels)
+        self.metrics.observe("profile_log_seconds", log_seconds, labels)
+
+    def _report_grouping(self, batch_type: Type, stats: GroupingStats) -> None:
+        self._logger.info(
+            f"Grouped {stats.messages} {batch_type.__name__} into {stats.groups} groups, "
+            f"{stats.mean_rows_per_group():.1f} rows per group on average and {stats.max_rows_per_group} max"
+        )
+        self.grouping_stats[batch_type.__name__].merge(stats)
+
+    def _quarantine(self, message: LogMessageType, reason: str, error: Exception) -> None:
+        type_name = type(message).__name__
+        self._logger.warning(f"Quarantining a {type_name} ({reason}): {str(error)[:_MAX_ERROR_LENGTH]}")
+        self.metrics.inc("messages_quarantined_total", labels={"type": type_name, "reason": reason})
+        if self.quarantine is None:
+            return
+
+        info = {k: v for k, v in vars(message).items() if k not in ("request", "shared_request")}
+        info.update(reason=reason, error=str(error), type=type_name)
+        try:
+            if not self.quarantine.save(message.request, info):
+                self._logger.warning(f"Not saving the {type_name}, the quarantine directory is full")
+        except Exception as e:
+            self._logger.exception(f"Couldn't save a quarantined {type_name}: {e}")
+
+    def _parse_messages(self, messages: List[M], parse: Callable[[M], R]) -> List[Tuple[M, R]]:
+        """
+        Parse and validate each message on its own, so that bad ones are quarantined without affecting the
+        rest of the batch.
+        """
+        parsed: List[Tuple[M, R]] = []
+        for message in messages:
+            try:
+                parsed.append((message, parse(message)))
+            except InvalidRequestError as e:
+                self._quarantine(message, e.reason, e)
+            except Exception as e:
+                self._quarantine(message, "invalid_request", e)
+        return parsed
+
+    def _convert_group(self, group: List[Tuple[M, R]], convert: Callable[[List[R]], T]) -> Optional[T]:
+        """
+        Combine a group of parsed messages into something that can be logged. If that fails then the
+        messages are tried one at a time to find the ones to blame. Those are quarantined and the rest are
+        combined again. Returns None if none of the messages could be converted.
+        """
+        try:
+            return convert([it[1] for it in group])
+        except Exception as e:
+            if len(group) == 1:
+                self._quarantine(group[0][0], "unloggable", e)
+                return None
+
+        good: List[R] = []
+        for message, parsed in group:
+            try:
+                convert([parsed])
+                good.append(parsed)
+            except Exception as e:
+                self._quarantine(message, "unloggable", e)
+        return convert(good) if good else None
 
     def process_log_embeddings_dicts(self, messages: List[RawLogEmbeddingsMessage]) -> None:
         self._logger.info("Processing log embeddings request message")
-        log_dicts = [m.to_log_embeddings_request_dict() for m in messages]
-
-        for dataset_id, group in groupby(log_dicts, lambda it: it["datasetId"]):
-            logger = self._get_logger(dataset_id)
-            options = get_dataset_options(dataset_id)
-            cadence = (options and options.dataset_cadence) or self.env_vars.default_dataset_cadence
-
-            for dataset_timestamp, ts_grouped in groupby(group, lambda it: determine_dataset_timestamp(cadence, it)):
-                for n, sub_group in groupby(ts_grouped, lambda it: encode_strings(get_embeddings_columns(it))):
-                    self._logger.info(
-                        f"Logging embeddings for ts {dataset_timestamp} in dataset {dataset_id} for column set {n}"
-                    )
-                    giga_message: LogEmbeddingRequestDict = reduce(reduce_embeddings_request, sub_group)
-                    row = log_dict_to_embedding_matrix(giga_message)
-
-                    row_count = 0
-                    for embeddings in row.values():
-                        row_count += len(embeddings)
-
-                    start = time.perf_counter()
-                    logger.log(row, timestamp_ms=dataset_timestamp, sync=True)
-                    self._logger.debug(
-                        f'Took {time.perf_counter() - start}s to log {row_count} rows for {len(giga_message["embeddings"])} columns'
-                    )
+        batch_start = time.perf_counter()
+        log_seconds = 0.0
+        parsed = self._parse_messages(messages, RawLogEmbeddingsMessage.to_log_embeddings_request_dict)
+        timestamps = self._dataset_timestamps([(it[1]["datasetId"], it[1]["timestamp"]) for it in parsed])
+        groups = group_by_key(
+            zip(parsed, timestamps),
+            lambda it: (it[0][1]["datasetId"], it[1], frozenset(get_embeddings_columns(it[0][1]))),
+        )
+
+        stats = GroupingStats(messages=len(messages))
+        for (dataset_id, dataset_timestamp, columns), timestamped in groups.items():
+            group = [it[0] for it in timestamped]
+            self._logger.info(
+                f"Logging embeddings for ts {dataset_timestamp} in dataset {dataset_id} for {len(columns)} columns"
+            )
+            row = self._convert_group(group, log_dicts_to_embedding_matrix)
+            if row is None:
+                continue
+
+            row_count = 0
+            for embeddings in row.values():
+                row_count += len(embeddings)
+
+            start = time.perf_counter()
+            try:
+                logger = self._get_logger(dataset_id)
+                logger.log(row, timestamp_ms=dataset_timestamp, sync=True)
+            except Exception as e:
+                self._logger.exception(f"Couldn't log embeddings for {dataset_id}: {e}")
+                continue
+            finally:
+                log_seconds += time.perf_counter() - start
+            self._logger.debug(f"Took {time.perf_counter() - start}s to log {row_count} rows for {len(row)} columns")
+            stats.add_group(row_count)
+            self._record_logged(dataset_id, row_count, len(row))
+
+        self._record_batch_timing(RawLogEmbeddingsMessage, batch_start, log_seconds)
+        self._report_grouping(RawLogEmbeddingsMessage, stats)
+
+    def _to_slices(
+        self, dataset_id: str, dataset_timestamp: int, timestamp_column: Optional[str], requests: List[LogRequestDict]
+    ) -> List[Tuple[int, pd.DataFrame]]:
+        df = log_dicts_to_data_frame(requests)
+        if timestamp_column is None:
+            return [(dataset_timestamp, df)]
+        return split_by_row_timestamp(
+            df, timestamp_column, self._get_settings(dataset_id).granularity, dataset_timestamp
+        )
 
     def process_log_dicts(self, messages: List[RawLogMessage]) -> None:
         self._logger.info("Processing log request message")
-        log_dicts = [m.to_log_request_dict() for m in messages]
-
-        for dataset_id, group in groupby(log_dicts, lambda it: it["datasetId"]):
-            logger = self._get_logger(dataset_id)
-            options = get_dataset_options(dataset_id)
-            cadence = (options and options.dataset_cadence) or self.env_vars.default_dataset_cadence
-
-            for dataset_timestamp, ts_grouped in groupby(group, lambda it: determine_dataset_timestamp(cadence, it)):
-                for n, sub_group in groupby(ts_grouped, lambda it: encode_strings(get_columns(it))):
-                    self._logger.info(
-                        f"Logging data for ts {dataset_timestamp} in dataset {dataset_id} for column set {n}"
-                    )
-                    giga_message: LogRequestDict = reduce(reduce_log_requests, sub_group)
-                    df = log_dict_to_data_frame(giga_message)
-                    start = time.perf_counter()
-                    logger.log(df, timestamp_ms=dataset_timestamp, sync=True)
-                    self._logger.debug(f"Took {time.perf_counter() - start}s to log {len(df.index)}")
+        batch_start = time.perf_counter()
+        log_seconds = 0.0
+        parsed = self._parse_messages(messages, RawLogMessage.to_log_request_dict)
+        timestamps = self._dataset_timestamps([(it[1]["datasetId"], it[1]["timestamp"]) for it in parsed])
+        groups = group_by_key(
+            zip(parsed, timestamps),
+            lambda it: (
+                it[0][1]["datasetId"],
+                it[1],
+                frozenset(get_columns(it[0][1])),
+                get_timestamp_column(it[0][1]),
+            ),
+        )
+
+        stats = GroupingStats(messages=len(messages))
+        for (dataset_id, dataset_timestamp, columns, timestamp_column), timestamped in groups.items():
+            group = [it[0] for it in timestamped]
+            self._logger.info(
+                f"Logging data for ts {dataset_timestamp} in dataset {dataset_id} for {len(columns)} columns"
+            )
+            slices = self._convert_group(
+                group, partial(self._to_slices, dataset_id, dataset_timestamp, timestamp_column)
+            )
+            if slices is None:
+                continue
+
+            rows = sum(len(data.index) for _, data in slices)
+            start = time.perf_counter()
+            try:
+                logger = self._get_logger(dataset_id)
+                for slice_timestamp, data in slices:
+                    logger.log(data, timestamp_ms=slice_timestamp, sync=True)
+            except Exception as e:
+                self._logger.exception(f"Couldn't log data for {dataset_id}: {e}")
+                continue
+            finally:
+                log_seconds += time.perf_counter() - start
+            self._logger.debug(f"Took {time.perf_counter() - start}s to log {rows} rows in {len(slices)} slices")
+            stats.add_group(rows)
+            self._record_logged(dataset_id, rows, len(slices[0][1].columns))
+
+        self._record_batch_timing(RawLogMessage, batch_start, log_seconds)
+        self._report_grouping(RawLogMessage, stats)
+
+    def process_log_arrow(self, messages: List[RawLogArrowMessage]) -> None:
+        import pyarrow as pa  # Optional dependency, only needed for this message type
+
+        self._logger.info("Processing log arrow message")
+        batch_start = time.perf_counter()
+        log_seconds = 0.0
+        tables = self._parse_messages(messages, RawLogArrowMessage.to_table)
+        timestamps = self._dataset_timestamps([(it[0].dataset_id, it[0].get_timestamp()) for it in tables])
+        # Tables can only be concatenated without copying when their schemas match exactly
+        groups = group_by_key(zip(tables, timestamps), lambda it: (it[0][0].dataset_id, it[1], it[0][1].schema))
+
+        stats = GroupingStats(messages=len(messages))
+        for (dataset_id, dataset_timestamp, schema), timestamped in groups.items():
+            group = [it[0] for it in timestamped]
+            self._logger.info(
+                f"Logging arrow data for ts {dataset_timestamp} in dataset {dataset_id} for columns {schema.names}"
+            )
+            try:
+                table = pa.concat_tables([it[1] for it in group])
+                df = table.to_pandas(split_blocks=True, self_destruct=True)
+            except Exception as e:
+                # The tables can't be retried one at a time since converting them may have freed their memory
+                for message, _ in group:
+                    self._quarantine(message, "unloggable", e)
+                continue
+
+            start = time.perf_counter()
+            try:
+                logger = self._get_logger(dataset_id)
+                logger.log(df, timestamp_ms=dataset_timestamp, sync=True)
+            except Exception as e:
+                self._logger.exception(f"Couldn't log arrow data for {dataset_id}: {e}")
+                continue
+            finally:
+                log_seconds += time.perf_counter() - start
+            self._logger.debug(f"Took {time.perf_counter() - start}s to log {len(df.index)}")
+            stats.add_group(len(df.index))
+            self._record_logged(dataset_id, len(df.index), len(df.columns))
+
+        self._record_batch_timing(RawLogArrowMessage, batch_start, log_seconds)
+        self._report_grouping(RawLogArrowMessage, stats)
 
     def process_debug_message(self, messages: List[DebugMessage]) -> None:
+        for type_name, stats in self.grouping_stats.items():
+            self._logger.info(f"Grouping stats for {type_name}: {stats}")
+
         for dataset_id, logger in self.loggers.items():
-            profiles = logger._get_matching_profiles()
-            for profile in profiles:
-                self._logger.info(f"{dataset_id}{os.linesep}{profile.view().to_pandas()}")
+            snapshot = logger.snapshot().result()
+            for dataset_timestamp, profile in snapshot.profiles.items():
+                if profile.profile is not None:
+                    view = DatasetProfileView.deserialize(profile.profile)
+                    self._logger.info(f"{dataset_id} {dataset_timestamp}{os.linesep}{view.to_pandas()}")
+                for segment, data in profile.segments.items():
+                    view = DatasetProfileView.deserialize(data)
+                    self._logger.info(f"{dataset_id} {dataset_timestamp} {segment}{os.linesep}{view.to_pandas()}")
 
     def process_publish_message(self, messages: Optional[List[PublishMessage]] = None) -> None:
         if not self.loggers:
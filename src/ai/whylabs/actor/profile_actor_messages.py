@@ -1,16 +1,39 @@
+import io
+import re
 from dataclasses import dataclass
-from typing import Dict, List, TypedDict, Union
+from itertools import chain, zip_longest
+from typing import Any, Dict, List, Optional, Tuple, TypedDict, Union
 
 import numpy as np
 import orjson
 import pandas as pd
-from whylabs_toolkit.container.config_types import DatasetCadence
 
-from ...util.time import TimeGranularity, truncate_time_ms
+from ...util.compression_util import DecompressedSizeError, decompress, iter_decompressed
+from ...util.time import Bucketing, group_by_bucket
 from ..container.requests import DataTypes
+from .shared_arena import SharedSlot
 
 
-class DataDict(TypedDict):
+ARROW_STREAM_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_CONTENT_TYPES = {"application/vnd.apache.parquet", "application/x-parquet"}
+NPZ_CONTENT_TYPE = "application/x-npz"
+
+_DATASET_ID_PATTERN = re.compile(rb'"datasetId"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_DATASET_ID_KEY = b'"datasetId"'
+# How much of a compressed request is decompressed looking for the datasetId before giving up on it
+_PEEK_MAX_BYTES = 1024 * 1024
+
+
+class _DataDictOptions(TypedDict, total=False):
+    # Either "rows" (the default), where data is a list of rows, or "columns", where data has one list of
+    # values for each of the columns.
+    orient: str
+    # A column with the epoch ms timestamp of each row. Rows are profiled in the time bucket of their own
+    # timestamp instead of the request's, and the column itself isn't profiled.
+    timestampColumn: str
+
+
+class DataDict(_DataDictOptions):
     columns: List[str]
     data: List[List[DataTypes]]
 
@@ -21,10 +44,25 @@ class LogRequestDict(TypedDict):
     data: DataDict
 
 
+# Nested lists when they come from json requests, arrays when they come from npz requests
+Embeddings = Union[List[DataTypes], np.ndarray]
+
+
 class LogEmbeddingRequestDict(TypedDict):
     datasetId: str
     timestamp: int
-    embeddings: Dict[str, List[DataTypes]]
+    embeddings: Dict[str, Embeddings]
+
+
+class InvalidRequestError(Exception):
+    """
+    A request that can't be logged. The reason is one of a few fixed strings so that it can be used as a
+    metric label, the message has the details.
+    """
+
+    def __init__(self, reason: str, message: str) -> None:
+        super().__init__(message)
+        self.reason = reason
 
 
 class DebugMessage:
@@ -37,21 +75,112 @@ class PublishMessage:
 
 @dataclass
 class RawLogMessage:
+    """
+    A json log request. The body stays compressed until it gets to the actor that logs it, so the server
+    process peeks the dataset id out of it once and keeps it here for routing. Large bodies are moved into
+    shared memory on their way through the queue, see ProfileActor.
+    """
+
     request: bytes
     request_time: int
+    content_encoding: Optional[str] = None
+    dataset_id: Optional[str] = None
+    shared_request: Optional[SharedSlot] = None
 
     def to_log_request_dict(self) -> LogRequestDict:
-        d: LogRequestDict = orjson.loads(self.request)
-        if "timestamp" not in d or d["timestamp"] is None:
+        d: LogRequestDict = _load_json(self.request, self.content_encoding)
+        if d.get("timestamp") is None:
             d["timestamp"] = self.request_time
 
-        if "datasetId" not in d or d["datasetId"] is None:
-            raise Exception(f"Request missing dataset id {d}")
+        validate_log_request_dict(d)
+        _check_routed_dataset_id(d, self.dataset_id)
+        return d
 
-        if "data" not in d or d["data"] is None:
-            raise Exception(f"Request has no data field {d}")
 
-        return d
+@dataclass
+class RawLogArrowMessage:
+    """
+    An Arrow IPC stream or Parquet file. Neither format has a natural place for the dataset id and
+    timestamp so they come from the request's query string instead.
+    """
+
+    request: bytes
+    request_time: int
+    dataset_id: str
+    timestamp: Optional[int]
+    content_type: str
+
+    def to_table(self) -> Any:
+        # pyarrow is an optional dependency that's only needed for this message type
+        import pyarrow as pa
+
+        # py_buffer wraps the bytes without copying and both readers can use the resulting buffers directly
+        buffer = pa.py_buffer(self.request)
+        if self.content_type == ARROW_STREAM_CONTENT_TYPE:
+            return pa.ipc.open_stream(buffer).read_all()
+        elif self.content_type in PARQUET_CONTENT_TYPES:
+            import pyarrow.parquet as pq
+
+            return pq.read_table(pa.BufferReader(buffer))
+        else:
+            raise Exception(f"Unsupported content type {self.content_type}")
+
+    def get_timestamp(self) -> int:
+        return self.timestamp if self.timestamp is not None else self.request_time
+
+
+def peek_dataset_id(request: bytes, content_encoding: Optional[str] = None) -> Optional[str]:
+    """
+    Find the datasetId of a raw json request without parsing the whole thing. This is used in the
+    server process to route requests, where fully parsing the body would be too expensive. Compressed
+    requests are only decompressed up to the point where the datasetId shows up, and no further than
+    _PEEK_MAX_BYTES.
+    """
+    match = (
+        _DATASET_ID_PATTERN.search(request) if content_encoding is None else _peek_compressed(request, content_encoding)
+    )
+    if match is None:
+        return None
+
+    dataset_id = match.group(1)
+    if b"\\" in dataset_id:
+        # Let orjson deal with escape sequences in the rare case that they show up
+        return str(orjson.loads(b'"' + dataset_id + b'"'))
+
+    return dataset_id.decode("utf-8")
+
+
+def _peek_compressed(request: bytes, content_encoding: str) -> Optional["re.Match[bytes]"]:
+    # Only what hasn't been searched yet is kept, so this holds at most a chunk or two at a time
+    decompressed = bytearray()
+    total = 0
+    for chunk in iter_decompressed(request, content_encoding):
+        decompressed += chunk
+        match = _DATASET_ID_PATTERN.search(decompressed)
+        if match is not None:
+            return match
+
+        total += len(chunk)
+        if total >= _PEEK_MAX_BYTES:
+            return None
+
+        # Keep a key whose value hasn't been decompressed yet, or enough of the end for a key that was cut off
+        key = decompressed.rfind(_DATASET_ID_KEY)
+        del decompressed[: key if key >= 0 else max(0, len(decompressed) - len(_DATASET_ID_KEY))]
+
+    return None
+
+
+def get_message_dataset_id(message: object) -> Optional[str]:
+    if isinstance(message, (RawLogMessage, RawLogEmbeddingsMessage)) and message.dataset_id is not None:
+        return message.dataset_id
+    elif isinstance(message, (RawLogMessage, RawLogEmbeddingsMessage)) and message.content_encoding is None:
+        return peek_dataset_id(message.request)
+    elif isinstance(message, RawLogArrowMessage):
+        return message.dataset_id
+
+    # Compressed requests are peeked once, when their message is created, instead of every time this is called
+    return None
 
 
 def get_columns(request: LogRequestDict) -> List[str]:
@@ -71,61 +200,276 @@ def get_embeddings_columns(request: LogEmbeddingRequestDict) -> List[str]:
 
 @dataclass
 class RawLogEmbeddingsMessage:
+    """
+    Either a json request or a .npz file with one 2d array per column. The npz variant doesn't have anywhere
+    to put the dataset id and timestamp so those come from the query string in that case.
+    """
+
     request: bytes
     request_time: int
+    dataset_id: Optional[str] = None
+    timestamp: Optional[int] = None
+    content_type: str = "application/json"
+    content_encoding: Optional[str] = None
+    shared_request: Optional[SharedSlot] = None
 
     def to_log_embeddings_request_dict(self) -> LogEmbeddingRequestDict:
-        d: LogEmbeddingRequestDict = orjson.loads(self.request)
-        if "timestamp" not in d or d["timestamp"] is None:
+        if self.content_type == NPZ_CONTENT_TYPE:
+            return self._npz_to_log_embeddings_request_dict()
+
+        d: LogEmbeddingRequestDict = _load_json(self.request, self.content_encoding)
+        if d.get("timestamp") is None:
             d["timestamp"] = self.request_time
 
-        if "datasetId" not in d or d["datasetId"] is None:
-            raise Exception(f"Request missing dataset id {d}")
+        validate_log_embeddings_request_dict(d)
+        _check_routed_dataset_id(d, self.dataset_id)
+        return d
 
-        if "embeddings" not in d or d["embeddings"] is None:
-            raise Exception(f"Request has no embeddings field {d}")
+    def _npz_to_log_embeddings_request_dict(self) -> LogEmbeddingRequestDict:
+        if self.dataset_id is None:
+            raise InvalidRequestError("missing_dataset_id", "Npz embeddings request missing dataset id")
+
+        matrices: Dict[str, np.ndarray] = {}
+        try:
+            with np.load(io.BytesIO(_decompress(self.request, self.content_encoding)), allow_pickle=False) as npz:
+                for col in npz.files:
+                    matrices[col] = npz[col]
+        except InvalidRequestError:
+            raise
+        except Exception as e:
+            raise InvalidRequestError("invalid_npz", f"Couldn't read npz request: {e}")
+
+        embeddings: Dict[str, Embeddings] = {}
+        for col, matrix in matrices.items():
+            if matrix.ndim != 2:
+                raise InvalidRequestError(
+                    "invalid_embeddings", f"Expected a 2d array for embeddings column {col}. Got shape {matrix.shape}"
+                )
+            embeddings[col] = matrix
+
+        return {
+            "datasetId": self.dataset_id,
+            "timestamp": self.timestamp if self.timestamp is not None else self.request_time,
+            "embeddings": embeddings,
+        }
+
+
+def _decompress(request: bytes, content_encoding: Optional[str]) -> bytes:
+    try:
+        return decompress(request, content_encoding)
+    except DecompressedSizeError as e:
+        raise InvalidRequestError("too_large", f"Decompressed {content_encoding} request is too large: {e}")
+    except Exception as e:
+        raise InvalidRequestError("invalid_encoding", f"Couldn't decompress {content_encoding} request: {e}")
+
+
+def _load_json(request: bytes, content_encoding: Optional[str]) -> Any:
+    try:
+        d = orjson.loads(_decompress(request, content_encoding))
+    except orjson.JSONDecodeError as e:
+        raise InvalidRequestError("invalid_json", f"Request isn't valid json: {e}")
+
+    if not isinstance(d, dict):
+        raise InvalidRequestError("invalid_json", f"Expected a json object, got {type(d).__name__}")
+    return d
+
+
+def _check_routed_dataset_id(request: Any, dataset_id: Optional[str]) -> None:
+    """
+    The request was sent to the actor that owns dataset_id, so logging it under any other dataset would give that
+    dataset a second owner.
+    """
+    if dataset_id is not None and request["datasetId"] != dataset_id:
+        raise InvalidRequestError(
+            "mismatched_dataset_id", f"Request for {request['datasetId']} was routed as {dataset_id}"
+        )
 
-        if not isinstance(d["embeddings"], dict):
-            # TODO test recovering from errors like this. It seems to brick the container
-            raise Exception(
-                f'Expected a dictionary format for embeddings of the form {{"column_name": "embedding_2d_list"}}. Got {self.request}'
-            )
 
-        return d
+def _validate_header(request: Any) -> None:
+    dataset_id = request.get("datasetId")
+    if not isinstance(dataset_id, str) or not dataset_id:
+        raise InvalidRequestError("missing_dataset_id", f"Request missing dataset id, got {dataset_id!r}")
+
+    timestamp = request["timestamp"]
+    if isinstance(timestamp, float) and timestamp.is_integer():
+        # Some clients write every number as a float, like 1677024000000.0
+        timestamp = request["timestamp"] = int(timestamp)
+    if not isinstance(timestamp, int) or isinstance(timestamp, bool):
+        raise InvalidRequestError("invalid_timestamp", f"Expected an epoch ms timestamp, got {timestamp!r}")
+
+
+def _has_lengths(lists: List[Any], length: int) -> bool:
+    # map() keeps this in C, which matters for requests with a lot of rows
+    try:
+        return not any(map(length.__ne__, map(len, lists)))
+    except TypeError:
+        # Something without a length, like a number
+        return False
+
+
+def validate_log_request_dict(request: LogRequestDict) -> None:
+    """
+    Check the structure of a parsed request, so that a bad one can be set aside before it's combined with
+    others and breaks the whole group. This only looks at the shape of the data, not at the values, so it's
+    cheap enough to run on every request.
+    """
+    _validate_header(request)
+    data = request.get("data")
+    if not isinstance(data, dict):
+        raise InvalidRequestError("missing_data", "Request has no data field")
+
+    columns = data.get("columns")
+    if not isinstance(columns, list) or not all(isinstance(it, str) for it in columns):
+        raise InvalidRequestError("invalid_columns", "Expected data.columns to be a list of column names")
+    if len(set(columns)) != len(columns):
+        raise InvalidRequestError("invalid_columns", f"Duplicate column names in {columns}")
+
+    values = data.get("data")
+    if not isinstance(values, list):
+        raise InvalidRequestError("missing_data", "Expected data.data to be a list")
+
+    orient = data.get("orient", "rows")
+    if orient == "columns":
+        if len(values) != len(columns):
+            raise InvalidRequestError("invalid_shape", f"Expected {len(columns)} column lists, got {len(values)}")
+        if values and not (all(isinstance(it, list) for it in values) and _has_lengths(values, len(values[0]))):
+            raise InvalidRequestError("invalid_shape", "Expected column lists that are all the same length")
+    elif orient == "rows":
+        if not _has_lengths(values, len(columns)):
+            raise InvalidRequestError("invalid_shape", f"Expected every row to have {len(columns)} values")
+    else:
+        raise InvalidRequestError("invalid_orient", f"Unknown orient {orient}, expected rows or columns")
+
+    timestamp_column = data.get("timestampColumn")
+    if timestamp_column is not None and timestamp_column not in columns:
+        raise InvalidRequestError(
+            "invalid_timestamp", f"Timestamp column {timestamp_column} isn't one of the request's columns"
+        )
+
+
+def validate_log_embeddings_request_dict(request: LogEmbeddingRequestDict) -> None:
+    """
+    The embeddings version of validate_log_request_dict. Every column has to be a non empty 2d list.
+    """
+    _validate_header(request)
+    embeddings = request.get("embeddings")
+    if not isinstance(embeddings, dict):
+        raise InvalidRequestError(
+            "missing_data",
+            'Expected a dictionary format for embeddings of the form {"column_name": "embedding_2d_list"}',
+        )
+
+    for col, rows in embeddings.items():
+        if not isinstance(rows, list) or not rows or not isinstance(rows[0], list):
+            raise InvalidRequestError("invalid_embeddings", f"Expected a 2d list for embeddings column {col}")
+        if not _has_lengths(rows, len(rows[0])):
+            raise InvalidRequestError("invalid_embeddings", f"Embeddings in column {col} have different lengths")
+
+
+def get_timestamp_column(request: LogRequestDict) -> Optional[str]:
+    return request["data"].get("timestampColumn")
+
+
+def split_by_row_timestamp(
+    df: pd.DataFrame, column: str, granularity: Bucketing, default_timestamp: int
+) -> List[Tuple[int, pd.DataFrame]]:
+    """
+    Split a data frame into one slice per time bucket based on the timestamps in one of its columns, which is
+    dropped. Rows without a timestamp use default_timestamp.
+    """
+    if column not in df.columns:
+        raise Exception(f"Timestamp column {column} isn't one of the request's columns")
+
+    timestamps = pd.to_numeric(df[column]).fillna(default_timestamp).to_numpy(dtype=np.int64)
+    data = df.drop(columns=[column])
+    groups = group_by_bucket(timestamps, granularity)
+    if len(groups) == 1:
+        return [(groups[0][0], data)]
+    return [(bucket, data.iloc[indexes]) for bucket, indexes in groups]
 
 
 def log_dict_to_data_frame(request: LogRequestDict) -> pd.DataFrame:
     return pd.DataFrame(request["data"]["data"], columns=request["data"]["columns"])
 
 
-def log_dict_to_embedding_matrix(request: LogEmbeddingRequestDict) -> Dict[str, np.ndarray]:
-    row: Dict[str, np.ndarray] = {}
-    for col, embeddings in request["embeddings"].items():
-        row[col] = np.array(embeddings)
-    return row
+def is_columnar(request: LogRequestDict) -> bool:
+    return request["data"].get("orient") == "columns"
 
 
-def reduce_log_requests(acc: LogRequestDict, cur: LogRequestDict) -> LogRequestDict:
+def to_column_array(values: List[Any]) -> np.ndarray:
     """
-    Reduce requests, assuming that each request has the same columns.
-    That assumption should be enforced before this is used by grouping by set of columns.
+    Convert the values of a single column into a typed numpy array, ending up with the same dtypes
+    that pandas would have picked. Numeric and bool columns are handled by numpy directly and anything
+    else (None values, nested lists, mixed types) falls back to pandas' inference.
     """
-    acc["data"]["data"].extend(cur["data"]["data"])
-    return acc
+    if not values or isinstance(values[0], str):
+        # Strings always end up as objects in pandas. Skip numpy's fixed width unicode conversion.
+        return np.array(values, dtype=object)
 
+    try:
+        array = np.array(values)
+        if array.ndim == 1 and array.dtype.kind in "biuf":
+            return array
+    except ValueError:
+        # Ragged nested lists
+        pass
 
-def reduce_embeddings_request(acc: LogEmbeddingRequestDict, cur: LogEmbeddingRequestDict) -> LogEmbeddingRequestDict:
-    for col, embeddings in cur["embeddings"].items():
-        if col not in acc["embeddings"]:
-            acc["embeddings"][col] = []
+    inferred: np.ndarray = pd.Series(values).to_numpy()
+    return inferred
 
-        acc["embeddings"][col].extend(embeddings)
 
-    return acc
+def log_dicts_to_data_frame(requests: List[LogRequestDict]) -> pd.DataFrame:
+    """
+    Merge requests that have the same set of columns into a single data frame. The columns can be in a
+    different order in each request.
+
+    Column oriented requests are converted into typed numpy arrays one column at a time, which avoids
+    creating a python list for every row on the client, in orjson and in the data frame constructor.
+    If all of the requests are row oriented with the same column order then pandas' row constructor is
+    used since it's implemented in C and beats transposing the rows in python.
+    """
+    columnar = [it for it in requests if is_columnar(it)]
+    row_oriented = [it for it in requests if not is_columnar(it)]
+
+    column_names = requests[0]["data"]["columns"]
+    if not columnar and all(it["data"]["columns"] == column_names for it in row_oriented):
+        # Doesn't modify the requests, so a group that fails can still be retried one request at a time
+        rows = list(chain.from_iterable(it["data"]["data"] for it in row_oriented))
+        return pd.DataFrame(rows, columns=column_names)
+
+    column_values: Dict[str, List[Any]] = {name: [] for name in column_names}
+    for request in columnar:
+        for name, values in zip(request["data"]["columns"], request["data"]["data"]):
+            column_values[name].extend(values)
+
+    for request in row_oriented:
+        # Each request can have its columns in a different order
+        names = request["data"]["columns"]
+        for name, row_values in zip(names, zip_longest(*request["data"]["data"])):
+            column_values[name].extend(row_values)
+
+    return pd.DataFrame({name: to_column_array(values) for name, values in column_values.items()})
+
 
+def log_dicts_to_embedding_matrix(requests: List[LogEmbeddingRequestDict]) -> Dict[str, np.ndarray]:
+    """
+    Merge the embeddings of several requests into one matrix per column. Each request is converted to an
+    array on its own and the arrays are concatenated once at the end, rather than growing python lists.
+    """
+    matrices: Dict[str, List[np.ndarray]] = {}
+    for request in requests:
+        for col, embeddings in request["embeddings"].items():
+            if col not in matrices:
+                matrices[col] = []
+            matrices[col].append(np.asarray(embeddings))
+
+    return {col: parts[0] if len(parts) == 1 else np.concatenate(parts) for col, parts in matrices.items()}
 
-def determine_dataset_timestamp(
-    cadence: DatasetCadence, request: Union[LogRequestDict, LogEmbeddingRequestDict]
-) -> int:
-    ts = request["timestamp"]
-    return truncate_time_ms(ts, TimeGranularity.D if cadence == DatasetCadence.DAILY else TimeGranularity.H)
+
+def reduce_log_requests(acc: LogRequestDict, cur: LogRequestDict) -> LogRequestDict:
+    """
+    Reduce requests, assuming that each request has the same columns.
+    That assumption should be enforced before this is used by grouping by set of columns.
+    """
+    acc["data"]["data"].extend(cur["data"]["data"])
+    return acc
@@ -0,0 +1,66 @@
+"""
+Compare the row oriented and column oriented paths for turning /log requests into data frames.
+
+Run with `python -m ai.whylabs.actor.profile_actor_messages_bench` from the src directory.
+"""
+import random
+import time
+from functools import reduce
+from typing import Any, Callable, List
+
+import orjson
+
+from .profile_actor_messages import (
+    LogRequestDict,
+    log_dict_to_data_frame,
+    log_dicts_to_data_frame,
+    reduce_log_requests,
+)
+
+_REQUESTS = 100
+_ROWS_PER_REQUEST = 1000
+_COLUMN_GROUPS = 5  # Each group adds a float, int, str, bool column
+
+
+def _make_row() -> List[Any]:
+    row: List[Any] = []
+    for _ in range(_COLUMN_GROUPS):
+        row += [random.random(), random.randint(0, 1000), random.choice(["a", "b", "c"]), random.random() > 0.5]
+    return row
+
+
+def _make_requests(columnar: bool) -> List[bytes]:
+    columns = [f"col_{i}" for i in range(_COLUMN_GROUPS * 4)]
+    requests: List[bytes] = []
+    for _ in range(_REQUESTS):
+        rows = [_make_row() for _ in range(_ROWS_PER_REQUEST)]
+        data = [list(it) for it in zip(*rows)] if columnar else rows
+        orient = "columns" if columnar else "rows"
+        request = {"datasetId": "model-1", "timestamp": 0, "data": {"columns": columns, "data": data, "orient": orient}}
+        requests.append(orjson.dumps(request))
+    return requests
+
+
+def _row_path(requests: List[LogRequestDict]) -> Any:
+    return log_dict_to_data_frame(reduce(reduce_log_requests, requests))
+
+
+def _time(name: str, raw: List[bytes], fn: Callable[[List[LogRequestDict]], Any], iterations: int = 5) -> None:
+    parse_times: List[float] = []
+    frame_times: List[float] = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        parsed: List[LogRequestDict] = [orjson.loads(it) for it in raw]
+        parsed_time = time.perf_counter()
+        fn(parsed)
+        parse_times.append(parsed_time - start)
+        frame_times.append(time.perf_counter() - parsed_time)
+
+    rows = _REQUESTS * _ROWS_PER_REQUEST
+    print(f"{name:<20} parse {min(parse_times):.3f}s  data frame {min(frame_times):.3f}s  ({rows} rows)")
+
+
+if __name__ == "__main__":
+    _time("rows (old path)", _make_requests(columnar=False), _row_path)
+    _time("rows (merged)", _make_requests(columnar=False), log_dicts_to_data_frame)
+    _time("columns", _make_requests(columnar=True), log_dicts_to_data_frame)
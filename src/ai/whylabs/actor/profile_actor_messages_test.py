@@ -0,0 +1,293 @@
+import gzip
+import io
+import os
+from typing import Any, Callable, List
+
+import numpy as np
+import orjson
+import pandas as pd
+import pytest
+
+from .profile_actor_messages import (
+    _PEEK_MAX_BYTES,
+    ARROW_STREAM_CONTENT_TYPE,
+    NPZ_CONTENT_TYPE,
+    InvalidRequestError,
+    LogEmbeddingRequestDict,
+    LogRequestDict,
+    RawLogArrowMessage,
+    RawLogEmbeddingsMessage,
+    RawLogMessage,
+    get_message_dataset_id,
+    log_dicts_to_data_frame,
+    log_dicts_to_embedding_matrix,
+    peek_dataset_id,
+    split_by_row_timestamp,
+    to_column_array,
+    validate_log_request_dict,
+)
+from ...util import compression_util
+from ...util.compression_util import GZIP
+from ...util.time import TimeGranularity
+
+
+def test_peek_dataset_id() -> None:
+    request = b'{"datasetId": "model-1", "timestamp": 1, "data": {"columns": ["a"], "data": [[1]]}}'
+    assert peek_dataset_id(request) == "model-1"
+
+
+def test_peek_dataset_id_not_first() -> None:
+    request = b'{"data":{"columns":["datasetId"],"data":[["model-2"]]},"datasetId":"model-1"}'
+    assert peek_dataset_id(request) == "model-1"
+
+
+def test_peek_dataset_id_escaped() -> None:
+    request = b'{"datasetId": "model-\\"1\\""}'
+    assert peek_dataset_id(request) == 'model-"1"'
+
+
+def test_peek_dataset_id_missing() -> None:
+    assert peek_dataset_id(b'{"data": {"columns": [], "data": []}}') is None
+
+
+def test_peek_dataset_id_compressed() -> None:
+    # Put the dataset id after enough incompressible data that it's decompressed in a later chunk
+    padding = os.urandom(150 * 1024).hex()
+    request = f'{{"timestamp": 1, "data": {{"columns": ["a"], "data": [["{padding}"]]}}, "datasetId": "model-1"}}'
+    compressed = gzip.compress(request.encode())
+    assert peek_dataset_id(compressed, GZIP) == "model-1"
+    assert peek_dataset_id(gzip.compress(b'{"data": {"columns": [], "data": []}}'), GZIP) is None
+
+    message = RawLogMessage(request=compressed, request_time=1, content_encoding=GZIP)
+    # Compressed requests are only peeked when their message is created
+    assert get_message_dataset_id(message) is None
+    assert message.to_log_request_dict()["data"]["data"] == [[padding]]
+
+
+def test_peek_dataset_id_compressed_limit() -> None:
+    padding = "a" * _PEEK_MAX_BYTES
+    request = f'{{"data": {{"columns": ["a"], "data": [["{padding}"]]}}, "datasetId": "model-1"}}'
+    assert peek_dataset_id(gzip.compress(request.encode()), GZIP) is None
+
+
+def test_decompressed_too_large(monkeypatch: pytest.MonkeyPatch) -> None:
+    request = gzip.compress(b'{"datasetId": "model-1", "data": {"columns": ["a"], "data": [[1]]}}')
+    monkeypatch.setattr(compression_util, "MAX_DECOMPRESSED_BYTES", 10)
+    message = RawLogMessage(request=request, request_time=1, content_encoding=GZIP)
+    assert _invalid_reason(message.to_log_request_dict) == "too_large"
+
+
+def _request(columns: List[str], data: List[List[Any]], orient: str = "rows") -> LogRequestDict:
+    return {"datasetId": "model-1", "timestamp": 1, "data": {"columns": columns, "data": data, "orient": orient}}
+
+
+def test_to_column_array_dtypes() -> None:
+    assert to_column_array([1, 2, 3]).dtype == np.int64
+    assert to_column_array([1, 2.5]).dtype == np.float64
+    assert to_column_array([True, False]).dtype == np.bool_
+    assert to_column_array(["a", "b"]).dtype == object
+    assert to_column_array([1, None]).dtype == np.float64
+    assert to_column_array(["a", None]).dtype == object
+    assert to_column_array([[1.0, 2.0], [3.0]]).dtype == object
+    assert to_column_array([]).dtype == object
+
+
+def test_columnar_matches_rows() -> None:
+    columns = ["a", "b", "c", "d"]
+    rows: List[List[Any]] = [[1, 1.5, "x", True], [2, None, "y", False], [3, 2.5, None, True]]
+    expected = pd.DataFrame(rows, columns=columns)
+
+    columnar = log_dicts_to_data_frame([_request(columns, [list(it) for it in zip(*rows)], orient="columns")])
+
+    pd.testing.assert_frame_equal(columnar, expected)
+
+
+def test_columnar_merged_with_rows() -> None:
+    requests = [
+        _request(["a", "b"], [[1, 2], ["x", "y"]], orient="columns"),
+        _request(["b", "a"], [["z", 3]]),
+    ]
+
+    df = log_dicts_to_data_frame(requests)
+
+    assert df["a"].tolist() == [1, 2, 3]
+    assert df["b"].tolist() == ["x", "y", "z"]
+
+
+def test_npz_embeddings() -> None:
+    buffer = io.BytesIO()
+    np.savez(buffer, col1=np.ones((3, 4), dtype=np.float32), col2=np.zeros((3, 2), dtype=np.float32))
+    message = RawLogEmbeddingsMessage(
+        request=buffer.getvalue(), request_time=5, dataset_id="model-1", content_type=NPZ_CONTENT_TYPE
+    )
+
+    request = message.to_log_embeddings_request_dict()
+
+    assert request["datasetId"] == "model-1"
+    assert request["timestamp"] == 5
+    assert set(request["embeddings"].keys()) == {"col1", "col2"}
+    assert get_message_dataset_id(message) == "model-1"
+
+
+def test_embeddings_merge_json_and_npz() -> None:
+    json_request: LogEmbeddingRequestDict = {
+        "datasetId": "model-1",
+        "timestamp": 1,
+        "embeddings": {"col1": [[1.0, 2.0], [3.0, 4.0]]},
+    }
+    npz_request: LogEmbeddingRequestDict = {
+        "datasetId": "model-1",
+        "timestamp": 1,
+        "embeddings": {"col1": np.array([[5.0, 6.0]], dtype=np.float32)},
+    }
+
+    matrix = log_dicts_to_embedding_matrix([json_request, npz_request])
+
+    assert matrix["col1"].shape == (3, 2)
+    assert matrix["col1"][2].tolist() == [5.0, 6.0]
+
+
+def test_rows_with_different_column_order() -> None:
+    requests = [_request(["a", "b"], [[1, "x"]]), _request(["b", "a"], [["y", 2]])]
+
+    df = log_dicts_to_data_frame(requests)
+
+    assert df["a"].tolist() == [1, 2]
+    assert df["b"].tolist() == ["x", "y"]
+
+
+def test_split_by_row_timestamp() -> None:
+    hour = 60 * 60 * 1000
+    day = 1677024000000
+    df = pd.DataFrame({"a": [1, 2, 3, 4, 5], "ts": [day + 2 * hour + 1, day + 5, None, day + 2 * hour, day - 1]})
+
+    slices = split_by_row_timestamp(df, "ts", TimeGranularity.H, default_timestamp=day)
+    assert [(ts, data["a"].tolist()) for ts, data in slices] == [
+        (day - hour, [5]),
+        (day, [2, 3]),
+        (day + 2 * hour, [1, 4]),
+    ]
+    assert all(list(data.columns) == ["a"] for _, data in slices)
+
+
+def test_split_by_row_timestamp_single_bucket() -> None:
+    day = 1677024000000
+    df = pd.DataFrame({"a": [1, 2], "ts": [day + 1, day + 2]})
+
+    [(ts, data)] = split_by_row_timestamp(df, "ts", TimeGranularity.D, default_timestamp=0)
+    assert ts == day
+    assert data["a"].tolist() == [1, 2]
+
+
+def _invalid_reason(parse: Callable[[], Any]) -> str:
+    try:
+        parse()
+    except InvalidRequestError as e:
+        return e.reason
+    raise AssertionError("Expected the request to be invalid")
+
+
+@pytest.mark.parametrize(
+    "request_dict,reason",
+    [
+        ({"timestamp": 1, "data": {"columns": ["a"], "data": [[1]]}}, "missing_dataset_id"),
+        ({"datasetId": "model-1", "timestamp": "now", "data": {"columns": ["a"], "data": [[1]]}}, "invalid_timestamp"),
+        ({"datasetId": "model-1", "timestamp": 1}, "missing_data"),
+        ({"datasetId": "model-1", "timestamp": 1, "data": {"columns": "a", "data": [[1]]}}, "invalid_columns"),
+        ({"datasetId": "model-1", "timestamp": 1, "data": {"columns": ["a", "b"], "data": [[1]]}}, "invalid_shape"),
+        ({"datasetId": "model-1", "timestamp": 1, "data": {"columns": ["a"], "data": [1]}}, "invalid_shape"),
+        (
+            {
+                "datasetId": "model-1",
+                "timestamp": 1,
+                "data": {"columns": ["a", "b"], "data": [[1, 2], [3]], "orient": "columns"},
+            },
+            "invalid_shape",
+        ),
+        (
+            {"datasetId": "model-1", "timestamp": 1, "data": {"columns": ["a"], "data": [[1]], "timestampColumn": "t"}},
+            "invalid_timestamp",
+        ),
+    ],
+)
+def test_invalid_requests(request_dict: Any, reason: str) -> None:
+    message = RawLogMessage(request=orjson.dumps(request_dict), request_time=1)
+    assert _invalid_reason(message.to_log_request_dict) == reason
+
+
+@pytest.mark.parametrize("timestamp", [1677024000000.5, float("inf"), float("nan")])
+def test_invalid_float_timestamp(timestamp: float) -> None:
+    request: Any = {"datasetId": "model-1", "timestamp": timestamp, "data": {"columns": ["a"], "data": [[1]]}}
+    assert _invalid_reason(lambda: validate_log_request_dict(request)) == "invalid_timestamp"
+
+
+def test_whole_float_timestamp() -> None:
+    request = {"datasetId": "model-1", "timestamp": 1677024000000.0, "data": {"columns": ["a"], "data": [[1]]}}
+    parsed = RawLogMessage(request=orjson.dumps(request), request_time=1).to_log_request_dict()
+    assert parsed["timestamp"] == 1677024000000
+    assert isinstance(parsed["timestamp"], int)
+
+
+def test_invalid_json_and_encoding() -> None:
+    assert (
+        _invalid_reason(RawLogMessage(request=b'{"datasetId": ', request_time=1).to_log_request_dict) == "invalid_json"
+    )
+    message = RawLogMessage(request=b"not gzip", request_time=1, content_encoding=GZIP)
+    assert _invalid_reason(message.to_log_request_dict) == "invalid_encoding"
+
+
+def test_invalid_embeddings() -> None:
+    request = {"datasetId": "model-1", "embeddings": {"a": [[1, 2], [3]]}}
+    message = RawLogEmbeddingsMessage(request=orjson.dumps(request), request_time=1)
+    assert _invalid_reason(message.to_log_embeddings_request_dict) == "invalid_embeddings"
+
+
+def _arrow_message(request: bytes, content_type: str = ARROW_STREAM_CONTENT_TYPE) -> RawLogArrowMessage:
+    return RawLogArrowMessage(
+        request=request, request_time=5, dataset_id="model-1", timestamp=None, content_type=content_type
+    )
+
+
+def test_arrow_stream_to_table() -> None:
+    pa = pytest.importorskip("pyarrow")
+    table = pa.table({"a": [1, 2, 3], "b": ["x", "y", None]})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        # Several record batches come back as one table
+        writer.write_table(table, max_chunksize=2)
+
+    assert _arrow_message(sink.getvalue().to_pybytes()).to_table().equals(table)
+
+
+def test_parquet_to_table() -> None:
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    table = pa.table({"a": [1.5, 2.5], "b": [True, False]})
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink)
+
+    for content_type in ["application/vnd.apache.parquet", "application/x-parquet"]:
+        assert _arrow_message(sink.getvalue().to_pybytes(), content_type).to_table().equals(table)
+
+
+def test_arrow_unsupported_content_type() -> None:
+    pytest.importorskip("pyarrow")
+    with pytest.raises(Exception, match="Unsupported content type"):
+        _arrow_message(b"", "text/csv").to_table()
+
+
+def test_arrow_timestamp_and_dataset_id() -> None:
+    message = _arrow_message(b"")
+    assert message.get_timestamp() == 5
+    assert get_message_dataset_id(message) == "model-1"
+    assert RawLogArrowMessage(b"", 5, "model-1", 10, ARROW_STREAM_CONTENT_TYPE).get_timestamp() == 10
+
+
+def test_mismatched_dataset_id() -> None:
+    request = orjson.dumps({"datasetId": "model-2", "embeddings": {"a": [[1, 2]]}})
+    message = RawLogEmbeddingsMessage(request=request, request_time=1, dataset_id="model-1")
+    assert _invalid_reason(message.to_log_embeddings_request_dict) == "mismatched_dataset_id"
+
+    request = orjson.dumps({"datasetId": "model-2", "data": {"columns": ["a"], "data": [[1]]}})
+    message2 = RawLogMessage(request=request, request_time=1, dataset_id="model-1")
+    assert _invalid_reason(message2.to_log_request_dict) == "mismatched_dataset_id"
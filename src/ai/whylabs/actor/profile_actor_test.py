@@ -0,0 +1,339 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future
+from queue import Full
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+import pandas as pd
+import pytest
+import whylogs as why
+from faster_fifo import Queue
+from whylogs.api.writer import Writer
+from whylogs.api.writer.writer import Writable
+from whylogs.core import DatasetProfileView
+
+from ...util.metrics import deserialize
+from ..container.config import ContainerConfig
+from .actor import CloseMessage
+from .checkpoints import Checkpoints
+from .overflow import OverflowPolicy, QueueFullError
+from .pending_uploads import PendingUploads
+from .profile_actor import ProfileActor
+from .profile_actor_messages import ARROW_STREAM_CONTENT_TYPE, RawLogArrowMessage, RawLogMessage
+from .quarantine import Quarantine
+from .shared_arena import SharedArena, SharedSlot
+from .spill_queue import SpillQueue
+
+# 2023-02-21T23:27:55.123Z
+_REQUEST_TIME = 1677022075123
+_DAY_MS = 24 * 60 * 60 * 1000
+
+
+class _RecordingWriter(Writer):
+    def __init__(self, release: Optional[threading.Event] = None) -> None:
+        self.written: List[DatasetProfileView] = []
+        # Writes wait for this, if it's set, to simulate slow uploads
+        self.release = release
+        self._lock = threading.Lock()
+
+    def write(self, file: Writable, dest: Optional[str] = None, **kwargs: Any) -> Tuple[bool, str]:
+        if self.release is not None:
+            self.release.wait()
+        with self._lock:
+            self.written.append(file)
+        return True, "ok"
+
+    def option(self, **kwargs: Any) -> "_RecordingWriter":
+        return self
+
+
+class _RecordingActor(ProfileActor):
+    """
+    A ProfileActor that's driven from the test process and hands its profiles to a writer per dataset instead
+    of uploading them.
+    """
+
+    def __init__(self, release: Optional[threading.Event] = None, **kwargs: Any) -> None:
+        super().__init__(Queue(1000 * 1000), **kwargs)
+        self.writers: Dict[str, _RecordingWriter] = {}
+        self.release = release
+
+    def _create_writer(self, dataset_id: str) -> Writer:
+        return self.writers.setdefault(dataset_id, _RecordingWriter(self.release))
+
+    def flush(self) -> Dict[str, List[DatasetProfileView]]:
+        for logger in self.loggers.values():
+            logger.close()
+        self.upload_pool.close()
+        return {dataset_id: writer.written for dataset_id, writer in self.writers.items()}
+
+
+def _arrow_message(table: Any, timestamp: Optional[int] = None, dataset_id: str = "model-1") -> RawLogArrowMessage:
+    pa = pytest.importorskip("pyarrow")
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return RawLogArrowMessage(
+        request=sink.getvalue().to_pybytes(),
+        request_time=_REQUEST_TIME,
+        dataset_id=dataset_id,
+        timestamp=timestamp,
+        content_type=ARROW_STREAM_CONTENT_TYPE,
+    )
+
+
+def _count(profile: DatasetProfileView, column: str) -> int:
+    count: int = profile.get_column(column).get_metric("counts").n.value
+    return count
+
+
+def test_log_arrow_groups_by_schema() -> None:
+    pa = pytest.importorskip("pyarrow")
+    actor = _RecordingActor()
+    messages: List[Any] = [
+        _arrow_message(pa.table({"a": [1, 2], "b": ["x", "y"]})),
+        _arrow_message(pa.table({"a": [3], "b": ["z"]})),
+        # Same columns in a different type, so it can't be concatenated with the others
+        _arrow_message(pa.table({"a": [4.5], "b": ["w"]})),
+    ]
+    actor.process_batch(messages, RawLogArrowMessage)
+
+    stats = actor.grouping_stats[RawLogArrowMessage.__name__]
+    assert (stats.messages, stats.groups, stats.rows) == (3, 2, 4)
+    profiles = actor.flush()["model-1"]
+    # Both groups end up in the same daily profile
+    assert len(profiles) == 1
+    assert _count(profiles[0], "a") == 4
+    assert _count(profiles[0], "b") == 4
+    # The tables' memory is freed as they're converted, the values have to make it through intact
+    assert profiles[0].get_column("a").get_metric("distribution").mean.value == pytest.approx(10.5 / 4)
+
+
+def test_log_arrow_timestamp() -> None:
+    pa = pytest.importorskip("pyarrow")
+    actor = _RecordingActor()
+    table = pa.table({"a": [1]})
+    actor.process_batch(
+        [_arrow_message(table), _arrow_message(table, timestamp=_REQUEST_TIME - _DAY_MS)], RawLogArrowMessage
+    )
+
+    profiles = actor.flush()["model-1"]
+    timestamps = sorted(int(it.dataset_timestamp.timestamp() * 1000) for it in profiles)
+    today = _REQUEST_TIME - _REQUEST_TIME % _DAY_MS
+    assert timestamps == [today - _DAY_MS, today]
+
+
+def test_log_arrow_quarantines_bad_bodies(tmp_path: str) -> None:
+    pa = pytest.importorskip("pyarrow")
+    actor = _RecordingActor(quarantine=Quarantine(str(tmp_path)))
+    bad = RawLogArrowMessage(b"not arrow", _REQUEST_TIME, "model-1", None, ARROW_STREAM_CONTENT_TYPE)
+    actor.process_batch([bad, _arrow_message(pa.table({"a": [1, 2]}))], RawLogArrowMessage)
+
+    profiles = actor.flush()["model-1"]
+    assert _count(profiles[0], "a") == 2
+    assert len([it for it in os.listdir(tmp_path) if it.endswith(".json")]) == 1
+
+
+def test_recovered_uploads_are_not_saved_twice(tmp_path: str) -> None:
+    pending = PendingUploads(str(tmp_path))
+    for _ in range(3):
+        pending.save("model-1", why.log(pd.DataFrame({"a": [1]})).view())
+    config = ContainerConfig()
+    config.upload_max_pending = 1
+    config.shutdown_deadline_seconds = 0.1
+    release = threading.Event()
+    actor = _RecordingActor(release, env_vars=config, pending_uploads=pending)
+
+    try:
+        # Only as many as fit in the upload pool are submitted, the rest wait instead of blocking the actor
+        actor.on_start()
+        assert len(actor._recovered) == 2
+
+        # The one that was still uploading is left where it is instead of being saved under a new name
+        actor.process_close_message([CloseMessage()])
+        assert len(os.listdir(tmp_path)) == 3
+    finally:
+        release.set()
+
+
+def _log_message(dataset_id: str, rows: int = 2) -> RawLogMessage:
+    request = {"datasetId": dataset_id, "data": {"columns": ["a"], "data": [[i] for i in range(rows)]}}
+    return RawLogMessage(request=orjson.dumps(request), request_time=_REQUEST_TIME, dataset_id=dataset_id)
+
+
+def _evictions(actor: ProfileActor) -> Dict[Any, float]:
+    families = {it.name: it for it in deserialize(actor.metrics.serialize())}
+    return families["logger_evictions_total"].samples  # type: ignore
+
+
+def test_lru_eviction_flushes_logger(tmp_path: str) -> None:
+    config = ContainerConfig()
+    config.max_loggers = 1
+    checkpoints = Checkpoints(str(tmp_path))
+    actor = _RecordingActor(env_vars=config, checkpoints=checkpoints)
+
+    actor.process_batch([_log_message("model-1", rows=3)], RawLogMessage)
+    actor.checkpoint().result()
+    assert list(checkpoints.load()) == ["model-1"]
+
+    actor.process_batch([_log_message("model-2")], RawLogMessage)
+    loaded = list(checkpoints.load())
+    loggers = [dataset_id for dataset_id, _ in actor.loggers.items()]
+    written = actor.flush()
+
+    # The evicted logger's profile was handed to its writer and its checkpoint isn't restored anymore
+    assert loggers == ["model-2"]
+    assert loaded == []
+    assert [_count(it, "a") for it in written["model-1"]] == [3]
+    assert _evictions(actor) == {(("reason", "lru"),): 1}
+
+
+def test_idle_eviction_flushes_logger() -> None:
+    config = ContainerConfig()
+    config.logger_idle_seconds = 0.01
+    actor = _RecordingActor(env_vars=config)
+
+    actor.process_batch([_log_message("model-1")], RawLogMessage)
+    time.sleep(0.05)
+    actor.after_poll()
+    loggers = len(actor.loggers)
+    written = actor.flush()
+
+    assert loggers == 0
+    assert [_count(it, "a") for it in written["model-1"]] == [2]
+    assert _evictions(actor) == {(("reason", "idle"),): 1}
+
+
+def _fill(queue: Queue) -> None:
+    for size in [10_000, 10]:
+        try:
+            while True:
+                queue.put(b"x" * size, block=False)
+        except Full:
+            pass
+
+
+def _arena_actor(
+    monkeypatch: pytest.MonkeyPatch, policy: OverflowPolicy, **kwargs: Any
+) -> Tuple[_RecordingActor, SharedArena, List[SharedSlot]]:
+    """
+    An actor with a full queue that shares every request through an arena, and the slots it allocated.
+    """
+    config = ContainerConfig()
+    config.queue_overflow_policy = policy
+    config.queue_overflow_deadline_seconds = 0.1
+    config.shared_memory_min_request_bytes = 1
+    arena = SharedArena(1024 * 1024)
+    allocated: List[SharedSlot] = []
+
+    def allocate(data: bytes) -> Optional[SharedSlot]:
+        slot = SharedArena.allocate(arena, data)
+        if slot is not None:
+            allocated.append(slot)
+        return slot
+
+    monkeypatch.setattr(arena, "allocate", allocate)
+    actor = _RecordingActor(env_vars=config, shared_arena=arena, **kwargs)
+    _fill(actor.queue)
+    return actor, arena, allocated
+
+
+def test_shared_request_reused_across_retries(monkeypatch: pytest.MonkeyPatch) -> None:
+    actor, arena, allocated = _arena_actor(monkeypatch, OverflowPolicy.BLOCK)
+    message = _log_message("model-1")
+
+    async def drain_later() -> None:
+        await asyncio.sleep(0.05)
+        while actor.queue.qsize() > 0:
+            actor.queue.get_many(block=False)
+
+    async def run() -> None:
+        await asyncio.gather(actor.send(message), drain_later())
+
+    asyncio.run(run())
+
+    queued = actor.queue.get_many(block=False)
+    assert actor.send_stats.delayed == 1
+    assert len(allocated) == 1
+    assert [it.shared_request for it in queued] == allocated
+    assert bytes(arena.view(allocated[0])) == message.request
+
+
+def test_shared_request_released_when_rejected(monkeypatch: pytest.MonkeyPatch) -> None:
+    actor, arena, allocated = _arena_actor(monkeypatch, OverflowPolicy.BLOCK)
+
+    with pytest.raises(QueueFullError):
+        asyncio.run(actor.send(_log_message("model-1")))
+
+    assert actor.send_stats.delayed == 1
+    assert len(allocated) == 1
+    assert arena.used_bytes() == 0
+
+
+def test_shared_request_released_when_spilled(monkeypatch: pytest.MonkeyPatch, tmp_path: str) -> None:
+    spill_queue = SpillQueue(str(tmp_path))
+    actor, arena, allocated = _arena_actor(monkeypatch, OverflowPolicy.SPILL, spill_queue=spill_queue)
+    message = _log_message("model-1")
+
+    asyncio.run(actor.send(message))
+
+    assert len(allocated) == 1
+    assert arena.used_bytes() == 0
+    # The spilled message has its own copy of the body instead of pointing into the arena
+    assert spill_queue.read_many(10) == [message]
+
+
+def test_eviction_doesnt_wait_for_checkpoint(tmp_path: str) -> None:
+    config = ContainerConfig()
+    config.max_loggers = 1
+    checkpoints = Checkpoints(str(tmp_path))
+    actor = _RecordingActor(env_vars=config, checkpoints=checkpoints)
+    actor.process_batch([_log_message("model-1")], RawLogMessage)
+    actor.checkpoint().result()
+
+    job: "Future[None]" = Future()
+    actor._checkpoint_job = job
+    actor.process_batch([_log_message("model-2")], RawLogMessage)
+    # The evicted logger's checkpoint is only removed once the one being saved is done
+    loaded = list(checkpoints.load())
+    job.set_result(None)
+    actor.flush()
+
+    assert loaded == ["model-1"]
+    assert list(checkpoints.load()) == []
+
+
+def test_close_keeps_checkpoints_past_deadline(tmp_path: str) -> None:
+    config = ContainerConfig()
+    config.shutdown_deadline_seconds = 0.1
+    checkpoints = Checkpoints(str(tmp_path))
+    actor = _RecordingActor(env_vars=config, checkpoints=checkpoints)
+    actor.process_batch([_log_message("model-1")], RawLogMessage)
+    actor.checkpoint().result()
+
+    actor._checkpoint_job = Future()
+    actor.process_close_message([CloseMessage()])
+
+    assert list(checkpoints.load()) == ["model-1"]
+
+
+def test_dataset_timestamps() -> None:
+    actor = _RecordingActor()
+    pairs = [("model-1", _REQUEST_TIME), ("model-2", _REQUEST_TIME - _DAY_MS), ("model-1", _REQUEST_TIME + 1)]
+
+    expected = [actor._dataset_timestamp(dataset_id, timestamp) for dataset_id, timestamp in pairs]
+    assert actor._dataset_timestamps(pairs) == expected
+    # Too large for numpy, these are done one at a time instead
+    assert actor._dataset_timestamps([("model-1", 2**70)]) == [actor._dataset_timestamp("model-1", 2**70)]
+
+
+def test_writers_share_api_client() -> None:
+    actor = _RecordingActor()
+    writers = [ProfileActor._create_writer(actor, dataset_id) for dataset_id in ["model-1", "model-2"]]
+
+    clients = {id(it._writer._api_client) for it in writers}
+    assert clients == {id(actor._get_api_client())}
+    assert actor._get_api_client().configuration.host == actor.env_vars.whylabs_api_endpoint
@@ -0,0 +1,45 @@
+import logging
+import os
+import uuid
+from typing import Any, Dict
+
+import orjson
+
+_BODY_SUFFIX = ".body"
+_INFO_SUFFIX = ".json"
+
+
+class Quarantine:
+    """
+    Requests that couldn't be logged, saved to a directory along with why so that they can be inspected
+    later. Each one is a .body file with the request exactly as it was received and a .json file with the
+    reason and the request's metadata. Saving stops once there are max_files requests in the directory, or
+    once the bodies add up to max_bytes.
+    """
+
+    def __init__(self, directory: str, max_files: int = 1000, max_bytes: int = 1024 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._logger = logging.getLogger(f"{type(self).__name__}_{id(self)}")
+        os.makedirs(directory, exist_ok=True)
+        names = os.listdir(directory)
+        self._count = len([it for it in names if it.endswith(_INFO_SUFFIX)])
+        self._bytes = sum(os.path.getsize(os.path.join(directory, it)) for it in names if it.endswith(_BODY_SUFFIX))
+
+    def save(self, body: bytes, info: Dict[str, Any]) -> bool:
+        """
+        Save a request, returning False if the directory is already full or the request doesn't fit.
+        """
+        if self._count >= self.max_files or self._bytes + len(body) > self.max_bytes:
+            return False
+
+        path = os.path.join(self.directory, uuid.uuid4().hex)
+        with open(f"{path}{_BODY_SUFFIX}", "wb") as f:
+            f.write(body)
+        # The info file is written last, so a body without one was never completely saved
+        with open(f"{path}{_INFO_SUFFIX}", "wb") as f:
+            f.write(orjson.dumps(info, option=orjson.OPT_INDENT_2))
+        self._count += 1
+        self._bytes += len(body)
+        return True
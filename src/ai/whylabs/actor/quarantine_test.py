@@ -0,0 +1,37 @@
+import os
+
+import orjson
+
+from .quarantine import Quarantine
+
+
+def test_save(tmp_path: str) -> None:
+    quarantine = Quarantine(str(tmp_path))
+    assert quarantine.save(b"not json", {"reason": "invalid_json", "dataset_id": "model-1"})
+
+    names = sorted(os.listdir(tmp_path))
+    assert [os.path.splitext(it)[1] for it in names] == [".body", ".json"]
+    with open(os.path.join(tmp_path, names[0]), "rb") as f:
+        assert f.read() == b"not json"
+    with open(os.path.join(tmp_path, names[1]), "rb") as f:
+        assert orjson.loads(f.read()) == {"reason": "invalid_json", "dataset_id": "model-1"}
+
+
+def test_max_files(tmp_path: str) -> None:
+    quarantine = Quarantine(str(tmp_path), max_files=2)
+    assert quarantine.save(b"1", {})
+    assert quarantine.save(b"2", {})
+    assert not quarantine.save(b"3", {})
+
+    # Files from before a restart count too
+    assert not Quarantine(str(tmp_path), max_files=2).save(b"4", {})
+
+
+def test_max_bytes(tmp_path: str) -> None:
+    quarantine = Quarantine(str(tmp_path), max_bytes=10)
+    assert not quarantine.save(b"x" * 11, {})
+    assert quarantine.save(b"x" * 6, {})
+    assert not quarantine.save(b"x" * 6, {})
+    assert quarantine.save(b"x" * 4, {})
+
+    assert not Quarantine(str(tmp_path), max_bytes=10).save(b"x", {})
@@ -0,0 +1,255 @@
+import re
+from typing import Any, Dict, List, Optional
+
+import orjson
+
+from .profile_actor_messages import InvalidRequestError
+
+_WHITESPACE = re.compile(rb"[ \t\r\n]*")
+# The rest of a string after its opening quote
+_STRING_REST = re.compile(rb'(?:[^"\\]|\\.)*"')
+_STRUCTURE = re.compile(rb'["\[\]{}]')
+_SCALAR = re.compile(rb"[^,\]}\s]*")
+# A run of rows without strings or nested values in them, which is what most rows look like
+_FLAT_ROWS = re.compile(rb"\[[^\[\]{}\"]*\](?:[ \t\r\n]*,[ \t\r\n]*\[[^\[\]{}\"]*\])*")
+
+# What the chunker is expecting next
+_START = 0
+_KEY = 1
+_DATA_START = 2
+_DATA_KEY = 3
+_ROWS_START = 4
+_ROWS = 5
+_END = 6
+
+# Fields that change how the rows are interpreted, so they can't show up after the first chunk was sent
+_HEADER_FIELDS = {"timestamp", "orient", "timestampColumn"}
+
+
+class RowChunker:
+    """
+    Split a /log request into several smaller requests as it's read, so that a very large request never
+    has to be in memory at once. Each chunk has the same dataset id, timestamp and columns as the original
+    request and a slice of its rows that's about max_chunk_bytes long. The rows are passed along as the
+    original json without being parsed, only the fields around them are.
+
+    Rows that show up before the dataset id and columns are held until they're known. The timestamp,
+    orient and timestampColumn fields have to come before the rows if there are enough rows to fill a chunk,
+    which is the order that clients normally send them in. Only row oriented data can be split.
+    """
+
+    def __init__(self, max_chunk_bytes: int, dataset_id: Optional[str] = None) -> None:
+        self.max_chunk_bytes = max_chunk_bytes
+        self.dataset_id = dataset_id
+        self._fields: Dict[str, Any] = {}
+        self._data_fields: Dict[str, Any] = {}
+        self._buffer = bytearray()
+        self._pos = 0
+        self._state = _START
+        # Where the rows of the chunk being collected start and end in the buffer
+        self._rows_start: Optional[int] = None
+        self._rows_end = 0
+        self._rows = 0
+        self._sent_chunks = 0
+        # How many rows each of the chunks returned so far has
+        self.chunk_rows: List[int] = []
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """
+        Add more of the request. Returns the chunks that are ready to be logged, as complete /log requests.
+        """
+        self._buffer += data
+        chunks: List[bytes] = []
+        self._parse(chunks, final=False)
+        self._compact()
+        return chunks
+
+    def close(self) -> List[bytes]:
+        """
+        Finish the request, returning the last chunks.
+        """
+        chunks: List[bytes] = []
+        self._parse(chunks, final=True)
+        if self._state != _END:
+            raise InvalidRequestError("invalid_json", "Request ended before the json was complete")
+
+        if self._rows_start is not None or self._sent_chunks == 0:
+            # Even a request without any rows is sent along so that it's handled like any other request
+            chunks.append(self._chunk())
+        return chunks
+
+    def _parse(self, chunks: List[bytes], final: bool) -> None:
+        while self._state != _END:
+            self._skip_whitespace_and_commas()
+            if self._pos >= len(self._buffer):
+                return
+
+            char = self._buffer[self._pos]
+            if self._state == _START:
+                self._expect(char, b"{")
+                self._state = _KEY
+            elif self._state in (_KEY, _DATA_KEY):
+                if char == ord("}"):
+                    self._pos += 1
+                    self._state = _END if self._state == _KEY else _KEY
+                    continue
+                if not self._read_field(final):
+                    return
+            elif self._state == _DATA_START:
+                self._expect(char, b"{")
+                self._state = _DATA_KEY
+            elif self._state == _ROWS_START:
+                self._expect(char, b"[")
+                self._state = _ROWS
+            elif self._state == _ROWS:
+                if char == ord("]"):
+                    self._pos += 1
+                    self._state = _DATA_KEY
+                    continue
+                rows_start = self._pos if self._rows_start is None else self._rows_start
+                # Take as many flat rows as fit in the chunk in one go instead of going a row at a time
+                flat = None
+                if char == ord("["):
+                    flat = _FLAT_ROWS.match(self._buffer, self._pos, rows_start + self.max_chunk_bytes)
+                if flat is not None:
+                    end = flat.end()
+                    rows = self._buffer.count(b"[", self._pos, end)
+                else:
+                    value_end = self._value_end(self._pos, final)
+                    if value_end is None:
+                        return
+                    end = value_end
+                    rows = 1
+                self._rows_start = rows_start
+                self._rows_end = end
+                self._rows += rows
+                self._pos = end
+                if self._rows_end - self._rows_start >= self.max_chunk_bytes and self._ready():
+                    chunks.append(self._chunk())
+
+    def _read_field(self, final: bool) -> bool:
+        """
+        Read a key and its value, or start reading the data object or the rows. Returns False if more of the
+        request is needed first.
+        """
+        self._expect(self._buffer[self._pos], b'"', self._pos)
+        key_end = self._value_end(self._pos, final)
+        if key_end is None:
+            return False
+        key = orjson.loads(self._buffer[self._pos : key_end])
+
+        colon = self._after(_WHITESPACE, key_end)
+        if colon >= len(self._buffer):
+            return False
+        self._expect(self._buffer[colon], b":", colon)
+        value_start = self._after(_WHITESPACE, colon + 1)
+        if value_start >= len(self._buffer):
+            return False
+
+        if self._state == _KEY and key == "data":
+            self._pos = value_start
+            self._state = _DATA_START
+            return True
+        if self._state == _DATA_KEY and key == "data":
+            self._pos = value_start
+            self._state = _ROWS_START
+            return True
+
+        value_end = self._value_end(value_start, final)
+        if value_end is None:
+            return False
+        value = orjson.loads(self._buffer[value_start:value_end])
+        self._pos = value_end
+        if key in _HEADER_FIELDS and self._sent_chunks > 0:
+            raise InvalidRequestError("invalid_stream", f"{key} has to come before the rows in large requests")
+
+        if self._state == _KEY:
+            self._fields[key] = value
+        else:
+            if key == "orient" and value == "columns":
+                raise InvalidRequestError("invalid_orient", "Large requests have to be row oriented")
+            self._data_fields[key] = value
+        return True
+
+    def _value_end(self, start: int, final: bool) -> Optional[int]:
+        """
+        Where the json value that starts at start ends, or None if it isn't all there yet.
+        """
+        buffer = self._buffer
+        char = buffer[start]
+        if char == ord('"'):
+            match = _STRING_REST.match(buffer, start + 1)
+            return None if match is None else match.end()
+
+        if char not in b"[{":
+            end = self._after(_SCALAR, start)
+            # A number at the end of the buffer might have more digits coming
+            return end if end < len(buffer) or final else None
+
+        depth = 0
+        pos = start
+        while True:
+            match = _STRUCTURE.search(buffer, pos)
+            if match is None:
+                return None
+            pos = match.end()
+            found = buffer[match.start()]
+            if found == ord('"'):
+                string = _STRING_REST.match(buffer, pos)
+                if string is None:
+                    return None
+                pos = string.end()
+            elif found in b"[{":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return pos
+
+    def _ready(self) -> bool:
+        return (self.dataset_id is not None or "datasetId" in self._fields) and "columns" in self._data_fields
+
+    def _chunk(self) -> bytes:
+        request: Dict[str, Any] = dict(self._fields)
+        if self.dataset_id is not None:
+            request["datasetId"] = self.dataset_id
+        data: Dict[str, Any] = dict(self._data_fields)
+        data["data"] = []
+        request["data"] = data
+        prefix = orjson.dumps(request)
+        # Put the raw rows in place of the empty list that ends the request
+        suffix_length = len(b"]}}")
+        rows = b"" if self._rows_start is None else bytes(self._buffer[self._rows_start : self._rows_end])
+        self._rows_start = None
+        self._sent_chunks += 1
+        self.chunk_rows.append(self._rows)
+        self._rows = 0
+        return prefix[:-suffix_length] + rows + prefix[-suffix_length:]
+
+    def _compact(self) -> None:
+        # Drop what's been read, except for rows that haven't been sent yet
+        keep = self._pos if self._rows_start is None else self._rows_start
+        if keep == 0:
+            return
+        del self._buffer[:keep]
+        self._pos -= keep
+        if self._rows_start is not None:
+            self._rows_start -= keep
+            self._rows_end -= keep
+
+    def _after(self, pattern: "re.Pattern[bytes]", pos: int) -> int:
+        # Both patterns can match nothing, so there's always a match
+        match = pattern.match(self._buffer, pos)
+        return pos if match is None else match.end()
+
+    def _skip_whitespace_and_commas(self) -> None:
+        buffer = self._buffer
+        while self._pos < len(buffer) and buffer[self._pos] in b" \t\r\n,":
+            self._pos += 1
+
+    def _expect(self, char: int, expected: bytes, pos: Optional[int] = None) -> None:
+        if char != expected[0]:
+            at = self._pos if pos is None else pos
+            raise InvalidRequestError("invalid_json", f"Expected {expected.decode()} at {at}, got {chr(char)}")
+        if pos is None:
+            self._pos += 1
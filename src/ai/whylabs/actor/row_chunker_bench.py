@@ -0,0 +1,52 @@
+"""
+Compare splitting a large /log request into chunks of rows, which is what streamed requests cost the http process,
+with what a buffered request costs it (peeking at the dataset id) and with parsing the whole request.
+
+Run with `python -m ai.whylabs.actor.row_chunker_bench` from the src directory.
+"""
+import time
+from typing import Callable, List
+
+import orjson
+
+from .profile_actor_messages import peek_dataset_id
+from .row_chunker import RowChunker
+
+_PIECE_SIZE = 64 * 1024
+_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def _make_request(rows: int, columns: int) -> bytes:
+    names = [f"col_{i}" for i in range(columns)]
+    data = [[i * 0.5 + j for j in range(columns)] for i in range(rows)]
+    return orjson.dumps({"datasetId": "model-1", "timestamp": 0, "data": {"columns": names, "data": data}})
+
+
+def _chunk(request: bytes) -> None:
+    chunker = RowChunker(_CHUNK_BYTES)
+    view = memoryview(request)
+    for start in range(0, len(request), _PIECE_SIZE):
+        chunker.feed(view[start : start + _PIECE_SIZE])
+    chunker.close()
+
+
+def _time(name: str, request: bytes, fn: Callable[[bytes], object], iterations: int = 3) -> float:
+    times: List[float] = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(request)
+        times.append(time.perf_counter() - start)
+
+    best = min(times)
+    print(f"  {name:<10} {best:>8.3f}s {len(request) / best / 1024 / 1024:>8.1f}MB/s")
+    return best
+
+
+if __name__ == "__main__":
+    for rows, columns in [(1_000_000, 1), (100_000, 20), (10_000, 200)]:
+        request = _make_request(rows, columns)
+        print(f"{rows} rows x {columns} columns, {len(request) // 1024 // 1024}MB")
+        buffered = _time("buffered", request, peek_dataset_id)
+        chunked = _time("chunked", request, _chunk)
+        parsed = _time("orjson", request, orjson.loads)
+        print(f"  chunking costs {chunked / parsed:.1f}x a full parse")
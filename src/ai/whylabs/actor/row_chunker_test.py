@@ -0,0 +1,113 @@
+import random
+from typing import Any, Callable, Dict, List
+
+import orjson
+import pytest
+
+from .profile_actor_messages import InvalidRequestError
+from .row_chunker import RowChunker
+
+
+def _chunk(body: bytes, max_chunk_bytes: int, piece_sizes: List[int], dataset_id: Any = None) -> List[Dict[str, Any]]:
+    chunker = RowChunker(max_chunk_bytes, dataset_id=dataset_id)
+    chunks: List[bytes] = []
+    start = 0
+    while start < len(body):
+        size = piece_sizes[start % len(piece_sizes)]
+        chunks += chunker.feed(body[start : start + size])
+        start += size
+    chunks += chunker.close()
+    return [orjson.loads(it) for it in chunks]
+
+
+def _rows(chunks: List[Dict[str, Any]]) -> List[Any]:
+    return [row for chunk in chunks for row in chunk["data"]["data"]]
+
+
+def _invalid_reason(chunk: Callable[[], Any]) -> str:
+    try:
+        chunk()
+    except InvalidRequestError as e:
+        return e.reason
+    raise AssertionError("Expected the request to be invalid")
+
+
+_REQUEST = {
+    "datasetId": "model-1",
+    "timestamp": 1000,
+    "data": {
+        "columns": ["a", 'b"]', "c"],
+        # Strings with brackets, quotes and escapes, and nested values
+        "data": [[i, 'x"],[{\\' * (i % 3), [1, {"k": [2]}] if i % 2 else None] for i in range(500)],
+    },
+}
+
+
+@pytest.mark.parametrize("piece_sizes", [[1], [7, 13], [4096], [10_000_000]])
+def test_chunks_have_all_rows(piece_sizes: List[int]) -> None:
+    body = orjson.dumps(_REQUEST, option=orjson.OPT_INDENT_2)
+    chunks = _chunk(body, 500, piece_sizes)
+
+    assert len(chunks) > 1
+    assert _rows(chunks) == _REQUEST["data"]["data"]  # type: ignore
+    for chunk in chunks:
+        assert chunk["datasetId"] == "model-1"
+        assert chunk["timestamp"] == 1000
+        assert chunk["data"]["columns"] == ["a", 'b"]', "c"]
+
+
+def test_random_pieces() -> None:
+    body = orjson.dumps(_REQUEST)
+    rng = random.Random(0)
+    chunks = _chunk(body, 1000, [rng.randint(1, 200) for _ in range(100)])
+    assert _rows(chunks) == _REQUEST["data"]["data"]  # type: ignore
+
+
+def test_fields_after_rows_are_held() -> None:
+    body = b'{"data": {"data": [[1], [2], [3.5]], "columns": ["a"]}, "datasetId": "model-1", "timestamp": 5}'
+    chunks = _chunk(body, 1, [3])
+
+    # Nothing could be sent before the columns and dataset id, so it all goes in the last chunk
+    assert chunks == [{"datasetId": "model-1", "timestamp": 5, "data": {"columns": ["a"], "data": [[1], [2], [3.5]]}}]
+
+
+def test_dataset_id_from_header() -> None:
+    body = b'{"data": {"columns": ["a"], "data": [[1], [2]]}}'
+    chunks = _chunk(body, 1, [100], dataset_id="model-2")
+    assert [it["datasetId"] for it in chunks] == ["model-2", "model-2"]
+    assert _rows(chunks) == [[1], [2]]
+
+
+def test_no_rows() -> None:
+    body = b'{"datasetId": "model-1", "data": {"columns": ["a"], "data": []}}'
+    assert _chunk(body, 10, [5]) == [{"datasetId": "model-1", "data": {"columns": ["a"], "data": []}}]
+
+
+def test_header_after_sent_chunk() -> None:
+    body = b'{"datasetId": "model-1", "data": {"columns": ["a"], "data": [[1], [2]]}, "timestamp": 5}'
+    assert _invalid_reason(lambda: _chunk(body, 1, [100])) == "invalid_stream"
+
+
+def test_columns_orient() -> None:
+    body = b'{"datasetId": "model-1", "data": {"orient": "columns", "columns": ["a"], "data": [[1, 2]]}}'
+    assert _invalid_reason(lambda: _chunk(body, 1, [100])) == "invalid_orient"
+
+
+@pytest.mark.parametrize("body", [b'{"datasetId": "model-1", "data": {"columns": ["a"], "data": [[1]', b"[1, 2]"])
+def test_invalid_json(body: bytes) -> None:
+    assert _invalid_reason(lambda: _chunk(body, 1, [100])) == "invalid_json"
+
+
+@pytest.mark.parametrize("rows", [[[i, i * 0.5] for i in range(100)], _REQUEST["data"]["data"]])  # type: ignore
+def test_chunk_rows(rows: List[Any]) -> None:
+    body = orjson.dumps(
+        {"datasetId": "model-1", "data": {"columns": ["a", "b"], "data": rows}}, option=orjson.OPT_INDENT_2
+    )
+    chunker = RowChunker(50)
+    chunks = [it for start in range(0, len(body), 100) for it in chunker.feed(body[start : start + 100])]
+    chunks += chunker.close()
+
+    counts = [len(orjson.loads(it)["data"]["data"]) for it in chunks]
+    assert len(counts) > 1
+    assert chunker.chunk_rows == counts
+    assert sum(counts) == len(rows)
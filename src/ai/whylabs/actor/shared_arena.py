@@ -0,0 +1,126 @@
+import ctypes
+import struct
+from dataclasses import dataclass
+from multiprocessing import Lock
+from multiprocessing.sharedctypes import RawArray
+from typing import Optional
+
+# Every block starts with its total size, including the header and padding, and whether it's been released
+_BLOCK_HEADER = struct.Struct("<QQ")
+# Blocks are multiples of the header size so that there's always room for a header at the end of the buffer
+_ALIGNMENT = _BLOCK_HEADER.size
+_IN_USE = 0
+_RELEASED = 1
+# Indexes into the state array
+_HEAD = 0
+_TAIL = 1
+_USED = 2
+
+
+@dataclass(frozen=True)
+class SharedSlot:
+    """
+    Where some data was written in a SharedArena. This is what gets sent through the queue in place of the data.
+    """
+
+    offset: int
+    length: int
+
+
+def _block_size(length: int) -> int:
+    size = _BLOCK_HEADER.size + length
+    return size + (-size % _ALIGNMENT)
+
+
+class SharedArena:
+    """
+    A ring buffer in shared memory for handing large request bodies from the http processes to an actor
+    without copying them through the queue. Any process can allocate and the actor releases each slot once
+    it's done with it. Slots can be released in any order, the space is reclaimed from the oldest slot
+    forward once everything before it has been released. This has to be created before forking.
+    """
+
+    def __init__(self, size_bytes: int) -> None:
+        self.capacity = size_bytes - size_bytes % _ALIGNMENT
+        self._buffer = RawArray(ctypes.c_ubyte, self.capacity)
+        # The oldest block that hasn't been reclaimed, where the next block goes, and the bytes in between
+        self._state = RawArray(ctypes.c_int64, 3)
+        self._lock = Lock()
+
+    def _view(self) -> memoryview:
+        return memoryview(self._buffer).cast("B")
+
+    def allocate(self, data: bytes) -> Optional[SharedSlot]:
+        """
+        Copy data into the arena. Returns None if there isn't room for it, in which case the caller should send
+        the data through the queue as usual.
+        """
+        size = _block_size(len(data))
+        view = self._view()
+        with self._lock:
+            self._reclaim(view)
+            offset = self._reserve(view, size)
+            if offset is None:
+                return None
+            _BLOCK_HEADER.pack_into(view, offset, size, _IN_USE)
+
+        # The block belongs to the caller now, so the copy doesn't need to hold up other processes
+        start = offset + _BLOCK_HEADER.size
+        view[start : start + len(data)] = data
+        return SharedSlot(offset, len(data))
+
+    def _reclaim(self, view: memoryview) -> None:
+        state = self._state
+        while state[_USED] > 0:
+            size, status = _BLOCK_HEADER.unpack_from(view, state[_HEAD])
+            if status != _RELEASED:
+                break
+            state[_HEAD] = (state[_HEAD] + size) % self.capacity
+            state[_USED] -= size
+
+        if state[_USED] == 0:
+            # Start over at the beginning so that the whole arena is available in one piece
+            state[_HEAD] = 0
+            state[_TAIL] = 0
+
+    def _reserve(self, view: memoryview, size: int) -> Optional[int]:
+        state = self._state
+        head, tail, used = state[_HEAD], state[_TAIL], state[_USED]
+        if used == self.capacity:
+            return None
+
+        if tail >= head:
+            # The free space is after the tail and before the head
+            if size <= self.capacity - tail:
+                offset = tail
+            elif size <= head:
+                # Skip the end of the buffer with a block that's already released
+                _BLOCK_HEADER.pack_into(view, tail, self.capacity - tail, _RELEASED)
+                state[_USED] += self.capacity - tail
+                offset = 0
+            else:
+                return None
+        elif size <= head - tail:
+            offset = tail
+        else:
+            return None
+
+        state[_TAIL] = (offset + size) % self.capacity
+        state[_USED] += size
+        return offset
+
+    def view(self, slot: SharedSlot) -> memoryview:
+        """
+        The data in a slot, without copying it. It's only valid until the slot is released.
+        """
+        start = slot.offset + _BLOCK_HEADER.size
+        return self._view()[start : start + slot.length]
+
+    def release(self, slot: SharedSlot) -> None:
+        with self._lock:
+            _BLOCK_HEADER.pack_into(self._view(), slot.offset, _block_size(slot.length), _RELEASED)
+
+    def used_bytes(self) -> int:
+        with self._lock:
+            self._reclaim(self._view())
+            return int(self._state[_USED])
@@ -0,0 +1,55 @@
+import os
+
+from .shared_arena import SharedArena, SharedSlot
+
+
+def _allocate(arena: SharedArena, data: bytes) -> SharedSlot:
+    slot = arena.allocate(data)
+    assert slot is not None
+    return slot
+
+
+def test_allocate_and_release() -> None:
+    arena = SharedArena(1024)
+    slot = _allocate(arena, b"hello")
+    assert bytes(arena.view(slot)) == b"hello"
+    assert arena.used_bytes() > 0
+
+    arena.release(slot)
+    assert arena.used_bytes() == 0
+
+
+def test_full_until_oldest_released() -> None:
+    arena = SharedArena(1024)
+    slots = [_allocate(arena, bytes([i]) * 200) for i in range(4)]
+    assert arena.allocate(b"x" * 200) is None
+
+    # Releasing out of order doesn't free anything until the oldest slot is released too
+    arena.release(slots[1])
+    assert arena.allocate(b"x" * 200) is None
+    arena.release(slots[0])
+
+    # The new slot doesn't fit after the last one, so it wraps around to the start
+    wrapped = _allocate(arena, b"y" * 300)
+    assert wrapped.offset == 0
+    assert bytes(arena.view(wrapped)) == b"y" * 300
+    assert bytes(arena.view(slots[3])) == bytes([3]) * 200
+
+
+def test_too_large() -> None:
+    assert SharedArena(1024).allocate(b"x" * 1024) is None
+
+
+def test_shared_across_fork() -> None:
+    arena = SharedArena(1024)
+
+    pid = os.fork()
+    if pid == 0:
+        arena.allocate(b"from child")
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    # The parent's slot goes after the child's
+    slot = _allocate(arena, b"from parent")
+    assert slot.offset > 0
+    assert bytes(arena.view(SharedSlot(0, len(b"from child")))) == b"from child"
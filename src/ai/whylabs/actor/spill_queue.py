@@ -0,0 +1,245 @@
+import fcntl
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+from dataclasses import dataclass
+from typing import Any, List, Optional, Tuple
+
+# Each segment starts with the offset that data has been written up to and whether or not the segment
+# has been sealed, meaning writers have moved on to the next segment.
+_SEGMENT_HEADER = struct.Struct("<QQ")
+# Each record is the length of the pickled message followed by the message.
+_RECORD_HEADER = struct.Struct("<I")
+_SEGMENT_PREFIX = "segment-"
+_SEGMENT_SUFFIX = ".log"
+_ACK_FILE = "ack"
+_LOCK_FILE = "lock"
+
+_DEFAULT_SEGMENT_SIZE_BYTES = 64 * 1024 * 1024
+
+# Where a record starts, as the index of its segment and its offset in that segment
+SpillPosition = Tuple[int, int]
+
+
+@dataclass
+class _OpenSegment:
+    index: int
+    file: Any
+    map: mmap.mmap
+
+    def write_offset(self) -> int:
+        offset, _ = _SEGMENT_HEADER.unpack_from(self.map, 0)
+        return int(offset)
+
+    def is_sealed(self) -> bool:
+        _, sealed = _SEGMENT_HEADER.unpack_from(self.map, 0)
+        return bool(sealed)
+
+    def close(self) -> None:
+        self.map.close()
+        self.file.close()
+
+
+class SpillQueue:
+    """
+    An append only log of messages on disk, split into memory mapped segment files.
+
+    Any number of processes and threads can append to the queue, coordinated with a file lock. A single reader,
+    the actor process, reads messages in the order they were appended and acknowledges them once
+    they've been processed. Segments are deleted once everything in them has been acknowledged, and
+    anything that was appended but not acknowledged is read again after a restart.
+
+    A record becomes visible to the reader when the segment's write offset is moved past it, which
+    happens after the record has been copied in, so readers never see partially written records.
+    """
+
+    def __init__(self, directory: str, segment_size_bytes: int = _DEFAULT_SEGMENT_SIZE_BYTES) -> None:
+        self.directory = directory
+        self.segment_size_bytes = segment_size_bytes
+        self._logger = logging.getLogger(f"{type(self).__name__}_{id(self)}")
+        os.makedirs(directory, exist_ok=True)
+
+        # Both of these are opened lazily so that the writer and reader state is created in the process
+        # that uses it rather than being inherited across a fork.
+        self._writer: Optional[_OpenSegment] = None
+        self._reader: Optional[_OpenSegment] = None
+        self._read_offset = 0
+        self._lock_fd: Optional[int] = None
+        # The file lock doesn't keep threads that share its file descriptor out
+        self._thread_lock = threading.Lock()
+
+    def _segment_path(self, index: int) -> str:
+        return os.path.join(self.directory, f"{_SEGMENT_PREFIX}{index:012d}{_SEGMENT_SUFFIX}")
+
+    def _segment_indexes(self) -> List[int]:
+        indexes = [
+            int(name[len(_SEGMENT_PREFIX) : -len(_SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX)
+        ]
+        return sorted(indexes)
+
+    def _open_segment(self, index: int, size: Optional[int] = None) -> _OpenSegment:
+        path = self._segment_path(index)
+        if size is not None and not os.path.exists(path):
+            # Create it under a temporary name so the reader never sees a segment without a header
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.truncate(size)
+                f.write(_SEGMENT_HEADER.pack(_SEGMENT_HEADER.size, 0))
+            os.replace(tmp_path, path)
+
+        file = open(path, "r+b")
+        return _OpenSegment(index=index, file=file, map=mmap.mmap(file.fileno(), 0))
+
+    def _lock(self) -> int:
+        if self._lock_fd is None:
+            self._lock_fd = os.open(os.path.join(self.directory, _LOCK_FILE), os.O_RDWR | os.O_CREAT)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        return self._lock_fd
+
+    def append(self, message: Any) -> None:
+        payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        record_size = _RECORD_HEADER.size + len(payload)
+
+        with self._thread_lock:
+            self._append(payload, record_size)
+
+    def _append(self, payload: bytes, record_size: int) -> None:
+        lock_fd = self._lock()
+        try:
+            segment = self._current_write_segment()
+            offset = segment.write_offset()
+            if offset + record_size > len(segment.map):
+                # Seal this one and start a new segment that's big enough for the record.
+                _SEGMENT_HEADER.pack_into(segment.map, 0, offset, 1)
+                segment.close()
+                size = max(self.segment_size_bytes, _SEGMENT_HEADER.size + record_size)
+                segment = self._open_segment(segment.index + 1, size)
+                self._writer = segment
+                offset = segment.write_offset()
+
+            _RECORD_HEADER.pack_into(segment.map, offset, len(payload))
+            segment.map[offset + _RECORD_HEADER.size : offset + record_size] = payload
+            _SEGMENT_HEADER.pack_into(segment.map, 0, offset + record_size, 0)
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+    def _current_write_segment(self) -> _OpenSegment:
+        # Another process may have moved on to a newer segment. The newest segment is never sealed
+        # while the lock is held since sealing and creating the next segment happen together.
+        if self._writer is None or self._writer.is_sealed():
+            if self._writer is not None:
+                self._writer.close()
+            indexes = self._segment_indexes()
+            index = indexes[-1] if indexes else 0
+            self._writer = self._open_segment(index, self.segment_size_bytes)
+
+        return self._writer
+
+    def _read_ack(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.directory, _ACK_FILE), "r") as f:
+                index, offset = f.read().split()
+                return int(index), int(offset)
+        except FileNotFoundError:
+            indexes = self._segment_indexes()
+            return (indexes[0] if indexes else 0), _SEGMENT_HEADER.size
+
+    def _current_read_segment(self) -> Optional[_OpenSegment]:
+        if self._reader is None:
+            index, offset = self._read_ack()
+            if not os.path.exists(self._segment_path(index)):
+                return None
+            self._reader = self._open_segment(index)
+            self._read_offset = offset
+            if offset > _SEGMENT_HEADER.size:
+                self._logger.info(f"Resuming spilled messages from segment {index} at offset {offset}")
+
+        # Move past sealed segments that have been read completely.
+        while self._reader.is_sealed() and self._read_offset >= self._reader.write_offset():
+            next_index = self._reader.index + 1
+            if not os.path.exists(self._segment_path(next_index)):
+                break
+            self._reader.close()
+            self._reader = self._open_segment(next_index)
+            self._read_offset = _SEGMENT_HEADER.size
+
+        return self._reader
+
+    def read_many(self, max_messages: int) -> List[Any]:
+        """
+        Read up to max_messages that haven't been read yet, in the order they were appended. They're
+        read again after a restart unless ack() is called after they've been processed.
+        """
+        return [message for message, _ in self.read_many_with_positions(max_messages)]
+
+    def read_many_with_positions(self, max_messages: int) -> List[Tuple[Any, SpillPosition]]:
+        """
+        Like read_many, along with where each message starts, for readers that don't process messages in
+        the order they were read and can only acknowledge up to the first one that hasn't been processed.
+        """
+        messages: List[Tuple[Any, SpillPosition]] = []
+        segment = self._current_read_segment()
+        while segment is not None and len(messages) < max_messages:
+            write_offset = segment.write_offset()
+            while self._read_offset < write_offset and len(messages) < max_messages:
+                (length,) = _RECORD_HEADER.unpack_from(segment.map, self._read_offset)
+                start = self._read_offset + _RECORD_HEADER.size
+                message = pickle.loads(segment.map[start : start + length])
+                messages.append((message, (segment.index, self._read_offset)))
+                self._read_offset = start + length
+
+            if self._read_offset < write_offset or not segment.is_sealed():
+                break
+
+            next_segment = self._current_read_segment()
+            if next_segment is segment:
+                break
+            segment = next_segment
+
+        return messages
+
+    def is_empty(self) -> bool:
+        """
+        Whether or not the reader has read everything that has been appended so far.
+        """
+        segment = self._current_read_segment()
+        return segment is None or (self._read_offset >= segment.write_offset() and self._is_last(segment))
+
+    def _is_last(self, segment: _OpenSegment) -> bool:
+        return not segment.is_sealed() or not os.path.exists(self._segment_path(segment.index + 1))
+
+    def ack(self, position: Optional[SpillPosition] = None) -> None:
+        """
+        Acknowledge everything that was read before position, or everything that has been read so far if
+        it's None. It won't be read again after a restart.
+        """
+        if self._reader is None:
+            return
+
+        index, offset = position if position is not None else (self._reader.index, self._read_offset)
+        ack_path = os.path.join(self.directory, _ACK_FILE)
+        tmp_path = f"{ack_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(f"{index} {offset}")
+        os.replace(tmp_path, ack_path)
+
+        for segment_index in self._segment_indexes():
+            if segment_index >= index:
+                break
+            os.remove(self._segment_path(segment_index))
+
+    def close(self) -> None:
+        for segment in [self._writer, self._reader]:
+            if segment is not None:
+                segment.map.flush()
+                segment.close()
+        self._writer = None
+        self._reader = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
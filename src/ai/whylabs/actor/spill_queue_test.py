@@ -0,0 +1,92 @@
+import os
+from typing import List
+
+from .spill_queue import SpillQueue
+
+
+def test_read_in_order(tmp_path: str) -> None:
+    queue = SpillQueue(str(tmp_path))
+    for i in range(10):
+        queue.append(i)
+
+    assert queue.read_many(4) == [0, 1, 2, 3]
+    assert queue.read_many(100) == [4, 5, 6, 7, 8, 9]
+    assert queue.read_many(100) == []
+    assert queue.is_empty()
+
+
+def test_empty_without_segments(tmp_path: str) -> None:
+    queue = SpillQueue(str(tmp_path))
+
+    assert queue.is_empty()
+    assert queue.read_many(10) == []
+
+
+def test_rolls_segments(tmp_path: str) -> None:
+    queue = SpillQueue(str(tmp_path), segment_size_bytes=256)
+    messages = [b"x" * 50 for _ in range(20)]
+    for message in messages:
+        queue.append(message)
+
+    read: List[bytes] = []
+    while not queue.is_empty():
+        read += queue.read_many(3)
+        queue.ack()
+
+    assert read == messages
+    # Only the segment currently being read from is kept around
+    assert len([it for it in os.listdir(tmp_path) if it.endswith(".log")]) == 1
+
+
+def test_record_larger_than_segment(tmp_path: str) -> None:
+    queue = SpillQueue(str(tmp_path), segment_size_bytes=128)
+    queue.append(b"a")
+    queue.append(b"b" * 1000)
+
+    assert queue.read_many(10) == [b"a", b"b" * 1000]
+
+
+def test_replay_unacked_after_restart(tmp_path: str) -> None:
+    queue = SpillQueue(str(tmp_path), segment_size_bytes=256)
+    for i in range(20):
+        queue.append(i)
+
+    assert queue.read_many(5) == [0, 1, 2, 3, 4]
+    queue.ack()
+    assert queue.read_many(5) == [5, 6, 7, 8, 9]
+    queue.close()
+
+    restarted = SpillQueue(str(tmp_path), segment_size_bytes=256)
+    restarted.append(20)
+
+    assert restarted.read_many(100) == list(range(5, 21))
+
+
+def test_ack_up_to_position(tmp_path: str) -> None:
+    queue = SpillQueue(str(tmp_path), segment_size_bytes=256)
+    messages = [b"%d" % i + b"x" * 50 for i in range(10)]
+    for message in messages:
+        queue.append(message)
+
+    read = queue.read_many_with_positions(10)
+    assert [message for message, _ in read] == messages
+    # Everything before the sixth message was processed, it and the ones after it weren't
+    queue.ack(read[5][1])
+    queue.close()
+
+    assert SpillQueue(str(tmp_path)).read_many(100) == messages[5:]
+
+
+def test_separate_writer_and_reader(tmp_path: str) -> None:
+    writer = SpillQueue(str(tmp_path), segment_size_bytes=256)
+    reader = SpillQueue(str(tmp_path), segment_size_bytes=256)
+
+    read: List[int] = []
+    for i in range(50):
+        writer.append(i)
+        if i % 7 == 0:
+            read += reader.read_many(100)
+            reader.ack()
+    read += reader.read_many(100)
+
+    assert read == list(range(50))
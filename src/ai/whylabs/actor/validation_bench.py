@@ -0,0 +1,75 @@
+"""
+Compare the cost of getting a /log request onto the queue with and without validating it in the http process,
+and with the pydantic model that /log_docs documents.
+
+Run with `python -m ai.whylabs.actor.validation_bench` from the src directory.
+"""
+import random
+import time
+from typing import Callable, List
+
+import orjson
+from faster_fifo import Queue
+
+from ..container.requests import LogRequest
+from .profile_actor_messages import RawLogMessage, peek_dataset_id
+
+_REQUESTS = 20
+_COLUMNS = 20
+
+
+def _make_requests(rows: int) -> List[bytes]:
+    columns = [f"col_{i}" for i in range(_COLUMNS)]
+    return [
+        orjson.dumps(
+            {
+                "datasetId": "model-1",
+                "timestamp": 0,
+                "data": {"columns": columns, "data": [[random.random() for _ in columns] for _ in range(rows)]},
+            }
+        )
+        for _ in range(_REQUESTS)
+    ]
+
+
+def _enqueue(queue: Queue, request: bytes) -> None:
+    # What /log does without validation, minus the http handling
+    message = RawLogMessage(request=request, request_time=0, dataset_id=peek_dataset_id(request))
+    queue.put(message)
+    queue.get()
+
+
+def _validate_and_enqueue(queue: Queue, request: bytes) -> None:
+    RawLogMessage(request=request, request_time=0).to_log_request_dict()
+    _enqueue(queue, request)
+
+
+def _pydantic_and_enqueue(queue: Queue, request: bytes) -> None:
+    LogRequest.parse_raw(request)
+    _enqueue(queue, request)
+
+
+def _time(
+    name: str, queue: Queue, requests: List[bytes], fn: Callable[[Queue, bytes], None], iterations: int = 3
+) -> float:
+    times: List[float] = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        for request in requests:
+            fn(queue, request)
+        times.append(time.perf_counter() - start)
+
+    per_request = min(times) / len(requests)
+    print(f"  {name:<12} {per_request * 1e6:>10.1f}us per request")
+    return per_request
+
+
+if __name__ == "__main__":
+    queue = Queue(1000 * 1000 * 1000)
+    for rows in [10, 1000, 10_000]:
+        requests = _make_requests(rows)
+        print(f"{rows} rows x {_COLUMNS} columns, {len(requests[0]) // 1024}KB per request")
+        enqueue = _time("enqueue", queue, requests, _enqueue)
+        validate = _time("validate", queue, requests, _validate_and_enqueue)
+        pydantic = _time("pydantic", queue, requests, _pydantic_and_enqueue)
+        print(f"  validation costs {validate / enqueue:.1f}x enqueue, pydantic {pydantic / enqueue:.1f}x")
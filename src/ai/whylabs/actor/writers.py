@@ -0,0 +1,242 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional, Set, Tuple
+
+from whylogs.api.writer import Writer
+from whylogs.api.writer.writer import Writable
+
+from ...util.metrics import MetricsRegistry
+
+UPLOADS_METRIC = "uploads_total"
+UPLOAD_SECONDS_METRIC = "upload_seconds"
+UPLOAD_WAIT_SECONDS_METRIC = "upload_wait_seconds"
+UPLOAD_RETRIES_METRIC = "upload_retries_total"
+UPLOAD_FAILURES_METRIC = "upload_failures_total"
+UPLOADS_PENDING_METRIC = "uploads_pending"
+
+
+class MeteredWriter(Writer):
+    """
+    Wraps another writer to count its uploads and how long they take. Every attempt is counted, including
+    ones that are retried.
+    """
+
+    def __init__(self, writer: Writer, metrics: MetricsRegistry, dataset_id: str) -> None:
+        self._writer = writer
+        self._metrics = metrics
+        self._dataset_id = dataset_id
+        metrics.counter(UPLOADS_METRIC, "Profile uploads by dataset and result")
+        metrics.histogram(UPLOAD_SECONDS_METRIC, "Time to upload a profile")
+
+    def check_interval(self, interval_seconds: int) -> None:
+        self._writer.check_interval(interval_seconds)
+
+    def write(self, file: Writable, dest: Optional[str] = None, **kwargs: Any) -> Tuple[bool, str]:
+        start = time.perf_counter()
+        success = False
+        try:
+            # Not every writer accepts dest, so only pass it along if it was given
+            success, message = (
+                self._writer.write(file, dest, **kwargs) if dest is not None else self._writer.write(file, **kwargs)
+            )
+            return success, message
+        finally:
+            result = "success" if success else "failure"
+            self._metrics.inc(UPLOADS_METRIC, labels={"dataset_id": self._dataset_id, "result": result})
+            self._metrics.observe(
+                UPLOAD_SECONDS_METRIC, time.perf_counter() - start, labels={"dataset_id": self._dataset_id}
+            )
+
+    def option(self, **kwargs: Any) -> "MeteredWriter":
+        self._writer = self._writer.option(**kwargs)
+        return self
+
+
+@dataclass(eq=False)
+class _Upload:
+    writer: Writer
+    writable: Writable
+    dataset_id: str
+    on_done: Optional[Callable[[bool], None]]
+    submit_time: float
+    holds_slot: bool
+    saved_path: Optional[str]
+
+
+class UploadPool:
+    """
+    Uploads profiles from a pool of threads. whylogs writes profiles from each logger's own thread and
+    the profiling loop waits on those threads when it logs, so a slow upload for one dataset would
+    otherwise hold up profiling.
+
+    Failed uploads are retried with exponential backoff. Once max_pending uploads are waiting, submit()
+    blocks the logger that's writing until one of them finishes, unless the pool is shutting down.
+    """
+
+    def __init__(
+        self,
+        metrics: MetricsRegistry,
+        max_workers: int = 4,
+        max_pending: int = 100,
+        max_attempts: int = 5,
+        initial_backoff_seconds: float = 1.0,
+        max_backoff_seconds: float = 30.0,
+    ) -> None:
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.initial_backoff_seconds = initial_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._metrics = metrics
+        self._logger = logging.getLogger(f"{type(self).__name__}_{id(self)}")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._uploads: Set[_Upload] = set()
+        self._changed = threading.Condition()
+        self._shutting_down = False
+        self._abandoned = threading.Event()
+        # Created on first use so that the threads are started in the process that does the uploading
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        metrics.gauge(UPLOADS_PENDING_METRIC, "Profiles waiting for or in the middle of an upload")
+        metrics.histogram(UPLOAD_WAIT_SECONDS_METRIC, "Time profiles wait for an upload thread")
+        metrics.counter(UPLOAD_RETRIES_METRIC, "Failed upload attempts that were retried by dataset")
+        metrics.counter(UPLOAD_FAILURES_METRIC, "Profiles that couldn't be uploaded by dataset")
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="upload")
+        return self._executor
+
+    def _track(self, upload: _Upload) -> None:
+        with self._changed:
+            self._uploads.add(upload)
+            self._metrics.set(UPLOADS_PENDING_METRIC, len(self._uploads))
+
+    def _finish(self, upload: _Upload, success: bool) -> None:
+        with self._changed:
+            if upload not in self._uploads:
+                return  # Abandoned
+            self._uploads.remove(upload)
+            self._metrics.set(UPLOADS_PENDING_METRIC, len(self._uploads))
+            self._changed.notify_all()
+
+        if upload.holds_slot:
+            self._slots.release()
+        if upload.on_done is not None:
+            upload.on_done(success)
+
+    def submit(
+        self,
+        writer: Writer,
+        writable: Writable,
+        dataset_id: str,
+        on_done: Optional[Callable[[bool], None]] = None,
+        saved_path: Optional[str] = None,
+        block: bool = True,
+    ) -> bool:
+        """
+        Upload a profile in the background. on_done is called with whether or not it was uploaded once
+        it's done retrying. It isn't called for uploads that are abandoned by close(). saved_path is where
+        the profile is already saved on disk, if it is, and it's returned along with the upload if it's
+        abandoned. With block off this returns False instead of waiting when max_pending uploads are waiting.
+        """
+        # Nothing should wait on the limit once shutdown has started since that would eat into its deadline
+        holds_slot = not self._shutting_down
+        if holds_slot and not self._slots.acquire(blocking=block):
+            return False
+
+        upload = _Upload(writer, writable, dataset_id, on_done, time.perf_counter(), holds_slot, saved_path)
+        self._track(upload)
+        try:
+            self._get_executor().submit(self._upload, upload)
+        except Exception:
+            self._finish(upload, False)
+            raise
+        return True
+
+    def _upload(self, upload: _Upload) -> None:
+        if self._abandoned.is_set():
+            return
+
+        labels = {"dataset_id": upload.dataset_id}
+        self._metrics.observe(UPLOAD_WAIT_SECONDS_METRIC, time.perf_counter() - upload.submit_time)
+        backoff = self.initial_backoff_seconds
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                success, message = upload.writer.write(upload.writable)
+            except Exception as e:
+                success, message = False, str(e)
+
+            if success:
+                self._finish(upload, True)
+                return
+
+            if attempt == self.max_attempts:
+                self._logger.error(f"Giving up on uploading a profile for {upload.dataset_id} after {attempt} attempts")
+                self._metrics.inc(UPLOAD_FAILURES_METRIC, labels=labels)
+                self._finish(upload, False)
+                return
+
+            self._logger.warning(f"Upload attempt {attempt} for {upload.dataset_id} failed, retrying: {message}")
+            self._metrics.inc(UPLOAD_RETRIES_METRIC, labels=labels)
+            # Jitter keeps uploads that failed together from all retrying at the same time
+            if self._abandoned.wait(backoff * random.uniform(0.5, 1.0)):
+                return
+            backoff = min(backoff * 2, self.max_backoff_seconds)
+
+    def begin_shutdown(self) -> None:
+        """
+        Stop making submit() wait for room so that everything can be handed to the pool right away.
+        """
+        self._shutting_down = True
+
+    def close(self, timeout_seconds: Optional[float] = None) -> List[Tuple[str, Writable, Optional[str]]]:
+        """
+        Wait up to timeout_seconds, or forever if it's None, for every submitted upload to finish. Anything
+        that hasn't been uploaded by then is abandoned and returned as (dataset id, profile, saved path) so it
+        can be saved, unless it already was. Abandoned uploads that are in the middle of a request may still go through, so saving them
+        can end up uploading a profile twice.
+        """
+        self.begin_shutdown()
+        if self._executor is None:
+            return []
+
+        with self._changed:
+            self._changed.wait_for(lambda: not self._uploads, timeout_seconds)
+            abandoned = list(self._uploads)
+            self._uploads.clear()
+            self._metrics.set(UPLOADS_PENDING_METRIC, 0)
+
+        if abandoned:
+            self._abandoned.set()
+            self._logger.warning(f"Abandoning {len(abandoned)} uploads that didn't finish in {timeout_seconds}s")
+        # Threads that are still uploading are left to finish on their own since there's no way to interrupt them
+        self._executor.shutdown(wait=not abandoned)
+        self._executor = None
+        return [(it.dataset_id, it.writable, it.saved_path) for it in abandoned]
+
+
+class PooledWriter(Writer):
+    """
+    Hands profiles to an UploadPool instead of writing them. Writes always succeed from whylogs' point
+    of view since the pool takes care of retrying them.
+    """
+
+    def __init__(self, writer: Writer, pool: UploadPool, dataset_id: str) -> None:
+        self._writer = writer
+        self._pool = pool
+        self._dataset_id = dataset_id
+
+    def check_interval(self, interval_seconds: int) -> None:
+        self._writer.check_interval(interval_seconds)
+
+    def write(self, file: Writable, dest: Optional[str] = None, **kwargs: Any) -> Tuple[bool, str]:
+        self._pool.submit(self._writer, file, self._dataset_id)
+        return True, "Queued for upload"
+
+    def option(self, **kwargs: Any) -> "PooledWriter":
+        self._writer = self._writer.option(**kwargs)
+        return self
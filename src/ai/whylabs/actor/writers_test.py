@@ -0,0 +1,170 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import pytest
+import whylogs as why
+from whylogs.api.writer import Writer, Writers
+from whylogs.api.writer.writer import Writable
+
+from ...util.metrics import MetricsRegistry, deserialize
+from .writers import MeteredWriter, PooledWriter, UploadPool
+
+
+class _FlakyWriter(Writer):
+    def __init__(self, failures: int, delay_seconds: float = 0) -> None:
+        self.failures = failures
+        self.delay_seconds = delay_seconds
+        self.attempts = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def write(self, file: Writable, dest: Optional[str] = None, **kwargs: Any) -> Tuple[bool, str]:
+        with self._lock:
+            self.attempts += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            fail = self.attempts <= self.failures
+        time.sleep(self.delay_seconds)
+        with self._lock:
+            self.active -= 1
+        return (False, "failed") if fail else (True, "ok")
+
+    def option(self, **kwargs: Any) -> "_FlakyWriter":
+        return self
+
+
+def _pool(metrics: MetricsRegistry, **kwargs: Any) -> UploadPool:
+    return UploadPool(metrics, initial_backoff_seconds=0.001, max_backoff_seconds=0.001, **kwargs)
+
+
+def _sample(metrics: MetricsRegistry, name: str) -> Any:
+    families = {it.name: it for it in deserialize(metrics.serialize())}
+    return families[name].samples
+
+
+def test_retries_until_success() -> None:
+    metrics = MetricsRegistry()
+    pool = _pool(metrics, max_attempts=3)
+    writer = _FlakyWriter(failures=2)
+
+    assert PooledWriter(writer, pool, "model-1").write(object()) == (True, "Queued for upload")
+    pool.close()
+
+    assert writer.attempts == 3
+    assert _sample(metrics, "upload_retries_total") == {(("dataset_id", "model-1"),): 2}
+    assert _sample(metrics, "upload_failures_total") == {}
+    assert _sample(metrics, "uploads_pending") == {(): 0}
+
+
+def test_gives_up_after_max_attempts() -> None:
+    metrics = MetricsRegistry()
+    pool = _pool(metrics, max_attempts=2)
+    writer = _FlakyWriter(failures=10)
+
+    pool.submit(writer, object(), "model-1")
+    pool.close()
+
+    assert writer.attempts == 2
+    assert _sample(metrics, "upload_failures_total") == {(("dataset_id", "model-1"),): 1}
+
+
+def test_concurrency_limit() -> None:
+    pool = _pool(MetricsRegistry(), max_workers=2)
+    writer = _FlakyWriter(failures=0, delay_seconds=0.02)
+
+    for _ in range(6):
+        pool.submit(writer, object(), "model-1")
+    pool.close()
+
+    assert writer.attempts == 6
+    assert writer.max_active == 2
+
+
+class _WhyLabsStandIn(BaseHTTPRequestHandler):
+    """
+    Just enough of the WhyLabs api to upload a profile: a log request that returns an upload url and
+    the upload itself.
+    """
+
+    uploads: List[bytes] = []
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("content-length", 0)))
+        port = self.server.server_address[1]
+        self._respond(json.dumps({"id": "1", "uploadUrl": f"http://127.0.0.1:{port}/upload"}).encode())
+
+    def do_PUT(self) -> None:
+        _WhyLabsStandIn.uploads.append(self.rfile.read(int(self.headers.get("content-length", 0))))
+        self._respond(b"")
+
+    def _respond(self, body: bytes) -> None:
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def whylabs_endpoint(monkeypatch: pytest.MonkeyPatch) -> Iterator[str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _WhyLabsStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setenv("WHYLABS_API_ENDPOINT", endpoint)
+    _WhyLabsStandIn.uploads = []
+    yield endpoint
+    server.shutdown()
+
+
+def test_uploads_to_whylabs(whylabs_endpoint: str) -> None:
+    metrics = MetricsRegistry()
+    pool = UploadPool(metrics)
+    whylabs_writer = Writers.get("whylabs", org_id="org-0", api_key="0123456789.abcdefghijklmnop", dataset_id="m-1")
+    writer = PooledWriter(MeteredWriter(whylabs_writer, metrics, "m-1"), pool, "m-1")
+
+    view = why.log(pd.DataFrame({"a": [1, 2, 3]})).view()
+    for _ in range(3):
+        writer.write(view)
+    pool.close()
+
+    assert len(_WhyLabsStandIn.uploads) == 3
+    assert _sample(metrics, "uploads_total") == {(("dataset_id", "m-1"), ("result", "success")): 3}
+
+
+def test_close_abandons_slow_uploads() -> None:
+    pool = _pool(MetricsRegistry(), max_workers=1)
+    writer = _FlakyWriter(failures=0, delay_seconds=0.5)
+    done: List[bool] = []
+
+    pool.submit(writer, "first", "model-1", on_done=done.append)
+    pool.submit(writer, "second", "model-2", on_done=done.append)
+    abandoned = pool.close(timeout_seconds=0.1)
+
+    assert sorted(abandoned) == [("model-1", "first", None), ("model-2", "second", None)]
+    time.sleep(0.6)
+    # The first one finishes after it was abandoned, but on_done isn't called and the second never starts
+    assert writer.attempts == 1
+    assert done == []
+
+
+def test_submit_without_blocking() -> None:
+    pool = _pool(MetricsRegistry(), max_workers=1, max_pending=1)
+    writer = _FlakyWriter(failures=0, delay_seconds=0.5)
+
+    assert pool.submit(writer, "first", "model-1", block=False)
+    assert not pool.submit(writer, "second", "model-1", block=False)
+    assert pool.close(timeout_seconds=0.1) == [("model-1", "first", None)]
+
+
+def test_abandoned_saved_path() -> None:
+    pool = _pool(MetricsRegistry(), max_workers=1)
+    pool.submit(_FlakyWriter(failures=0, delay_seconds=0.5), "first", "model-1", saved_path="/saved/first")
+    assert pool.close(timeout_seconds=0.1) == [("model-1", "first", "/saved/first")]
@@ -0,0 +1,125 @@
+"""
+Load test the container with synthetic requests and write the results as json.
+
+Run with `python -m ai.whylabs.benchmark --help` from the src directory. Without --url the app is
+driven in process, which needs the same environment variables as the container. With --url it
+targets a running container and reads the profiling process pids from --pid-file when it's local.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import platform
+import subprocess
+import time
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional
+
+import httpx
+import orjson
+
+from .payloads import DTYPES, Payload, PayloadSpec, make_embedding_payloads, make_log_payloads
+from .runner import BenchmarkResult, read_pid_file, run_load
+
+# Cycle through this many distinct payloads rather than generating one per request
+_DISTINCT_PAYLOADS = 20
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m ai.whylabs.benchmark", description=__doc__)
+    parser.add_argument("--url", help="Base url of a running container. The app runs in process without it.")
+    parser.add_argument("--pid-file", default="/tmp/profiling_pid", help="Profiling pids of a local container")
+    parser.add_argument("--password", default=os.environ.get("CONTAINER_PASSWORD"), help="Container password")
+    parser.add_argument("--kind", choices=["log", "embeddings"], default="log")
+    parser.add_argument("--rows", type=int, default=100, help="Rows per request")
+    parser.add_argument("--columns", type=int, default=20)
+    parser.add_argument("--dtypes", default=",".join(DTYPES), help="Comma separated column types to cycle through")
+    parser.add_argument("--datasets", type=int, default=1, help="Number of dataset ids to spread requests across")
+    parser.add_argument("--orient", choices=["rows", "columns"], default="rows")
+    parser.add_argument("--embedding-dimension", type=int, default=128)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to send requests for")
+    parser.add_argument(
+        "--settle", type=float, default=6, help="Idle seconds before in process profiling counts as done"
+    )
+    parser.add_argument("--output", help="File to write the json results to, printed when not given")
+    return parser.parse_args()
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except FileNotFoundError:
+        return None
+
+
+async def _run(args: argparse.Namespace, payloads: List[Payload], headers: Dict[str, str]) -> BenchmarkResult:
+    if args.url is not None:
+        async with httpx.AsyncClient(base_url=args.url) as client:
+            return await run_load(
+                client, payloads, args.concurrency, args.duration, headers, profiler_pids=read_pid_file(args.pid_file)
+            )
+
+    # Imported here because it reads the container config and creates the actor pool
+    from ..container.routes import actor_pool, app
+
+    actor_pool.start()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        return await run_load(
+            client,
+            payloads,
+            args.concurrency,
+            args.duration,
+            headers,
+            queue_depth=actor_pool.qsize,
+            profiler_pids=actor_pool.pids(),
+            settle_seconds=args.settle,
+        )
+
+
+def _write_results(args: argparse.Namespace, spec: PayloadSpec, result: BenchmarkResult) -> None:
+    report: Dict[str, Any] = {
+        "time": int(time.time()),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "target": args.url or "in-process",
+        "kind": args.kind,
+        "concurrency": args.concurrency,
+        "payload": asdict(spec),
+        "result": asdict(result),
+    }
+    output = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+    if args.output is None:
+        print(output.decode())
+    else:
+        with open(args.output, "wb") as f:
+            f.write(output)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    args = _parse_args()
+    spec = PayloadSpec(
+        rows=args.rows,
+        columns=args.columns,
+        dtypes=args.dtypes.split(","),
+        datasets=args.datasets,
+        orient=args.orient,
+        embedding_dimension=args.embedding_dimension if args.kind == "embeddings" else 0,
+    )
+    make_payloads = make_embedding_payloads if args.kind == "embeddings" else make_log_payloads
+    payloads = make_payloads(spec, _DISTINCT_PAYLOADS)
+    headers = {"Authorization": f"Bearer {args.password}"} if args.password else {}
+
+    result = asyncio.run(_run(args, payloads, headers))
+    _write_results(args, spec, result)
+
+    if args.url is None:
+        # Flushes and uploads whatever the profiling processes have before exiting the process
+        from ..container.routes import actor_pool
+
+        asyncio.run(actor_pool.shutdown())
+
+
+if __name__ == "__main__":
+    main()
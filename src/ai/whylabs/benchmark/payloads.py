@@ -0,0 +1,100 @@
+import random
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List
+
+import orjson
+
+from ...util.time import current_time_ms
+
+_STRINGS = ["a", "b", "c", "d", "e"]
+
+# Generators for a single value of each supported column type
+_VALUE_GENERATORS: Dict[str, Callable[[random.Random], Any]] = {
+    "float": lambda r: r.random(),
+    "int": lambda r: r.randint(0, 1000),
+    "str": lambda r: r.choice(_STRINGS),
+    "bool": lambda r: r.random() > 0.5,
+}
+
+DTYPES = list(_VALUE_GENERATORS.keys())
+
+
+@dataclass
+class PayloadSpec:
+    """
+    The shape of the synthetic requests to generate. Columns cycle through dtypes, so 6 columns with
+    dtypes float,str are float,str,float,str,float,str.
+    """
+
+    rows: int = 100
+    columns: int = 20
+    dtypes: List[str] = field(default_factory=lambda: list(DTYPES))
+    datasets: int = 1
+    orient: str = "rows"
+    embedding_dimension: int = 0
+    seed: int = 0
+
+    def __post_init__(self) -> None:
+        unknown = [it for it in self.dtypes if it not in _VALUE_GENERATORS]
+        if unknown:
+            raise Exception(f"Unknown dtypes {unknown}, expected any of {DTYPES}")
+        if self.orient not in ["rows", "columns"]:
+            raise Exception(f"Unknown orient {self.orient}, expected rows or columns")
+
+
+@dataclass
+class Payload:
+    path: str
+    body: bytes
+    rows: int
+
+
+def _dataset_id(index: int) -> str:
+    return f"model-{index}"
+
+
+def make_log_payloads(spec: PayloadSpec, count: int) -> List[Payload]:
+    """
+    Generate count /log requests spread evenly across spec.datasets datasets.
+    """
+    rand = random.Random(spec.seed)
+    column_names = [f"col_{i}" for i in range(spec.columns)]
+    generators = [_VALUE_GENERATORS[spec.dtypes[i % len(spec.dtypes)]] for i in range(spec.columns)]
+    timestamp = current_time_ms()
+
+    payloads: List[Payload] = []
+    for i in range(count):
+        data: List[List[Any]]
+        if spec.orient == "columns":
+            data = [[generate(rand) for _ in range(spec.rows)] for generate in generators]
+        else:
+            data = [[generate(rand) for generate in generators] for _ in range(spec.rows)]
+
+        request = {
+            "datasetId": _dataset_id(i % spec.datasets),
+            "timestamp": timestamp,
+            "data": {"columns": column_names, "data": data, "orient": spec.orient},
+        }
+        payloads.append(Payload(path="/log", body=orjson.dumps(request), rows=spec.rows))
+
+    return payloads
+
+
+def make_embedding_payloads(spec: PayloadSpec, count: int) -> List[Payload]:
+    """
+    Generate count /log-embeddings requests, each with one embedding column of spec.rows vectors that
+    have spec.embedding_dimension values.
+    """
+    if spec.embedding_dimension <= 0:
+        raise Exception("Need a positive embedding dimension to generate embedding payloads")
+
+    rand = random.Random(spec.seed)
+    timestamp = current_time_ms()
+
+    payloads: List[Payload] = []
+    for i in range(count):
+        vectors = [[rand.random() for _ in range(spec.embedding_dimension)] for _ in range(spec.rows)]
+        request = {"datasetId": _dataset_id(i % spec.datasets), "timestamp": timestamp, "embeddings": {"emb": vectors}}
+        payloads.append(Payload(path="/log-embeddings", body=orjson.dumps(request), rows=spec.rows))
+
+    return payloads
@@ -0,0 +1,41 @@
+import orjson
+import pytest
+
+from .payloads import PayloadSpec, make_embedding_payloads, make_log_payloads
+
+
+def test_log_payloads_rows() -> None:
+    spec = PayloadSpec(rows=3, columns=5, dtypes=["int", "str"], datasets=2)
+    payloads = make_log_payloads(spec, 4)
+
+    assert [it.path for it in payloads] == ["/log"] * 4
+    requests = [orjson.loads(it.body) for it in payloads]
+    assert [it["datasetId"] for it in requests] == ["model-0", "model-1", "model-0", "model-1"]
+
+    data = requests[0]["data"]
+    assert data["columns"] == ["col_0", "col_1", "col_2", "col_3", "col_4"]
+    assert len(data["data"]) == 3
+    assert [type(it) for it in data["data"][0]] == [int, str, int, str, int]
+
+
+def test_log_payloads_columns() -> None:
+    spec = PayloadSpec(rows=3, columns=2, dtypes=["float"], orient="columns")
+    data = orjson.loads(make_log_payloads(spec, 1)[0].body)["data"]
+
+    assert data["orient"] == "columns"
+    assert [len(it) for it in data["data"]] == [3, 3]
+
+
+def test_embedding_payloads() -> None:
+    spec = PayloadSpec(rows=4, embedding_dimension=8)
+    payload = make_embedding_payloads(spec, 1)[0]
+
+    assert payload.path == "/log-embeddings"
+    assert payload.rows == 4
+    embeddings = orjson.loads(payload.body)["embeddings"]["emb"]
+    assert [len(it) for it in embeddings] == [8, 8, 8, 8]
+
+
+def test_unknown_dtype() -> None:
+    with pytest.raises(Exception):
+        PayloadSpec(dtypes=["complex"])
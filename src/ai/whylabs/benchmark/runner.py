@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+from .payloads import Payload
+
+_logger = logging.getLogger("benchmark")
+
+_QUEUE_SAMPLE_SECONDS = 0.1
+_DRAIN_TIMEOUT_SECONDS = 120
+# The profiling processes are considered idle when they use less cpu than this over a sample
+_IDLE_SAMPLE_SECONDS = 0.5
+_IDLE_CPU_SECONDS = 0.02
+
+
+@dataclass
+class BenchmarkResult:
+    requests: int
+    errors: int
+    rows: int
+    duration_seconds: float
+    requests_per_second: float
+    rows_per_second: float
+    latency_p50_ms: float
+    latency_p99_ms: float
+    # These are only available when the profiling processes can be inspected from here
+    max_queue_depth: Optional[int]
+    drain_seconds: Optional[float]
+    profiler_cpu_seconds: Optional[float]
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def read_pid_file(path: str) -> List[int]:
+    try:
+        with open(path, "r") as f:
+            return [int(it) for it in f.read().split()]
+    except FileNotFoundError:
+        return []
+
+
+def process_cpu_seconds(pids: List[int]) -> Optional[float]:
+    """
+    User and system cpu time of the processes from /proc, or None if any of them can't be read.
+    """
+    ticks_per_second = os.sysconf("SC_CLK_TCK")
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", "r") as f:
+                # The command name can contain spaces so skip past it before splitting
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (FileNotFoundError, IndexError):
+            return None
+        # utime and stime are fields 14 and 15, which are 11 and 12 after the pid and command name
+        total += int(fields[11]) + int(fields[12])
+    return total / ticks_per_second
+
+
+async def _wait_until_idle(pids: List[int], settle_seconds: float, deadline: float) -> float:
+    """
+    Wait until the processes have been idle for settle_seconds and return when they were last busy.
+    """
+    last_busy = time.perf_counter()
+    previous = process_cpu_seconds(pids)
+    while previous is not None and time.perf_counter() - last_busy < settle_seconds:
+        if time.perf_counter() > deadline:
+            break
+        await asyncio.sleep(_IDLE_SAMPLE_SECONDS)
+        current = process_cpu_seconds(pids)
+        if current is None:
+            break
+        if current - previous > _IDLE_CPU_SECONDS:
+            last_busy = time.perf_counter()
+        previous = current
+    return last_busy
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    payloads: List[Payload],
+    concurrency: int,
+    duration_seconds: float,
+    headers: Dict[str, str],
+    queue_depth: Optional[Callable[[], int]] = None,
+    profiler_pids: Optional[List[int]] = None,
+    settle_seconds: float = 6,
+) -> BenchmarkResult:
+    """
+    Send the payloads in a loop from concurrency tasks for duration_seconds. When queue_depth is available
+    this also waits for the profiling processes to drain their queues and process what they've read before
+    reporting cpu time. They can hold a partial batch without using any cpu for up to the max batch latency,
+    so settle_seconds should be longer than that.
+    """
+    if not payloads:
+        raise Exception("Need at least one payload to send")
+    profiler_pids = profiler_pids or []
+
+    latencies: List[float] = []
+    errors = 0
+    rows = 0
+    next_payload = 0
+    max_queue_depth = 0
+    cpu_start = process_cpu_seconds(profiler_pids) if profiler_pids else None
+    start = time.perf_counter()
+    deadline = start + duration_seconds
+
+    async def send() -> None:
+        nonlocal next_payload, errors, rows
+        while time.perf_counter() < deadline:
+            payload = payloads[next_payload % len(payloads)]
+            next_payload += 1
+            request_start = time.perf_counter()
+            response = await client.post(payload.path, content=payload.body, headers=headers)
+            latencies.append(time.perf_counter() - request_start)
+            if response.status_code == 200:
+                rows += payload.rows
+            else:
+                errors += 1
+
+    async def sample_queue() -> None:
+        nonlocal max_queue_depth
+        while queue_depth is not None and time.perf_counter() < deadline:
+            max_queue_depth = max(max_queue_depth, queue_depth())
+            await asyncio.sleep(_QUEUE_SAMPLE_SECONDS)
+
+    await asyncio.gather(sample_queue(), *[send() for _ in range(concurrency)])
+    duration = time.perf_counter() - start
+
+    drain_seconds: Optional[float] = None
+    if queue_depth is not None:
+        drain_start = time.perf_counter()
+        while queue_depth() > 0 and time.perf_counter() - drain_start < _DRAIN_TIMEOUT_SECONDS:
+            await asyncio.sleep(_QUEUE_SAMPLE_SECONDS)
+        # The queue is empty once the last batch has been taken off of it, wait for that batch to be profiled too.
+        last_busy = await _wait_until_idle(profiler_pids, settle_seconds, drain_start + _DRAIN_TIMEOUT_SECONDS)
+        drain_seconds = max(0.0, last_busy - drain_start)
+
+    cpu_end = process_cpu_seconds(profiler_pids) if profiler_pids else None
+    if errors:
+        _logger.warning(f"{errors} of {len(latencies)} requests failed")
+
+    return BenchmarkResult(
+        requests=len(latencies),
+        errors=errors,
+        rows=rows,
+        duration_seconds=duration,
+        requests_per_second=len(latencies) / duration,
+        rows_per_second=rows / duration,
+        latency_p50_ms=percentile(latencies, 50) * 1000,
+        latency_p99_ms=percentile(latencies, 99) * 1000,
+        max_queue_depth=max_queue_depth if queue_depth is not None else None,
+        drain_seconds=drain_seconds,
+        profiler_cpu_seconds=cpu_end - cpu_start if cpu_start is not None and cpu_end is not None else None,
+    )
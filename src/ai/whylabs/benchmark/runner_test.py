@@ -0,0 +1,43 @@
+import asyncio
+import os
+
+import httpx
+from fastapi import FastAPI, Request, Response
+
+from .payloads import Payload
+from .runner import percentile, process_cpu_seconds, run_load
+
+
+def test_percentile() -> None:
+    values = [float(it) for it in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 99) == 0
+
+
+def test_process_cpu_seconds() -> None:
+    assert (process_cpu_seconds([os.getpid()]) or -1) >= 0
+    assert process_cpu_seconds([2**22 + 1]) is None
+
+
+def test_run_load() -> None:
+    app = FastAPI()
+    bodies = []
+
+    @app.post("/log")
+    async def log(request: Request) -> Response:
+        body = await request.body()
+        bodies.append(body)
+        return Response(status_code=200 if body == b"ok" else 500)
+
+    async def run() -> None:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+            payloads = [Payload(path="/log", body=b"ok", rows=10), Payload(path="/log", body=b"bad", rows=10)]
+            result = await run_load(client, payloads, concurrency=2, duration_seconds=0.2, headers={})
+
+            assert result.requests == len(bodies)
+            assert result.errors == bodies.count(b"bad")
+            assert result.rows == bodies.count(b"ok") * 10
+            assert result.max_queue_depth is None
+
+    asyncio.run(run())
@@ -0,0 +1,6 @@
+import os
+
+# The container config is read when its module is imported, so these have to be set before any test imports it
+os.environ.setdefault("WHYLABS_API_KEY", "0123456789.abcdefghijklmnop")
+os.environ.setdefault("WHYLABS_ORG_ID", "org-0")
+os.environ.setdefault("DISABLE_CONTAINER_PASSWORD", "True")
@@ -1,9 +1,12 @@
-from typing import Optional, Dict
+from typing import Optional, Dict, Set
 import os
 from whylogs.core.schema import DatasetSchema
 import logging
 from enum import Enum
 from whylabs_toolkit.container.config_types import DatasetCadence, DatasetOptions, DatasetUploadCadenceGranularity
+from ..actor.overflow import OverflowPolicy
+from ..actor.batch_policy import BatchLimits
+from ...util.compression_util import MAX_DECOMPRESSED_BYTES
 
 
 _logger = logging.getLogger("config")
@@ -12,6 +15,7 @@ _logger = logging.getLogger("config")
 class EnvVarNames(Enum):
     WHYLABS_API_KEY = "WHYLABS_API_KEY"
     WHYLABS_ORG_ID = "WHYLABS_ORG_ID"
+    WHYLABS_API_ENDPOINT = "WHYLABS_API_ENDPOINT"
     DEFAULT_WHYLABS_DATASET_CADENCE = "DEFAULT_WHYLABS_DATASET_CADENCE"
     DEFAULT_WHYLABS_UPLOAD_CADENCE = "DEFAULT_WHYLABS_UPLOAD_CADENCE"
     DEFAULT_WHYLABS_UPLOAD_INTERVAL = "DEFAULT_WHYLABS_UPLOAD_INTERVAL"
@@ -21,10 +25,62 @@ class EnvVarNames(Enum):
 
     FAIL_STARTUP_WITHOUT_CONFIG = "FAIL_STARTUP_WITHOUT_CONFIG"
 
+    PROFILING_PROCESSES = "PROFILING_PROCESSES"
+    HTTP_WORKERS = "HTTP_WORKERS"
+
+    MAX_BATCH_MESSAGES = "MAX_BATCH_MESSAGES"
+    MAX_BATCH_BYTES = "MAX_BATCH_BYTES"
+    MAX_BATCH_LATENCY_SECONDS = "MAX_BATCH_LATENCY_SECONDS"
+    BATCH_IDLE_SECONDS = "BATCH_IDLE_SECONDS"
+    ADAPTIVE_BATCHING = "ADAPTIVE_BATCHING"
+
+    QUEUE_OVERFLOW_POLICY = "QUEUE_OVERFLOW_POLICY"
+    QUEUE_OVERFLOW_DEADLINE_SECONDS = "QUEUE_OVERFLOW_DEADLINE_SECONDS"
+
+    SPILL_DIRECTORY = "SPILL_DIRECTORY"
+    SPILL_SEGMENT_SIZE_BYTES = "SPILL_SEGMENT_SIZE_BYTES"
+    DURABLE_QUEUE = "DURABLE_QUEUE"
+
+    UPLOAD_WORKERS = "UPLOAD_WORKERS"
+    UPLOAD_MAX_PENDING = "UPLOAD_MAX_PENDING"
+    UPLOAD_MAX_ATTEMPTS = "UPLOAD_MAX_ATTEMPTS"
+
+    SHUTDOWN_DEADLINE_SECONDS = "SHUTDOWN_DEADLINE_SECONDS"
+    PENDING_UPLOAD_DIRECTORY = "PENDING_UPLOAD_DIRECTORY"
+
+    CHECKPOINT_DIRECTORY = "CHECKPOINT_DIRECTORY"
+    CHECKPOINT_INTERVAL_SECONDS = "CHECKPOINT_INTERVAL_SECONDS"
+
+    MAX_LOGGERS = "MAX_LOGGERS"
+    LOGGER_IDLE_SECONDS = "LOGGER_IDLE_SECONDS"
+    METRICS_MAX_DATASETS = "METRICS_MAX_DATASETS"
+    DATASET_ALLOW_LIST = "DATASET_ALLOW_LIST"
+    VALIDATE_LOG_REQUESTS = "VALIDATE_LOG_REQUESTS"
+
+    SHARED_MEMORY_BYTES = "SHARED_MEMORY_BYTES"
+    SHARED_MEMORY_MIN_REQUEST_BYTES = "SHARED_MEMORY_MIN_REQUEST_BYTES"
+
+    QUARANTINE_DIRECTORY = "QUARANTINE_DIRECTORY"
+    QUARANTINE_MAX_FILES = "QUARANTINE_MAX_FILES"
+    QUARANTINE_MAX_BYTES = "QUARANTINE_MAX_BYTES"
+
+    STREAM_MIN_REQUEST_BYTES = "STREAM_MIN_REQUEST_BYTES"
+    STREAM_CHUNK_BYTES = "STREAM_CHUNK_BYTES"
+    STREAM_MAX_REQUEST_BYTES = "STREAM_MAX_REQUEST_BYTES"
+    STREAM_MAX_FORCED_BYTES = "STREAM_MAX_FORCED_BYTES"
+
+    DATASET_RATE_LIMIT_BYTES = "DATASET_RATE_LIMIT_BYTES"
+    DATASET_RATE_LIMITS = "DATASET_RATE_LIMITS"
+    RATE_LIMIT_BURST_SECONDS = "RATE_LIMIT_BURST_SECONDS"
+    FAIR_QUEUE_MAX_MESSAGES = "FAIR_QUEUE_MAX_MESSAGES"
+    FAIR_QUEUE_MAX_BYTES = "FAIR_QUEUE_MAX_BYTES"
+    DATASET_WEIGHTS = "DATASET_WEIGHTS"
+
 
 class ContainerConfig:
     whylabs_api_key: str
     whylabs_org_id: str
+    whylabs_api_endpoint: str
 
     disable_container_password: bool
     container_password: Optional[str]
@@ -35,9 +91,62 @@ class ContainerConfig:
 
     fail_startup_without_config: bool
 
+    profiling_processes: int
+    http_workers: int
+
+    max_batch_messages: int
+    max_batch_bytes: int
+    max_batch_latency_seconds: float
+    batch_idle_seconds: float
+    adaptive_batching: bool
+
+    queue_overflow_policy: OverflowPolicy
+    queue_overflow_deadline_seconds: float
+
+    spill_directory: Optional[str]
+    spill_segment_size_bytes: int
+    durable_queue: bool
+
+    upload_workers: int
+    upload_max_pending: int
+    upload_max_attempts: int
+
+    shutdown_deadline_seconds: Optional[float]
+    pending_upload_directory: Optional[str]
+
+    checkpoint_directory: Optional[str]
+    checkpoint_interval_seconds: float
+
+    max_loggers: int
+    logger_idle_seconds: Optional[float]
+    metrics_max_datasets: int
+    dataset_allow_list: Optional[Set[str]]
+    validate_log_requests: bool
+
+    shared_memory_bytes: int
+    shared_memory_min_request_bytes: int
+
+    quarantine_directory: Optional[str]
+    quarantine_max_files: int
+    quarantine_max_bytes: int
+
+    stream_min_request_bytes: int
+    stream_chunk_bytes: int
+    stream_max_request_bytes: int
+    stream_max_forced_bytes: int
+
+    dataset_rate_limit_bytes: int
+    dataset_rate_limits: Dict[str, int]
+    rate_limit_burst_seconds: float
+    fair_queue_max_messages: int
+    fair_queue_max_bytes: int
+    dataset_weights: Dict[str, int]
+
     def __init__(self) -> None:
         self.whylabs_api_key = self._require_env(EnvVarNames.WHYLABS_API_KEY)
         self.whylabs_org_id = self._require_env(EnvVarNames.WHYLABS_ORG_ID)
+        # Same variable and default as whylogs' own writer
+        self.whylabs_api_endpoint = self._read_env(EnvVarNames.WHYLABS_API_ENDPOINT) or "https://api.whylabsapp.com"
 
         self.disable_container_password = self._read_env_bool(EnvVarNames.DISABLE_CONTAINER_PASSWORD) or False
 
@@ -65,6 +174,130 @@ class ContainerConfig:
             default_whylabs_upload_interval and int(default_whylabs_upload_interval) or 1
         )
 
+        profiling_processes = self._read_env(EnvVarNames.PROFILING_PROCESSES)
+        self.profiling_processes = max(1, profiling_processes and int(profiling_processes) or 1)
+
+        http_workers = self._read_env(EnvVarNames.HTTP_WORKERS)
+        self.http_workers = max(1, http_workers and int(http_workers) or 1)
+
+        batch_limits = BatchLimits()
+        max_batch_messages = self._read_env(EnvVarNames.MAX_BATCH_MESSAGES)
+        self.max_batch_messages = max_batch_messages and int(max_batch_messages) or batch_limits.max_messages
+
+        max_batch_bytes = self._read_env(EnvVarNames.MAX_BATCH_BYTES)
+        self.max_batch_bytes = max_batch_bytes and int(max_batch_bytes) or batch_limits.max_bytes
+
+        max_batch_latency_seconds = self._read_env(EnvVarNames.MAX_BATCH_LATENCY_SECONDS)
+        self.max_batch_latency_seconds = (
+            max_batch_latency_seconds and float(max_batch_latency_seconds) or batch_limits.max_latency_seconds
+        )
+
+        batch_idle_seconds = self._read_env(EnvVarNames.BATCH_IDLE_SECONDS)
+        self.batch_idle_seconds = batch_idle_seconds and float(batch_idle_seconds) or batch_limits.idle_seconds
+
+        self.adaptive_batching = self._read_env(EnvVarNames.ADAPTIVE_BATCHING) == "True"
+
+        queue_overflow_policy = self._read_env(EnvVarNames.QUEUE_OVERFLOW_POLICY)
+        self.queue_overflow_policy = (
+            queue_overflow_policy and OverflowPolicy[queue_overflow_policy] or OverflowPolicy.BLOCK
+        )
+
+        queue_overflow_deadline_seconds = self._read_env(EnvVarNames.QUEUE_OVERFLOW_DEADLINE_SECONDS)
+        self.queue_overflow_deadline_seconds = (
+            queue_overflow_deadline_seconds and float(queue_overflow_deadline_seconds) or 30.0
+        )
+
+        self.spill_directory = self._read_env(EnvVarNames.SPILL_DIRECTORY)
+        spill_segment_size_bytes = self._read_env(EnvVarNames.SPILL_SEGMENT_SIZE_BYTES)
+        self.spill_segment_size_bytes = spill_segment_size_bytes and int(spill_segment_size_bytes) or 64 * 1024 * 1024
+        self.durable_queue = self._read_env(EnvVarNames.DURABLE_QUEUE) == "True"
+
+        upload_workers = self._read_env(EnvVarNames.UPLOAD_WORKERS)
+        self.upload_workers = max(1, upload_workers and int(upload_workers) or 4)
+        upload_max_pending = self._read_env(EnvVarNames.UPLOAD_MAX_PENDING)
+        self.upload_max_pending = max(1, upload_max_pending and int(upload_max_pending) or 100)
+        upload_max_attempts = self._read_env(EnvVarNames.UPLOAD_MAX_ATTEMPTS)
+        self.upload_max_attempts = max(1, upload_max_attempts and int(upload_max_attempts) or 5)
+
+        shutdown_deadline_seconds = self._read_env(EnvVarNames.SHUTDOWN_DEADLINE_SECONDS)
+        self.shutdown_deadline_seconds = shutdown_deadline_seconds and float(shutdown_deadline_seconds) or None
+        self.pending_upload_directory = self._read_env(EnvVarNames.PENDING_UPLOAD_DIRECTORY)
+
+        self.checkpoint_directory = self._read_env(EnvVarNames.CHECKPOINT_DIRECTORY)
+        checkpoint_interval_seconds = self._read_env(EnvVarNames.CHECKPOINT_INTERVAL_SECONDS)
+        self.checkpoint_interval_seconds = checkpoint_interval_seconds and float(checkpoint_interval_seconds) or 60.0
+
+        max_loggers = self._read_env(EnvVarNames.MAX_LOGGERS)
+        self.max_loggers = max(1, max_loggers and int(max_loggers) or 1000)
+        logger_idle_seconds = self._read_env(EnvVarNames.LOGGER_IDLE_SECONDS)
+        self.logger_idle_seconds = logger_idle_seconds and float(logger_idle_seconds) or None
+        # Datasets past this many are combined under dataset_id="other" in the metrics, which are published
+        # through a fixed size buffer. Each one takes a few hundred bytes of it.
+        metrics_max_datasets = self._read_env(EnvVarNames.METRICS_MAX_DATASETS)
+        self.metrics_max_datasets = metrics_max_datasets and int(metrics_max_datasets) or 1000
+        # Comma separated dataset ids. Requests for any other dataset are rejected when this is set.
+        dataset_allow_list = self._read_env(EnvVarNames.DATASET_ALLOW_LIST)
+        self.dataset_allow_list = (
+            {it.strip() for it in dataset_allow_list.split(",") if it.strip()} if dataset_allow_list else None
+        )
+        # Parse /log requests in the http process too so that bad ones get a 400 instead of being quarantined later.
+        # The parse runs on the event loop and holds the GIL, so each worker handles fewer requests while it's on.
+        self.validate_log_requests = self._read_env(EnvVarNames.VALIDATE_LOG_REQUESTS) == "True"
+
+        # Shared memory for each profiling process to receive large requests through, or 0 to send everything
+        # through the queue
+        shared_memory_bytes = self._read_env(EnvVarNames.SHARED_MEMORY_BYTES)
+        self.shared_memory_bytes = max(0, shared_memory_bytes and int(shared_memory_bytes) or 0)
+        shared_memory_min_request_bytes = self._read_env(EnvVarNames.SHARED_MEMORY_MIN_REQUEST_BYTES)
+        self.shared_memory_min_request_bytes = (
+            shared_memory_min_request_bytes and int(shared_memory_min_request_bytes) or 256 * 1024
+        )
+
+        self.quarantine_directory = self._read_env(EnvVarNames.QUARANTINE_DIRECTORY)
+        quarantine_max_files = self._read_env(EnvVarNames.QUARANTINE_MAX_FILES)
+        self.quarantine_max_files = quarantine_max_files and int(quarantine_max_files) or 1000
+        # Per profiling process, the bodies are saved as they were received so a few large ones could fill a disk
+        quarantine_max_bytes = self._read_env(EnvVarNames.QUARANTINE_MAX_BYTES)
+        self.quarantine_max_bytes = quarantine_max_bytes and int(quarantine_max_bytes) or 1024 * 1024 * 1024
+
+        # /log requests at least this large, or without a Content-Length, are read and split into chunks of rows
+        # as they arrive instead of all at once. The chunks are staged in a temp file until the whole request has
+        # been read. 0 turns this off.
+        stream_min_request_bytes = self._read_env(EnvVarNames.STREAM_MIN_REQUEST_BYTES)
+        self.stream_min_request_bytes = max(0, stream_min_request_bytes and int(stream_min_request_bytes) or 0)
+        stream_chunk_bytes = self._read_env(EnvVarNames.STREAM_CHUNK_BYTES)
+        self.stream_chunk_bytes = stream_chunk_bytes and int(stream_chunk_bytes) or 8 * 1024 * 1024
+        # Streamed requests that are larger than this once they're decompressed get a 413
+        stream_max_request_bytes = self._read_env(EnvVarNames.STREAM_MAX_REQUEST_BYTES)
+        self.stream_max_request_bytes = (
+            stream_max_request_bytes and int(stream_max_request_bytes) or MAX_DECOMPRESSED_BYTES
+        )
+        # Once a streamed request's first chunk is queued, this much more of it waits for room in the queue instead of
+        # being rejected, so that it isn't only partly logged. Past that it's subject to QUEUE_OVERFLOW_POLICY again.
+        stream_max_forced_bytes = self._read_env(EnvVarNames.STREAM_MAX_FORCED_BYTES)
+        self.stream_max_forced_bytes = max(
+            0, stream_max_forced_bytes and int(stream_max_forced_bytes) or 64 * 1024 * 1024
+        )
+
+        # Bytes per second of requests that each dataset can send before getting 429s, or 0 for no limit. The
+        # per dataset limits are comma separated dataset_id=bytes pairs that override the default.
+        dataset_rate_limit_bytes = self._read_env(EnvVarNames.DATASET_RATE_LIMIT_BYTES)
+        self.dataset_rate_limit_bytes = max(0, dataset_rate_limit_bytes and int(dataset_rate_limit_bytes) or 0)
+        self.dataset_rate_limits = _parse_dataset_values(self._read_env(EnvVarNames.DATASET_RATE_LIMITS))
+        rate_limit_burst_seconds = self._read_env(EnvVarNames.RATE_LIMIT_BURST_SECONDS)
+        self.rate_limit_burst_seconds = rate_limit_burst_seconds and float(rate_limit_burst_seconds) or 2.0
+        # How many messages each profiling process reads ahead so that it can take turns between datasets, or 0 to
+        # process messages in the order they were sent. Weights are comma separated dataset_id=weight pairs, a
+        # dataset gets that many messages per turn and the default is 1.
+        fair_queue_max_messages = self._read_env(EnvVarNames.FAIR_QUEUE_MAX_MESSAGES)
+        self.fair_queue_max_messages = max(0, fair_queue_max_messages and int(fair_queue_max_messages) or 0)
+        fair_queue_max_bytes = self._read_env(EnvVarNames.FAIR_QUEUE_MAX_BYTES)
+        self.fair_queue_max_bytes = fair_queue_max_bytes and int(fair_queue_max_bytes) or 256 * 1024 * 1024
+        self.dataset_weights = _parse_dataset_values(self._read_env(EnvVarNames.DATASET_WEIGHTS))
+
+        if self.spill_directory is None and (self.durable_queue or self.queue_overflow_policy == OverflowPolicy.SPILL):
+            raise Exception(f"{EnvVarNames.SPILL_DIRECTORY.name} is required for durable mode and the SPILL policy")
+
     def auth_disabled(self) -> bool:
         return self.disable_container_password
 
@@ -92,6 +325,24 @@ class ContainerConfig:
             return None
 
 
+def _parse_dataset_values(value: Optional[str]) -> Dict[str, int]:
+    """
+    Parse comma separated dataset_id=number pairs.
+    """
+    if not value:
+        return {}
+
+    result: Dict[str, int] = {}
+    for pair in value.split(","):
+        if not pair.strip():
+            continue
+        dataset_id, _, number = pair.rpartition("=")
+        if not dataset_id.strip():
+            raise Exception(f"Expected dataset_id=number, got {pair}")
+        result[dataset_id.strip()] = int(number)
+    return result
+
+
 def _load_custom_options() -> Optional[Dict[str, DatasetOptions]]:
     config = ContainerConfig()
     try:
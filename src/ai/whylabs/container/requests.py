@@ -1,4 +1,4 @@
-from typing import List, Optional, Union
+from typing import List, Literal, Optional, Union
 
 from pydantic import BaseModel, Field
 
@@ -8,6 +8,12 @@ DataTypes = Union[str, int, float, bool, List[float], List[int], List[str]]
 class LogMultiple(BaseModel):
     columns: List[str]
     data: List[List[DataTypes]]
+    # With "columns", data contains a list of values for each column instead of a list of rows. This is much cheaper
+    # to profile for large requests.
+    orient: Optional[Literal["rows", "columns"]]
+    # The column with each row's epoch millisecond timestamp, for requests with data from more than one hour or day.
+    # Each row is profiled in its own time bucket instead of the request's, and this column isn't profiled.
+    timestamp_column: Optional[str] = Field(None, alias="timestampColumn")
 
 
 class LogRequest(BaseModel):
@@ -1,11 +1,41 @@
+import importlib.util
 import logging
+import math
+import os
+import shutil
+import struct
+import tempfile
+import uuid
+from typing import Iterator, List, Optional, Tuple, cast
 
-from fastapi import Depends, FastAPI, Request
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse
 from faster_fifo import Queue
 
 from .config import ContainerConfig
+from ...util.compression_util import DecompressedSizeError, StreamDecompressor, supported_encodings
+from ...util.metrics import PROMETHEUS_CONTENT_TYPE, render_prometheus
+from ...util.rate_limit import RateLimiter
 from ...util.time import current_time_ms
+from ..actor.overflow import QueueFullError
+from ..actor.actor_pool import ActorPool
 from ..actor.profile_actor import DebugMessage, ProfileActor, PublishMessage, RawLogMessage, RawLogEmbeddingsMessage
+from ..actor.checkpoints import Checkpoints
+from ..actor.pending_uploads import PendingUploads
+from ..actor.quarantine import Quarantine
+from ..actor.row_chunker import RowChunker
+from ..actor.shared_arena import SharedArena
+from ..actor.spill_queue import SpillQueue
+from ..actor.profile_actor_messages import (
+    ARROW_STREAM_CONTENT_TYPE,
+    NPZ_CONTENT_TYPE,
+    InvalidRequestError,
+    PARQUET_CONTENT_TYPES,
+    RawLogArrowMessage,
+    get_message_dataset_id,
+    peek_dataset_id,
+)
 from .auth import Auth
 from .requests import LogRequest
 
@@ -15,21 +45,448 @@ logger = logging.getLogger("routes")
 app = FastAPI()
 auth = Auth()
 _DEFAULT_QUEUE_SIZE_BYTES = 1000 * 1000 * 1000
-actor = ProfileActor(Queue(_DEFAULT_QUEUE_SIZE_BYTES))
 config = ContainerConfig()
+# The number of profiling processes that the spill queues were written for
+_SPILL_SHARDS_FILE = "shards"
+_RESHARDING_PREFIX = "resharding-"
+
+
+def _set_aside_spill_queues() -> List[str]:
+    """
+    Spill queues are per profiling process, so if PROFILING_PROCESSES changed since they were written they're
+    moved out of the way. Their messages are rerouted to the process that owns their dataset now instead of
+    being replayed by whichever one has the same shard number, which would give the dataset a second owner.
+    Returns the directories to reroute, including any left from a restart in the middle of rerouting.
+    """
+    if config.spill_directory is None:
+        return []
+
+    os.makedirs(config.spill_directory, exist_ok=True)
+    shards_path = os.path.join(config.spill_directory, _SPILL_SHARDS_FILE)
+    try:
+        with open(shards_path, "r") as f:
+            shards: Optional[int] = int(f.read())
+    except FileNotFoundError:
+        shards = None
+
+    if shards != config.profiling_processes:
+        for name in os.listdir(config.spill_directory):
+            if name.startswith("shard-"):
+                os.rename(
+                    os.path.join(config.spill_directory, name),
+                    os.path.join(config.spill_directory, f"{_RESHARDING_PREFIX}{uuid.uuid4().hex}"),
+                )
+        tmp_path = f"{shards_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(config.profiling_processes))
+        os.replace(tmp_path, shards_path)
+
+    return [
+        os.path.join(config.spill_directory, it)
+        for it in sorted(os.listdir(config.spill_directory))
+        if it.startswith(_RESHARDING_PREFIX)
+    ]
+
+
+def _reroute_spill_queues(directories: List[str]) -> None:
+    for directory in directories:
+        moved = actor_pool.reroute_spilled(SpillQueue(directory, config.spill_segment_size_bytes))
+        shutil.rmtree(directory)
+        logger.info(f"Rerouted {moved} spilled messages from {directory} after the number of processes changed")
+
+
+def _create_spill_queue(shard: int) -> Optional[SpillQueue]:
+    if config.spill_directory is None:
+        return None
+    return SpillQueue(os.path.join(config.spill_directory, f"shard-{shard}"), config.spill_segment_size_bytes)
+
+
+def _create_pending_uploads(shard: int) -> Optional[PendingUploads]:
+    if config.pending_upload_directory is None:
+        return None
+    return PendingUploads(os.path.join(config.pending_upload_directory, f"shard-{shard}"))
+
+
+def _create_checkpoints(shard: int) -> Optional[Checkpoints]:
+    if config.checkpoint_directory is None:
+        return None
+    return Checkpoints(os.path.join(config.checkpoint_directory, f"shard-{shard}"))
+
+
+def _create_quarantine(shard: int) -> Optional[Quarantine]:
+    if config.quarantine_directory is None:
+        return None
+    return Quarantine(
+        os.path.join(config.quarantine_directory, f"shard-{shard}"),
+        config.quarantine_max_files,
+        config.quarantine_max_bytes,
+    )
+
+
+def _create_shared_arena() -> Optional[SharedArena]:
+    if config.shared_memory_bytes == 0:
+        return None
+    return SharedArena(config.shared_memory_bytes // config.profiling_processes)
+
+
+_resharded_spill_queues = _set_aside_spill_queues()
+# Each process gets an equal share of the queue memory
+actor_pool = ActorPool(
+    [
+        ProfileActor(
+            Queue(_DEFAULT_QUEUE_SIZE_BYTES // config.profiling_processes),
+            config,
+            _create_spill_queue(i),
+            _create_pending_uploads(i),
+            _create_checkpoints(i),
+            _create_shared_arena(),
+            _create_quarantine(i),
+        )
+        for i in range(config.profiling_processes)
+    ],
+    shard_key=get_message_dataset_id,
+)
+_reroute_spill_queues(_resharded_spill_queues)
 auth_dependencies = [Depends(auth.api_key_auth)] if not config.auth_disabled() else []
+_arrow_installed = importlib.util.find_spec("pyarrow") is not None
+_supported_encodings = supported_encodings()
+
+
+def _dataset_rate(dataset_id: object) -> float:
+    return config.dataset_rate_limits.get(cast(str, dataset_id), config.dataset_rate_limit_bytes)
+
+
+# Created before the http workers fork so that they all take from the same buckets
+_rate_limiter = RateLimiter(_dataset_rate, config.rate_limit_burst_seconds)
+_rate_limited = config.dataset_rate_limit_bytes > 0 or any(it > 0 for it in config.dataset_rate_limits.values())
+
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, e: QueueFullError) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(e)},
+        headers={"Retry-After": "1"},
+    )
+
+
+def _get_content_type(request: Request) -> str:
+    return request.headers.get("content-type", "").split(";")[0].strip()
+
+
+def _get_content_encoding(request: Request) -> Optional[str]:
+    """
+    The request's Content-Encoding, or None if it isn't compressed. Compressed bodies are passed to the
+    profiling processes as they are and only decompressed there.
+    """
+    encoding = request.headers.get("content-encoding", "").strip().lower()
+    if encoding == "" or encoding == "identity":
+        return None
+
+    if encoding not in _supported_encodings:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=f"Unsupported content encoding {encoding}"
+        )
+    return encoding
+
+
+def _peek_dataset_id(request: bytes, content_encoding: Optional[str]) -> Optional[str]:
+    try:
+        return peek_dataset_id(request, content_encoding)
+    except Exception as e:
+        logger.warning(f"Couldn't decompress {content_encoding} request: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=f"Couldn't decompress {content_encoding} request"
+        )
+
+
+def _check_dataset_allowed(message: object) -> None:
+    """
+    Reject requests for datasets that aren't in the allow list, if there is one. This only peeks at the dataset
+    id so that unknown datasets never make it to the profiling processes.
+    """
+    if config.dataset_allow_list is None:
+        return
+
+    dataset_id = get_message_dataset_id(message)
+    if dataset_id not in config.dataset_allow_list:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Dataset {dataset_id} isn't allowed")
+
+
+def _check_rate_limit(message: object, size_bytes: int, force: bool = False) -> None:
+    """
+    Reject requests from datasets that are sending more than their share, so that one of them can't fill up the
+    queue that every dataset shares. force counts the request against the limit without rejecting it.
+    """
+    if not _rate_limited:
+        return
+
+    dataset_id = get_message_dataset_id(message)
+    wait_seconds = _rate_limiter.take(dataset_id, size_bytes, force)
+    if wait_seconds > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Dataset {dataset_id} is over its rate limit",
+            headers={"Retry-After": str(math.ceil(wait_seconds))},
+        )
+
+
+def _validate(message: RawLogMessage) -> None:
+    """
+    Run the same checks that the profiling process does, if VALIDATE_LOG_REQUESTS is on. This parses the whole
+    request, so it's a trade off between http throughput and telling clients about bad requests right away.
+    """
+    if not config.validate_log_requests:
+        return
+
+    try:
+        message.to_log_request_dict()
+    except InvalidRequestError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{e.reason}: {e}")
+
+
+def _should_stream(request: Request) -> bool:
+    if config.stream_min_request_bytes == 0:
+        return False
+    content_length = request.headers.get("content-length")
+    if content_length is None:
+        return True
+
+    try:
+        return int(content_length) >= config.stream_min_request_bytes
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid Content-Length {content_length}")
+
+
+# Length and row count of each chunk of rows staged by _StagedStream
+_STAGED_HEADER = struct.Struct("<QQ")
+# Network reads are collected until there's this much before they're handed to a worker thread
+_STREAM_READ_BYTES = 1024 * 1024
+
+
+class _StagedStream:
+    """
+    A streamed /log request split into chunks of rows and staged in a temp file. Splitting the rows is pure
+    python, so feed and close are run in a worker thread instead of on the event loop.
+    """
+
+    def __init__(self, content_encoding: Optional[str]) -> None:
+        self.content_encoding = content_encoding
+        self.request_time = current_time_ms()
+        self.max_bytes = config.stream_max_request_bytes
+        self.dataset_id: Optional[str] = None
+        self.chunks = 0
+        self._chunker = RowChunker(config.stream_chunk_bytes)
+        self._decompressor = (
+            StreamDecompressor(content_encoding, self.max_bytes) if content_encoding is not None else None
+        )
+        self._received_bytes = 0
+        self._file = tempfile.TemporaryFile()
+
+    def feed(self, pieces: List[bytes]) -> None:
+        for data in pieces:
+            if self._decompressor is None:
+                self._received_bytes += len(data)
+                if self._received_bytes > self.max_bytes:
+                    raise self._too_large()
+                self._stage(self._chunker.feed(data))
+                continue
+
+            try:
+                for piece in self._decompressor.decompress(data):
+                    self._stage(self._chunker.feed(piece))
+            except DecompressedSizeError:
+                raise self._too_large()
+            except (InvalidRequestError, HTTPException):
+                raise
+            except Exception as e:
+                logger.warning(f"Couldn't decompress {self.content_encoding} request: {e}")
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Couldn't decompress {self.content_encoding} request",
+                )
+
+    def close(self) -> None:
+        self._stage(self._chunker.close())
+
+    def _stage(self, chunks: List[bytes]) -> None:
+        for chunk in chunks:
+            message = RawLogMessage(request=chunk, request_time=self.request_time, dataset_id=peek_dataset_id(chunk))
+            if self.chunks == 0:
+                # Later chunks are for the same dataset and the request was already let in
+                _check_dataset_allowed(message)
+                self.dataset_id = message.dataset_id
+            _check_rate_limit(message, len(chunk), force=self.chunks > 0)
+            _validate(message)
+            self._file.write(_STAGED_HEADER.pack(len(chunk), self._chunker.chunk_rows[self.chunks]))
+            self._file.write(chunk)
+            self.chunks += 1
+
+    def read(self) -> Iterator[Tuple[RawLogMessage, int]]:
+        """
+        The staged chunks and how many rows each one has.
+        """
+        self._file.seek(0)
+        for _ in range(self.chunks):
+            length, rows = _STAGED_HEADER.unpack(self._file.read(_STAGED_HEADER.size))
+            message = RawLogMessage(
+                request=self._file.read(length), request_time=self.request_time, dataset_id=self.dataset_id
+            )
+            yield message, rows
+
+    def discard(self) -> None:
+        self._file.close()
+
+    def _too_large(self) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Request is larger than {self.max_bytes} bytes",
+        )
+
+
+async def _stream_log(request: Request, content_encoding: Optional[str]) -> None:
+    """
+    Log a large request a chunk of rows at a time as it's read, so that neither this process nor the profiling
+    process ever has all of it in memory. The chunks all have the same request time, so they end up in the same
+    profile as they would have if the request was logged at once.
+
+    The chunks are staged in a temp file and only sent once the whole body has been read and checked. Then a
+    request that fails part way through hasn't logged any of its rows, and retrying it doesn't log them twice.
+    Only the first STREAM_MAX_FORCED_BYTES of it are sent no matter how full the queue is though. If the queue
+    turns the rest away the 503 says how many rows were logged.
+    """
+    staged = _StagedStream(content_encoding)
+    try:
+        try:
+            pieces: List[bytes] = []
+            pieces_bytes = 0
+            async for data in request.stream():
+                pieces.append(data)
+                pieces_bytes += len(data)
+                if pieces_bytes >= _STREAM_READ_BYTES:
+                    await run_in_threadpool(staged.feed, pieces)
+                    pieces = []
+                    pieces_bytes = 0
+            await run_in_threadpool(staged.feed, pieces)
+            await run_in_threadpool(staged.close)
+        except InvalidRequestError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{e.reason}: {e}")
+
+        await _send_staged(staged)
+    finally:
+        staged.discard()
+
+
+async def _send_staged(staged: _StagedStream) -> None:
+    logged_rows = 0
+    forced_bytes = 0
+    for i, (message, rows) in enumerate(staged.read()):
+        # The first chunk can still be turned away, but once it's queued the rest follow it, up to a limit
+        force = i > 0 and forced_bytes + len(message.request) <= config.stream_max_forced_bytes
+        if force:
+            forced_bytes += len(message.request)
+        try:
+            await actor_pool.send(message, force=force)
+        except QueueFullError as e:
+            if i == 0:
+                raise
+            raise QueueFullError(f"{e}. Only the first {logged_rows} rows of the request were logged.")
+        logged_rows += rows
 
 
 @app.post("/log", dependencies=auth_dependencies)
 async def log(_raw_request: Request) -> None:
+    content_encoding = _get_content_encoding(_raw_request)
+    if _should_stream(_raw_request):
+        await _stream_log(_raw_request, content_encoding)
+        return
+
     b: bytes = await _raw_request.body()
-    await actor.send(RawLogMessage(request=b, request_time=current_time_ms()))
+    # Peeking once here means neither the allow list nor the actor pool has to decompress the body again
+    message = RawLogMessage(
+        request=b,
+        request_time=current_time_ms(),
+        content_encoding=content_encoding,
+        dataset_id=_peek_dataset_id(b, content_encoding),
+    )
+    _check_dataset_allowed(message)
+    _check_rate_limit(message, len(b))
+    _validate(message)
+    await actor_pool.send(message)
 
 
 @app.post("/log-embeddings", dependencies=auth_dependencies)
-async def log_embeddings(_raw_request: Request) -> None:
+async def log_embeddings(
+    _raw_request: Request, dataset_id: Optional[str] = Query(None, alias="datasetId"), timestamp: Optional[int] = None
+) -> None:
+    """
+    Log embeddings as json or as a .npz file (application/x-npz) with one 2d array per column. The npz format
+    is much cheaper to produce and profile for large vectors. The dataset id and timestamp are passed as query
+    parameters when using npz.
+    """
+    content_type = _get_content_type(_raw_request)
+    if content_type == NPZ_CONTENT_TYPE and dataset_id is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="datasetId is required for npz requests")
+
+    content_encoding = _get_content_encoding(_raw_request)
     b: bytes = await _raw_request.body()
-    await actor.send(RawLogEmbeddingsMessage(request=b, request_time=current_time_ms()))
+    if content_type != NPZ_CONTENT_TYPE:
+        # Json requests are logged under the dataset id in the body, so that's the one they're routed by too
+        body_dataset_id = _peek_dataset_id(b, content_encoding)
+        if dataset_id is not None and dataset_id != body_dataset_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"datasetId {dataset_id} doesn't match the request's datasetId {body_dataset_id}",
+            )
+        dataset_id = body_dataset_id
+
+    message = RawLogEmbeddingsMessage(
+        request=b,
+        request_time=current_time_ms(),
+        dataset_id=dataset_id,
+        timestamp=timestamp,
+        content_type=NPZ_CONTENT_TYPE if content_type == NPZ_CONTENT_TYPE else "application/json",
+        content_encoding=content_encoding,
+    )
+    _check_dataset_allowed(message)
+    _check_rate_limit(message, len(b))
+    await actor_pool.send(message)
+
+
+@app.post("/log-arrow", dependencies=auth_dependencies)
+async def log_arrow(
+    _raw_request: Request, dataset_id: str = Query(alias="datasetId"), timestamp: Optional[int] = None
+) -> None:
+    """
+    Log an Arrow IPC stream (application/vnd.apache.arrow.stream) or a Parquet file (application/vnd.apache.parquet)
+    without converting it to json first. The dataset id and timestamp are passed as query parameters.
+    """
+    if not _arrow_installed:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="pyarrow isn't installed")
+
+    content_type = _get_content_type(_raw_request)
+    if content_type != ARROW_STREAM_CONTENT_TYPE and content_type not in PARQUET_CONTENT_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=f"Unsupported content type {content_type}"
+        )
+
+    if _get_content_encoding(_raw_request) is not None:
+        # Parquet is already compressed and arrow streams can use their own compression
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Arrow requests can't use a content encoding"
+        )
+
+    b: bytes = await _raw_request.body()
+    message = RawLogArrowMessage(
+        request=b,
+        request_time=current_time_ms(),
+        dataset_id=dataset_id,
+        timestamp=timestamp,
+        content_type=content_type,
+    )
+    _check_dataset_allowed(message)
+    _check_rate_limit(message, len(b))
+    await actor_pool.send(message)
 
 
 @app.post("/log_docs", dependencies=auth_dependencies)
@@ -45,7 +502,7 @@ async def log_docs(body: LogRequest, _raw_request: Request) -> None:
 
 @app.post("/publish", dependencies=auth_dependencies)
 async def publish_profiles() -> None:
-    await actor.send(PublishMessage())
+    await actor_pool.broadcast(PublishMessage())
 
 
 @app.post("/health", dependencies=auth_dependencies)
@@ -55,12 +512,24 @@ async def health() -> None:
     pass
 
 
+@app.get("/metrics", dependencies=auth_dependencies)
+async def metrics() -> PlainTextResponse:
+    """
+    Metrics in the Prometheus text format. The profiling processes publish theirs to shared memory so
+    this doesn't wait on them.
+    """
+    text = render_prometheus(actor_pool.collect_metrics(), namespace="whylogs_container")
+    return PlainTextResponse(text, media_type=PROMETHEUS_CONTENT_TYPE)
+
+
 @app.post("/logDebugInfo", dependencies=auth_dependencies)
 async def log_debug_info() -> None:
-    await actor.send(DebugMessage())
+    logger.info(f"Queue overflow stats {actor_pool.send_stats()} with {actor_pool.qsize()} messages queued")
+    await actor_pool.broadcast(DebugMessage())
 
 
 @app.on_event("shutdown")
 async def shutdown() -> None:
     logger.info("Shutting down web server")
-    await actor.shutdown()
+    if actor_pool.is_owner():
+        await actor_pool.shutdown()
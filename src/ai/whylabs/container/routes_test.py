@@ -0,0 +1,188 @@
+import asyncio
+import gzip
+import os
+from typing import Any, Coroutine, List, Optional, Tuple
+
+import orjson
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from ..actor.overflow import QueueFullError
+from ..actor.profile_actor_messages import RawLogEmbeddingsMessage, RawLogMessage
+from . import routes
+
+
+def _request(body: bytes, headers: Optional[List[Tuple[bytes, bytes]]] = None) -> Request:
+    async def receive() -> Any:
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request({"type": "http", "method": "POST", "headers": headers or []}, receive)
+
+
+def _queued() -> List[Any]:
+    """
+    Everything that was sent to the profiling processes, which aren't running in these tests.
+    """
+    messages: List[Any] = []
+    for actor in routes.actor_pool.actors:
+        while actor.queue.qsize() > 0:
+            messages += actor.queue.get_many(block=False)
+    return messages
+
+
+@pytest.fixture(autouse=True)
+def _empty_queues() -> None:
+    _queued()
+
+
+def _status(coroutine: Coroutine[Any, Any, None]) -> int:
+    return _response(coroutine)[0]
+
+
+def _response(coroutine: Coroutine[Any, Any, None]) -> Tuple[int, Any]:
+    try:
+        asyncio.run(coroutine)
+    except HTTPException as e:
+        return e.status_code, e.detail
+    return 200, None
+
+
+def _embeddings(dataset_id: str) -> bytes:
+    return orjson.dumps({"datasetId": dataset_id, "embeddings": {"a": [[1.0, 2.0]]}})
+
+
+def _log_body(dataset_id: str) -> bytes:
+    return orjson.dumps({"datasetId": dataset_id, "data": {"columns": ["a"], "data": [[1]]}})
+
+
+def test_log_embeddings_routes_by_body() -> None:
+    asyncio.run(routes.log_embeddings(_request(_embeddings("model-1")), dataset_id=None, timestamp=None))
+    asyncio.run(routes.log_embeddings(_request(_embeddings("model-1")), dataset_id="model-1", timestamp=None))
+
+    queued = _queued()
+    assert [type(it) for it in queued] == [RawLogEmbeddingsMessage] * 2
+    assert [it.dataset_id for it in queued] == ["model-1", "model-1"]
+
+
+def test_log_embeddings_mismatched_dataset_id() -> None:
+    request = _request(_embeddings("model-2"))
+    assert _status(routes.log_embeddings(request, dataset_id="model-1", timestamp=None)) == 400
+    assert _queued() == []
+
+
+def test_dataset_allow_list(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(routes.config, "dataset_allow_list", {"model-1"})
+
+    assert _status(routes.log(_request(_log_body("model-2")))) == 403
+    assert _status(routes.log_embeddings(_request(_embeddings("model-2")), dataset_id=None, timestamp=None)) == 403
+    assert _queued() == []
+
+    assert _status(routes.log(_request(_log_body("model-1")))) == 200
+    assert [it.dataset_id for it in _queued()] == ["model-1"]
+
+
+def test_validate_log_requests(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(routes.config, "validate_log_requests", True)
+    bad = orjson.dumps({"datasetId": "model-1", "data": {"columns": ["a", "b"], "data": [[1]]}})
+
+    status, detail = _response(routes.log(_request(bad)))
+    assert status == 400
+    assert detail.startswith("invalid_shape: ")
+    assert _queued() == []
+
+    assert _status(routes.log(_request(_log_body("model-1")))) == 200
+    assert [it.request for it in _queued()] == [_log_body("model-1")]
+
+
+def _stream(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(routes.config, "stream_min_request_bytes", 1)
+    monkeypatch.setattr(routes.config, "stream_chunk_bytes", 10)
+
+
+def test_stream_log(monkeypatch: pytest.MonkeyPatch) -> None:
+    _stream(monkeypatch)
+    rows = [[i] for i in range(5)]
+    body = orjson.dumps({"datasetId": "model-1", "data": {"columns": ["a"], "data": rows}})
+
+    assert _status(routes.log(_request(body))) == 200
+    queued = _queued()
+    assert len(queued) > 1
+    assert [it.dataset_id for it in queued] == ["model-1"] * len(queued)
+    assert [row for it in queued for row in orjson.loads(it.request)["data"]["data"]] == rows
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        # Fails after some of the rows have been split into chunks
+        b'{"datasetId": "model-1", "data": {"columns": ["a"], "data": [[1], [2], [3]]}, "timestamp": 5}',
+        b'{"datasetId": "model-1", "data": {"columns": ["a"], "data": [[1], [2], [3], [',
+    ],
+)
+def test_stream_log_failure_sends_nothing(monkeypatch: pytest.MonkeyPatch, body: bytes) -> None:
+    _stream(monkeypatch)
+    assert _status(routes.log(_request(body))) == 400
+    assert _queued() == []
+
+
+def test_stream_log_invalid_content_length(monkeypatch: pytest.MonkeyPatch) -> None:
+    _stream(monkeypatch)
+    request = _request(_log_body("model-1"), headers=[(b"content-length", b"lots")])
+    assert _status(routes.log(request)) == 400
+
+
+def test_stream_log_too_large(monkeypatch: pytest.MonkeyPatch) -> None:
+    _stream(monkeypatch)
+    monkeypatch.setattr(routes.config, "stream_max_request_bytes", 1024)
+    rows = [[0]] * 1000
+    body = orjson.dumps({"datasetId": "model-1", "data": {"columns": ["a"], "data": rows}})
+
+    assert _status(routes.log(_request(body))) == 413
+    compressed = gzip.compress(body)
+    assert len(compressed) < 1024
+    assert _status(routes.log(_request(compressed, headers=[(b"content-encoding", b"gzip")]))) == 413
+    assert _queued() == []
+
+
+def test_stream_log_forced_bytes(monkeypatch: pytest.MonkeyPatch) -> None:
+    _stream(monkeypatch)
+    sent: List[Tuple[int, bool]] = []
+
+    async def send(message: RawLogMessage, force: bool = False) -> None:
+        if sent and not force:
+            raise QueueFullError("Message queue full")
+        sent.append((len(orjson.loads(message.request)["data"]["data"]), force))
+
+    monkeypatch.setattr(routes.actor_pool, "send", send)
+    body = orjson.dumps({"datasetId": "model-1", "data": {"columns": ["a"], "data": [[i] for i in range(10)]}})
+    # Chunks of 3 rows, the last one has the 10th row
+    chunk = len(orjson.dumps({"datasetId": "model-1", "data": {"columns": ["a"], "data": [[0], [1], [2]]}}))
+    monkeypatch.setattr(routes.config, "stream_max_forced_bytes", chunk * 2)
+
+    try:
+        asyncio.run(routes.log(_request(body)))
+        raise AssertionError("Expected the queue to be full")
+    except QueueFullError as e:
+        assert str(e) == "Message queue full. Only the first 9 rows of the request were logged."
+    # The first chunk goes through normally and the next two are forced
+    assert sent == [(3, False), (3, True), (3, True)]
+
+
+def test_set_aside_spill_queues(monkeypatch: pytest.MonkeyPatch, tmp_path: str) -> None:
+    monkeypatch.setattr(routes.config, "spill_directory", str(tmp_path))
+    monkeypatch.setattr(routes.config, "profiling_processes", 2)
+    os.makedirs(os.path.join(tmp_path, "shard-0"))
+
+    # Queues from before the number of processes was known are rerouted too
+    [directory] = routes._set_aside_spill_queues()
+    assert os.path.basename(directory).startswith("resharding-")
+    assert not os.path.exists(os.path.join(tmp_path, "shard-0"))
+
+    # They're still returned until they've been rerouted, but the new queues are left alone
+    os.makedirs(os.path.join(tmp_path, "shard-0"))
+    assert routes._set_aside_spill_queues() == [directory]
+    assert os.path.exists(os.path.join(tmp_path, "shard-0"))
+
+    monkeypatch.setattr(routes.config, "profiling_processes", 3)
+    assert len(routes._set_aside_spill_queues()) == 2
@@ -19,27 +19,95 @@ def init_logging() -> None:
 init_logging()
 
 
-from ..actor.actor import Actor
-from .routes import actor
+import asyncio
+import os
+import signal
+import socket
+import time
+from types import FrameType
+from typing import List, Optional
 
+from ..actor.actor_pool import ActorPool
+from .routes import actor_pool, config as container_config
 
-def update_pid(act: Actor) -> None:
-    logger.info(f"Profiling process pid {actor.pid}")
+
+def update_pid(pool: ActorPool) -> None:
+    pids = pool.pids()
+    logger.info(f"Profiling process pids {pids}")
     with open("/tmp/profiling_pid", "w") as f:
-        f.write(str(act.pid))
+        f.write("\n".join(str(pid) for pid in pids))
+
+
+def _start_worker(config: uvicorn.Config, sock: socket.socket) -> int:
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    # Leave signals from the terminal to the parent. It forwards them exactly once, uvicorn treats a second
+    # signal as a request to exit without draining in flight requests.
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        uvicorn.Server(config).run(sockets=[sock])
+    finally:
+        os._exit(0)
+
+
+def run_workers(config: uvicorn.Config, workers: int) -> None:
+    """
+    Run several http worker processes that accept connections from the same socket. The actor pool has
+    to be started before this so that every worker inherits its queues. The workers only send messages
+    to the pool, this process shuts it down once all of the workers have exited.
+    """
+    sock = config.bind_socket()
+    pids: List[int] = [_start_worker(config, sock) for _ in range(workers)]
+    logger.info(f"Http worker pids {pids}")
+    stopping = False
+
+    def stop(signum: int, frame: Optional[FrameType]) -> None:
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        logger.info(f"Stopping {len(pids)} http workers")
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while pids:
+        time.sleep(0.5)
+        for pid in list(pids):
+            exited_pid, status = os.waitpid(pid, os.WNOHANG)
+            if exited_pid == 0:
+                continue
+            pids.remove(pid)
+            if not stopping:
+                logger.warning(f"Http worker {pid} exited with status {status}, starting a new one")
+                pids.append(_start_worker(config, sock))
+
+    sock.close()
+    asyncio.run(actor_pool.shutdown())
 
 
 if __name__ == "__main__":
     logger = logging.getLogger("startup")
 
-    actor.daemon = True
-    actor.start()
-    actor.join(0.1)
-    update_pid(actor)
+    actor_pool.start()
+    update_pid(actor_pool)
 
+    workers = container_config.http_workers
     config = uvicorn.Config(
-        "ai.whylabs.container.routes:app", host="0.0.0.0", port=8000, reload=True, log_level=logging.WARN
+        "ai.whylabs.container.routes:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=workers == 1,
+        log_level=logging.WARN,
     )
-    server = uvicorn.Server(config)
     logger.info("Visit http://localhost:8000/docs")
-    server.run()
+    if workers == 1:
+        uvicorn.Server(config).run()
+    else:
+        run_workers(config, workers)